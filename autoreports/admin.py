@@ -117,7 +117,7 @@ class ReportAdmin(ReportApi):
     def report_list(self, request, extra_context=None):
         "The 'change list' admin view for this model."
         cl_options = {}
-        cl_options['list_display'] = ('name', )
+        cl_options['list_display'] = ('name', 'column_count', 'filter_count', 'last_run')
         cl_options['list_display_links'] = tuple()
         cl_options['list_filter'] = tuple()
         cl_options['date_hierarchy'] = None
@@ -134,9 +134,9 @@ class ReportAdmin(ReportApi):
         app_label = opts.app_label
         content_type = ContentType.objects.get_for_model(self.model)
         cl = context['cl']
-        cl.query_set = cl.query_set.filter(content_type=content_type)
+        cl.query_set = cl.query_set.filter(content_type=content_type).defer('options')
         cl.result_list = cl.query_set._clone()
-        cl.result_count = len(cl.result_list)
+        cl.result_count = cl.result_list.count()
         context['cl'] = cl
         return render_to_response(getattr(self, 'change_report_list_template', None) or [
             'autoreports/admin/%s/%s/report_list.html' % (app_label, opts.object_name.lower()),
@@ -195,6 +195,9 @@ class ReportAdmin(ReportApi):
         context.update(extra_context)
         return super(ReportAdmin, self).report(request, report, self.queryset(request), template_name, context)
 
+    def get_export_queryset(self, request):
+        return self.queryset(request)
+
     def report_quick(self, request):
         fields = list(getattr(self, 'list_display', ('__unicode__', )))
         filters = Q()
@@ -227,7 +230,8 @@ class ReportAdmin(ReportApi):
         return reports_view(request, self.model._meta.app_label, self.model._meta.module_name,
                             fields=fields, list_headers=None, ordering=ordering, filters=filters,
                             api=self, queryset=queryset,
-                            report_to='csv')
+                            report_to='csv', streaming=self.export_streaming,
+                            chunk_size=self.export_chunk_size)
 
     def delete_report(self, request, report_id):
         report = get_object_or_404(Report, id=report_id)
@@ -16,18 +16,24 @@
 from django.conf import settings
 from django.contrib.admin import ModelAdmin
 from django.contrib.contenttypes.models import ContentType
-from django.http import HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect
 from django.shortcuts import render_to_response
 from django.template import RequestContext
+from django.utils import simplejson
 from django.utils.datastructures import SortedDict
+from django.utils.translation import ugettext as _
 
 
 from autoreports.forms import ReportFilterForm, ReportDisplayForm
+from autoreports.jobs import is_async_export
 from autoreports.models import Report
-from autoreports.model_forms import modelform_factory
+from autoreports.model_forms import reportform_factory
+from autoreports.preflight import (check_export, has_export_limits,
+                                   EXPORT_ASYNC, EXPORT_REFUSED)
 from autoreports.utils import (get_fields_from_model, get_available_formats,
                                get_field_from_model, get_adaptor, EXCLUDE_FIELDS,
-                               get_adaptors_from_report, get_ordered_fields)
+                               get_adaptors_from_report, get_compiled_report,
+                               is_multivalued_lookup)
 from autoreports.wizards import ReportNameForm, ModelFieldForm, WizardField
 
 
@@ -40,6 +46,12 @@ class ReportApi(object):
     category = 'no_category'
     category_verbosename = None
     is_admin = False
+    export_streaming = None
+    export_chunk_size = None
+    export_async = None
+    export_max_rows = None
+    export_async_rows = None
+    export_processes = None
 
     EXCLUDE_FIELDS = EXCLUDE_FIELDS
 
@@ -52,29 +64,36 @@ class ReportApi(object):
         self.verbose_name = getattr(self, 'verbose_name', self.__class__.__name__)
 
     def get_report_form_filter(self, data, fields):
-        form_filter_class = modelform_factory(model=self.model,
-                                              form=self.report_form_filter)
-        form_filter_class.base_fields = fields
+        form_filter_class = reportform_factory(self.model, self.report_form_filter, fields)
         form_filter = form_filter_class(data=data, is_admin=self.is_admin)
         return form_filter
 
     def get_report_form_display(self, data, fields):
-        form_display_class = modelform_factory(model=self.model,
-                                               form=self.report_form_display)
-        form_display_class.base_fields = fields
+        form_display_class = reportform_factory(self.model, self.report_form_display, fields)
         form_display = form_display_class(data=data, is_admin=self.is_admin)
         return form_display
 
-    def get_report(self, request, queryset, form_filter, form_display, report, submit):
-        queryset = queryset or self.model.objects.all()
+    def get_report(self, request, queryset, form_filter, form_display, report, submit, background=False):
+        if background or (is_async_export(self) and request.GET.get('__report_async', None)):
+            job = form_filter.get_report_job(request, form_display, report, submit, api=self)
+            return HttpResponseRedirect(job.get_absolute_url())
+        if queryset is None:
+            queryset = self.get_export_queryset(request)
         return form_filter.get_report(request, queryset, form_display, report, submit, api=self)
 
+    def get_report_estimate(self, request, queryset, form_filter, form_display, report, submit):
+        if queryset is None:
+            queryset = self.get_export_queryset(request)
+        return form_filter.get_report_estimate(request, queryset, form_display, report, submit, api=self)
+
+    def get_export_queryset(self, request):
+        return self.model.objects.all()
+
     def get_fields_of_form(self, report=None):
         fields_form_filter = SortedDict({})
         fields_form_display = SortedDict({})
         if report and report.options:
-            report_options_order = get_ordered_fields(report)
-            for field_name, opts in report_options_order:
+            for field_name, opts in get_compiled_report(report).fields:
                 fields_form_filter, fields_form_display = self.get_field_of_form(field_name, opts,
                                                                fields_form_filter=fields_form_filter,
                                                                fields_form_display=fields_form_display)
@@ -102,6 +121,7 @@ class ReportApi(object):
         query_filter = '\n%s.objects' % model_name
         filter_or = None
         filters = {}
+        lookups = []
         for fil, value in _adavanced_filters.items():
             if isinstance(value, list) and len(value) > 0 and isinstance(value[0], dict):
                 filter_or = ''
@@ -109,19 +129,27 @@ class ReportApi(object):
                     if filter_or:
                         filter_or += ' | '
                     filter_or += 'Q(**%s)' % unicode(item)
+                    lookups.extend(item.keys())
                 query_filter += '.filter(%s)' % filter_or
             else:
                 filters[fil] = value
+                lookups.append(fil)
         if filters:
             query_filter += '.filter(**%s)' % unicode(filters)
-        query_filter += '.distinct()'
+        if [lookup for lookup in lookups if is_multivalued_lookup(self.model, lookup)]:
+            query_filter += '.distinct()'
         if filter_or:
             query += import_q
         query += query_filter
         return query
 
     def report(self, request, report=None, queryset=None, template_name='autoreports/autoreports_form.html', extra_context=None):
-        export_report = (request.GET.get('__report_csv', None) and 'csv') or (request.GET.get('__report_excel', None) and 'excel')
+        export_formats = get_available_formats()
+        export_report = None
+        for export_format in export_formats.keys():
+            if request.GET.get('__report_%s' % export_format, None):
+                export_report = export_format
+                break
         data = request.GET or None
         fields_form_filter, fields_form_display = self.get_fields_of_form(report)
         form_filter = self.get_report_form_filter(data, fields_form_filter)
@@ -129,8 +157,23 @@ class ReportApi(object):
         are_valid = False
         if data:
             are_valid = form_display.is_valid() and form_filter.is_valid()
+        export_estimate = None
+        export_error = None
+        preflight = request.GET.get('__report_preflight', None)
+        if are_valid and (preflight or has_export_limits(self)):
+            report_to = export_report or (preflight in export_formats and preflight) or 'csv'
+            export_estimate = self.get_report_estimate(request, queryset, form_filter, form_display,
+                                                       report, report_to)
+            if preflight:
+                return HttpResponse(simplejson.dumps(export_estimate),
+                                    mimetype='application/json')
         if export_report and are_valid:
-            return self.get_report(request, queryset, form_filter, form_display, report, export_report)
+            action = export_estimate and check_export(export_estimate, self)
+            if action == EXPORT_REFUSED:
+                export_error = _('The report has too many rows, add some filters')
+            else:
+                return self.get_report(request, queryset, form_filter, form_display, report, export_report,
+                                       background=action == EXPORT_ASYNC)
         extra_context = extra_context or {}
         _adavanced_filters = extra_context.get('_adavanced_filters', None)
         django_query = None
@@ -139,11 +182,14 @@ class ReportApi(object):
         context = {'form_filter': form_filter,
                    'form_display': form_display,
                    'template_base': getattr(settings, 'AUTOREPORTS_BASE_TEMPLATE', 'base.html'),
-                   'export_formats': get_available_formats(),
+                   'export_formats': export_formats,
+                   'export_async': is_async_export(self),
                    'api': self,
                    'ADMIN_MEDIA_PREFIX': settings.ADMIN_MEDIA_PREFIX,
                    'report': report,
                    'django_query': django_query,
+                   'export_estimate': export_estimate,
+                   'export_error': export_error,
                   }
         context.update(extra_context)
         return render_to_response(template_name,
@@ -166,7 +212,7 @@ class ReportApi(object):
         if request.method == 'POST':
             data = request.POST
         elif report:
-            adaptors = get_adaptors_from_report(report)
+            adaptors = get_adaptors_from_report(report, api=self)
             form_top_initial['prefixes'] = ", ".join([unicode(adaptor.get_form().prefix) for adaptor in adaptors])
         form_top = form_top_class(instance=report, data=data, initial=form_top_initial)
         options = {}
@@ -0,0 +1,427 @@
+ # Copyright (c) 2010 by Yaco Sistemas <pmartin@yaco.es>
+ #
+ # This program is free software: you can redistribute it and/or modify
+ # it under the terms of the GNU Lesser General Public License as published by
+ # the Free Software Foundation, either version 3 of the License, or
+ # (at your option) any later version.
+ #
+ # This program is distributed in the hope that it will be useful,
+ # but WITHOUT ANY WARRANTY; without even the implied warranty of
+ # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ # GNU Lesser General Public License for more details.
+ #
+ # You should have received a copy of the GNU Lesser General Public License
+ # along with this programe.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import models
+from django.db.models.related import RelatedObject
+from django.db.models.sql.constants import LOOKUP_SEP
+from django.db.models.sql.datastructures import EmptyResultSet
+from django.utils import simplejson
+from django.utils.log import NullHandler
+from django.utils.translation import get_language
+
+from autoreports.exports import iter_file
+from autoreports.utils import SEPARATED_FIELD, get_class_from_path, get_compiled_report, get_field_by_name
+
+EXPORT_CACHE_TTL = 60 * 60
+EXPORT_CACHE_MAX_SIZE = 100 * 1024 * 1024
+# The values of memcached are 1MB at most
+EXPORT_CACHE_MAX_ITEM_SIZE = 1000 * 1000
+EXPORT_CACHE_PREFIX = 'autoreports:export'
+INDEX_LOCK_TIMEOUT = 10
+INDEX_LOCK_TRIES = 20
+INDEX_LOCK_WAIT = 0.05
+
+logger = logging.getLogger('autoreports')
+logger.addHandler(NullHandler())
+
+
+def get_model_label(model):
+    return '%s.%s' % (model._meta.app_label, model._meta.module_name)
+
+
+def normalize_filters(filters):
+    if hasattr(filters, 'lists'):
+        return dict(filters.lists())
+    return dict(filters)
+
+
+def get_query_key(object_list):
+    # The SQL keeps what the filters do not say: the queryset of the api,
+    # the ordering and the search of the quick reports
+    try:
+        return unicode(object_list.query)
+    except EmptyResultSet:
+        return None
+
+
+def get_relation_models(field):
+    """ The models that a relation reaches, with the table of a many to many """
+    if isinstance(field, RelatedObject):
+        relation_models = [field.model]
+        field = field.field
+        if isinstance(field, models.ManyToManyField):
+            relation_models.append(field.rel.through)
+        return relation_models
+    if isinstance(field, models.ManyToManyField):
+        return [field.rel.to, field.rel.through]
+    if isinstance(field, models.ForeignKey):
+        return [field.rel.to]
+    return []
+
+
+def get_export_models(model, lookups, separated_field=SEPARATED_FIELD):
+    """
+    The models whose changes can change an export: the model and the ones
+    reached by the display fields and the lookups of the filters
+    """
+    export_models = [model]
+    for lookup in lookups:
+        if callable(lookup):
+            continue
+        current_model = model
+        for field_name in lookup.replace(separated_field, LOOKUP_SEP).split(LOOKUP_SEP):
+            try:
+                field_name, field = get_field_by_name(current_model, field_name)
+            except models.FieldDoesNotExist:
+                break
+            relation_models = get_relation_models(field)
+            if not relation_models:
+                break
+            for relation_model in relation_models:
+                if not relation_model in export_models:
+                    export_models.append(relation_model)
+            current_model = relation_models[0]
+    return export_models
+
+
+def get_cache_key(model, report, filters, list_fields, list_headers, report_to, object_list,
+                  export_cache=None, separated_field=SEPARATED_FIELD):
+    options_hash = None
+    lookups = list(list_fields) + normalize_filters(filters).keys()
+    if report is not None and report.options:
+        compiled_report = get_compiled_report(report)
+        options_hash = compiled_report.options_hash
+        for field_name, opts in compiled_report.fields:
+            lookups.append(field_name)
+            lookups.extend(opts.get('other_fields', None) or [])
+    generations = None
+    if export_cache is not None:
+        # The exports are invalidated when their models change
+        generations = [export_cache.get_generation(export_model) for export_model in
+                       get_export_models(model, lookups, separated_field)]
+    data = [get_model_label(model),
+            report is not None and report.pk or None,
+            options_hash,
+            normalize_filters(filters),
+            [callable(field_name) and getattr(field_name, '__name__', repr(field_name)) or field_name
+             for field_name in list_fields],
+            list_headers,
+            report_to,
+            get_language(),
+            get_query_key(object_list),
+            generations]
+    return md5(simplejson.dumps(data, sort_keys=True, default=unicode)).hexdigest()
+
+
+class BaseExportCache(object):
+    """
+    Keeps the output of the exports, the least recently used ones are
+    removed when the cache is bigger than max_size. Every model has a
+    generation, which is part of the keys of the exports where it is
+    used (see get_cache_key), a new generation invalidates them
+    """
+
+    def __init__(self, ttl=EXPORT_CACHE_TTL, max_size=EXPORT_CACHE_MAX_SIZE, **options):
+        self.ttl = ttl
+        self.max_size = max_size
+
+    def get(self, key, model):
+        """ Returns an iterator with the cached output or None """
+        raise NotImplementedError
+
+    def store(self, key, model, content):
+        """ Yields the content and keeps it when it has been consumed """
+        raise NotImplementedError
+
+    def get_generation(self, model):
+        raise NotImplementedError
+
+    def invalidate(self, model):
+        """ Changes the generation of the model, if it is used by an export """
+        raise NotImplementedError
+
+
+class FileExportCache(BaseExportCache):
+    """
+    A file by export in a directory by model. The modification time of the
+    files is their creation time (ttl) and the access time their last use (LRU)
+    """
+
+    def __init__(self, location=None, **options):
+        super(FileExportCache, self).__init__(**options)
+        self.location = (location or getattr(settings, 'AUTOREPORTS_EXPORT_CACHE_DIR', None) or
+                         os.path.join(tempfile.gettempdir(), 'autoreports_cache'))
+
+    def get_path(self, key, model):
+        return os.path.join(self.location, get_model_label(model), key)
+
+    def get(self, key, model):
+        path = self.get_path(key, model)
+        try:
+            stat = os.stat(path)
+            now = time.time()
+            if now - stat.st_mtime > self.ttl:
+                os.remove(path)
+                return None
+            os.utime(path, (now, stat.st_mtime))
+            return iter_file(open(path, 'rb'))
+        except (IOError, OSError):
+            return None
+
+    def store(self, key, model, content):
+        path = self.get_path(key, model)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                pass
+        fd, temp_path = tempfile.mkstemp(dir=directory)
+        output = os.fdopen(fd, 'wb')
+        size = 0
+        try:
+            for chunk in content:
+                if output is not None:
+                    size += len(chunk)
+                    if size > self.max_size:
+                        output.close()
+                        output = None
+                    else:
+                        output.write(chunk)
+                yield chunk
+            if output is not None:
+                output.close()
+                output = None
+                os.rename(temp_path, path)
+                self.evict()
+        finally:
+            if output is not None:
+                output.close()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def evict(self):
+        files = []
+        now = time.time()
+        for dirpath, dirnames, filenames in os.walk(self.location):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                    if now - stat.st_mtime > self.ttl:
+                        os.remove(path)
+                    else:
+                        files.append((stat.st_atime, stat.st_size, path))
+                except OSError:
+                    pass
+        files.sort()
+        size = sum([file_size for atime, file_size, path in files])
+        for atime, file_size, path in files:
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            size -= file_size
+
+    def get_generation_path(self, model):
+        return os.path.join(self.location, 'generations', get_model_label(model))
+
+    def set_generation(self, model):
+        path = self.get_generation_path(model)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                pass
+        generation = uuid.uuid4().hex
+        fd, temp_path = tempfile.mkstemp(dir=directory)
+        output = os.fdopen(fd, 'wb')
+        try:
+            output.write(generation)
+        finally:
+            output.close()
+        os.rename(temp_path, path)
+        return generation
+
+    def get_generation(self, model):
+        try:
+            return open(self.get_generation_path(model), 'rb').read()
+        except IOError:
+            return self.set_generation(model)
+
+    def invalidate(self, model):
+        if not os.path.exists(self.get_generation_path(model)):
+            return
+        self.set_generation(model)
+        shutil.rmtree(os.path.join(self.location, get_model_label(model)), ignore_errors=True)
+
+
+class DjangoExportCache(BaseExportCache):
+    """
+    Uses the cache of Django, with an index of the entries (key, model,
+    size, creation time) sorted by their last use. The exports bigger than
+    max_item_size are not kept, the values of memcached have a limit
+    """
+
+    index_key = '%s:index' % EXPORT_CACHE_PREFIX
+    lock_key = '%s:lock' % EXPORT_CACHE_PREFIX
+
+    def __init__(self, max_item_size=EXPORT_CACHE_MAX_ITEM_SIZE, **options):
+        super(DjangoExportCache, self).__init__(**options)
+        self.max_item_size = max_item_size
+
+    def get_cache_key(self, key):
+        return '%s:%s' % (EXPORT_CACHE_PREFIX, key)
+
+    def get_generation_key(self, model):
+        return '%s:generation:%s' % (EXPORT_CACHE_PREFIX, get_model_label(model))
+
+    def get_generation(self, model):
+        generation_key = self.get_generation_key(model)
+        generation = cache.get(generation_key)
+        if generation is None:
+            # The exports live ttl seconds at most, an older generation can
+            # expire (and their exports are not used any more)
+            cache.add(generation_key, uuid.uuid4().hex, self.ttl)
+            generation = cache.get(generation_key)
+        return generation
+
+    def lock_index(self, tries=INDEX_LOCK_TRIES):
+        """ The index is changed by a process at once """
+        for i in xrange(tries):
+            if cache.add(self.lock_key, 1, INDEX_LOCK_TIMEOUT):
+                return True
+            time.sleep(INDEX_LOCK_WAIT)
+        return False
+
+    def unlock_index(self):
+        cache.delete(self.lock_key)
+
+    def get_index(self):
+        now = time.time()
+        return [entry for entry in cache.get(self.index_key, [])
+                if now - entry[3] <= self.ttl]
+
+    def get(self, key, model):
+        data = cache.get(self.get_cache_key(key))
+        if data is None:
+            return None
+        # The least recently used order is not changed if the index is busy
+        if self.lock_index(tries=1):
+            try:
+                index = self.get_index()
+                entries = [entry for entry in index if entry[0] == key]
+                if entries:
+                    index.remove(entries[0])
+                    index.append(entries[0])
+                    cache.set(self.index_key, index)
+            finally:
+                self.unlock_index()
+        return iter([data])
+
+    def store(self, key, model, content):
+        chunks = []
+        size = 0
+        for chunk in content:
+            if chunks is not None:
+                size += len(chunk)
+                if size > self.max_size or size > self.max_item_size:
+                    chunks = None
+                else:
+                    chunks.append(chunk)
+            yield chunk
+        if chunks is None:
+            logger.warning('The export %s of %s is not cached, it has more than %s bytes',
+                           key, get_model_label(model), min(self.max_size, self.max_item_size))
+            return
+        cache_key = self.get_cache_key(key)
+        cache.set(cache_key, ''.join(chunks), self.ttl)
+        if not self.lock_index():
+            # An export out of the index would not be evicted
+            cache.delete(cache_key)
+            return
+        try:
+            index = [entry for entry in self.get_index() if entry[0] != key]
+            index.append((key, get_model_label(model), size, time.time()))
+            while sum([entry[2] for entry in index]) > self.max_size:
+                cache.delete(self.get_cache_key(index.pop(0)[0]))
+            cache.set(self.index_key, index)
+        finally:
+            self.unlock_index()
+
+    def invalidate(self, model):
+        generation_key = self.get_generation_key(model)
+        if cache.get(generation_key) is None:
+            return
+        cache.set(generation_key, uuid.uuid4().hex, self.ttl)
+        # The exports of the model are not used any more, they are removed
+        # to free their space if the index is not busy
+        if not self.lock_index(tries=1):
+            return
+        try:
+            model_label = get_model_label(model)
+            index = []
+            for entry in self.get_index():
+                if entry[1] == model_label:
+                    cache.delete(self.get_cache_key(entry[0]))
+                else:
+                    index.append(entry)
+            cache.set(self.index_key, index)
+        finally:
+            self.unlock_index()
+
+
+def get_export_cache():
+    export_cache = getattr(settings, 'AUTOREPORTS_EXPORT_CACHE', None)
+    if not export_cache:
+        return None
+    return get_class_from_path(export_cache)(
+                ttl=getattr(settings, 'AUTOREPORTS_EXPORT_CACHE_TTL', EXPORT_CACHE_TTL),
+                max_size=getattr(settings, 'AUTOREPORTS_EXPORT_CACHE_MAX_SIZE', EXPORT_CACHE_MAX_SIZE),
+                max_item_size=getattr(settings, 'AUTOREPORTS_EXPORT_CACHE_MAX_ITEM_SIZE',
+                                      EXPORT_CACHE_MAX_ITEM_SIZE))
+
+
+def invalidate_export_cache(sender, **kwargs):
+    """
+    Every model can be used by the exports (their relations), the
+    generation is only changed if it is used
+    """
+    if not getattr(settings, 'AUTOREPORTS_EXPORT_CACHE_INVALIDATE', True):
+        return
+    if kwargs.get('action', 'post_').split('_')[0] != 'post':
+        # The signal m2m_changed is sent before and after the changes
+        return
+    export_cache = get_export_cache()
+    if export_cache is None:
+        return
+    export_cache.invalidate(sender)
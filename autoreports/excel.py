@@ -0,0 +1,213 @@
+ # Copyright (c) 2010 by Yaco Sistemas <pmartin@yaco.es>
+ #
+ # This program is free software: you can redistribute it and/or modify
+ # it under the terms of the GNU Lesser General Public License as published by
+ # the Free Software Foundation, either version 3 of the License, or
+ # (at your option) any later version.
+ #
+ # This program is distributed in the hope that it will be useful,
+ # but WITHOUT ANY WARRANTY; without even the implied warranty of
+ # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ # GNU Lesser General Public License for more details.
+ #
+ # You should have received a copy of the GNU Lesser General Public License
+ # along with this programe.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import decimal
+import tempfile
+
+from django.utils.encoding import force_unicode
+from django.utils.translation import ugettext_lazy as _
+
+from autoreports.exports import iter_file
+from autoreports.formats import BaseExportWriter
+from autoreports.utils import get_parser_value
+
+try:
+    import xlwt
+except ImportError:
+    xlwt = None
+
+try:
+    import pyExcelerator
+except ImportError:
+    pyExcelerator = None
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+try:
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+except ImportError:
+    ILLEGAL_CHARACTERS_RE = None
+
+XLS_MAX_ROWS = 65536
+XLSX_MAX_ROWS = 1048576
+XLS_FLUSH_ROWS = 1000
+
+DATE_FORMAT = 'YYYY-MM-DD'
+DATETIME_FORMAT = 'YYYY-MM-DD HH:MM:SS'
+TIME_FORMAT = 'HH:MM:SS'
+
+
+def get_cell_value(value):
+    if value is None:
+        return None
+    elif isinstance(value, (bool, int, long, float, decimal.Decimal,
+                            datetime.date, datetime.time)):
+        return value
+    elif isinstance(value, basestring):
+        return force_unicode(value, 'utf-8')
+    return force_unicode(get_parser_value(value), 'utf-8')
+
+
+def get_sheet_name(sheet_name, number):
+    return u'%s %s' % (sheet_name, number)
+
+
+class SpreadsheetWriter(BaseExportWriter):
+    """
+    Base writer of the spreadsheets, it starts a new sheet, with the
+    columns again, when the current one is full
+    """
+
+    max_rows = None
+    library = None
+
+    def __init__(self, sheet_name=u'Sheet', max_rows=None, **options):
+        super(SpreadsheetWriter, self).__init__(**options)
+        self.sheet_name = sheet_name
+        self.max_rows = max_rows or self.max_rows
+        self.workbook = self.get_workbook()
+        self.sheet = None
+        self.sheet_number = 0
+        self.row_number = 0
+
+    @classmethod
+    def is_available(cls):
+        return cls.library is not None
+
+    def get_workbook(self):
+        raise NotImplementedError
+
+    def add_sheet(self, title):
+        raise NotImplementedError
+
+    def append(self, row):
+        raise NotImplementedError
+
+    def save(self):
+        output = tempfile.TemporaryFile()
+        self.workbook.save(output)
+        return iter_file(output)
+
+    def new_sheet(self):
+        self.sheet_number += 1
+        self.sheet = self.add_sheet(get_sheet_name(self.sheet_name, self.sheet_number))
+        self.row_number = 0
+        self.append(self.columns)
+
+    def write_header(self, columns):
+        self.columns = [force_unicode(column, 'utf-8') for column in columns]
+        return ''
+
+    def write_rows(self, rows):
+        for row in rows:
+            if self.sheet is None or self.row_number >= self.max_rows:
+                self.new_sheet()
+            self.append([get_cell_value(value) for value in row])
+        return ''
+
+    def finish(self):
+        if self.sheet is None:
+            self.new_sheet()
+        return self.save()
+
+
+def _get_xls_styles(module):
+    styles = {}
+    for value_type, num_format in ((datetime.datetime, DATETIME_FORMAT),
+                                   (datetime.date, DATE_FORMAT),
+                                   (datetime.time, TIME_FORMAT)):
+        style = module.XFStyle()
+        style.num_format_str = num_format
+        styles[value_type] = style
+    styles[None] = module.XFStyle()
+    return styles
+
+
+def _get_xls_value(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    elif xlwt is None and type(value) is datetime.date:
+        # pyExcelerator only knows how to write datetimes
+        return datetime.datetime.combine(value, datetime.time())
+    return value
+
+
+class XLSWriter(SpreadsheetWriter):
+
+    file_extension = 'xls'
+    label = _('Report to Excel')
+    mimetype = 'application/vnd.ms-excel'
+    max_rows = XLS_MAX_ROWS
+    library = xlwt or pyExcelerator
+
+    def get_workbook(self):
+        self.styles = _get_xls_styles(self.library)
+        return self.library.Workbook()
+
+    def add_sheet(self, title):
+        return self.workbook.add_sheet(title)
+
+    def append(self, row):
+        styles = self.styles
+        for col_number, value in enumerate(row):
+            if value is None:
+                continue
+            style = styles.get(type(value), styles[None])
+            self.sheet.write(self.row_number, col_number, _get_xls_value(value), style)
+        self.row_number += 1
+        if self.row_number % XLS_FLUSH_ROWS == 0 and hasattr(self.sheet, 'flush_row_data'):
+            self.sheet.flush_row_data()
+
+    def save(self):
+        if xlwt is None:
+            return self.workbook.get_biff_data()
+        return super(XLSWriter, self).save()
+
+
+def _get_xlsx_workbook():
+    try:
+        return openpyxl.Workbook(write_only=True)
+    except TypeError:
+        # openpyxl < 2.4
+        return openpyxl.Workbook(optimized_write=True)
+
+
+def _get_xlsx_value(value):
+    if ILLEGAL_CHARACTERS_RE is not None and isinstance(value, unicode):
+        return ILLEGAL_CHARACTERS_RE.sub(u'', value)
+    return value
+
+
+class XLSXWriter(SpreadsheetWriter):
+
+    file_extension = 'xlsx'
+    label = _('Report to Excel 2007')
+    mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    max_rows = XLSX_MAX_ROWS
+    library = openpyxl
+
+    def get_workbook(self):
+        return _get_xlsx_workbook()
+
+    def add_sheet(self, title):
+        return self.workbook.create_sheet(title=title)
+
+    def append(self, row):
+        self.sheet.append([_get_xlsx_value(value) for value in row])
+        self.row_number += 1
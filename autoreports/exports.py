@@ -0,0 +1,541 @@
+ # Copyright (c) 2010 by Yaco Sistemas <pmartin@yaco.es>
+ #
+ # This program is free software: you can redistribute it and/or modify
+ # it under the terms of the GNU Lesser General Public License as published by
+ # the Free Software Foundation, either version 3 of the License, or
+ # (at your option) any later version.
+ #
+ # This program is distributed in the hope that it will be useful,
+ # but WITHOUT ANY WARRANTY; without even the implied warranty of
+ # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ # GNU Lesser General Public License for more details.
+ #
+ # You should have received a copy of the GNU Lesser General Public License
+ # along with this programe.  If not, see <http://www.gnu.org/licenses/>.
+
+import itertools
+
+from django.conf import settings
+from django.db import models
+from django.db.models.query import QuerySet
+from django.db.models.related import RelatedObject
+from django.http import HttpResponse
+from django.utils import translation
+from django.utils.datastructures import SortedDict
+
+from autoreports.utils import (SEPARATED_FIELD, ExportContext, get_adaptor, get_value_from_object,
+                               get_column_accessor, get_parser_value, get_field_by_name,
+                               get_model_of_relation, parsed_field_name,
+                               get_compiled_report)
+
+ROWS_PER_CHUNK = 100
+EXPORT_CHUNK_SIZE = 1000
+FILE_CHUNK_SIZE = 64 * 1024
+
+AGGREGATE_FUNCTIONS = {'count': models.Count,
+                       'sum': models.Sum,
+                       'avg': models.Avg,
+                       'min': models.Min,
+                       'max': models.Max}
+
+
+def is_streaming(streaming=None):
+    if streaming is None:
+        return getattr(settings, 'AUTOREPORTS_STREAMING', True)
+    return streaming
+
+
+def get_chunk_size(chunk_size=None):
+    return chunk_size or getattr(settings, 'AUTOREPORTS_EXPORT_CHUNK_SIZE', EXPORT_CHUNK_SIZE)
+
+
+def _get_pk_ordering(queryset):
+    query = queryset.query
+    if query.extra_order_by or not query.can_filter():
+        return None
+    ordering = query.order_by or (query.default_ordering and query.model._meta.ordering) or []
+    if not ordering:
+        return 'pk'
+    if len(ordering) == 1:
+        opts = query.model._meta
+        field_name = ordering[0]
+        desc = field_name.startswith('-')
+        if field_name.lstrip('-') in ('pk', opts.pk.name, opts.pk.attname):
+            return desc and '-pk' or 'pk'
+    return None
+
+
+def _get_ordering_field(model, name):
+    # Only the fields that can not be null nor be repeated by a join can be
+    # compared with the values of the last object of a chunk
+    opts = model._meta
+    parts = name.split('__')
+    field = None
+    for i, part in enumerate(parts):
+        try:
+            field = part == 'pk' and opts.pk or opts.get_field(part, many_to_many=False)
+        except models.FieldDoesNotExist:
+            return None
+        if field.null:
+            return None
+        if i < len(parts) - 1:
+            if not isinstance(field, models.ForeignKey):
+                return None
+            opts = field.rel.to._meta
+        elif field.rel and not field.primary_key:
+            # The foreign keys are ordered by the ordering of their model
+            return None
+    return field
+
+
+def _get_keyset_ordering(queryset):
+    """
+    Returns the ordering of the queryset as (lookup, descending) pairs that
+    end with the primary key, or None if the objects can not be paginated
+    by the values of their ordering
+    """
+    query = queryset.query
+    if query.extra_order_by or not query.can_filter():
+        return None
+    ordering = query.order_by or (query.default_ordering and query.model._meta.ordering) or []
+    keyset = []
+    for field_name in ordering:
+        desc = field_name.startswith('-')
+        name = field_name.lstrip('-')
+        field = _get_ordering_field(query.model, name)
+        if field is None:
+            return None
+        if field.primary_key and not '__' in name:
+            keyset.append(('pk', desc))
+            return keyset
+        keyset.append((name, desc))
+    keyset.append(('pk', False))
+    return keyset
+
+
+def _get_keyset_filter(keyset, obj):
+    # (a > x) or (a = x and b > y) or (a = x and b = y and pk > z)...
+    values = []
+    for name, desc in keyset:
+        value = obj
+        for attr in name.split('__'):
+            value = getattr(value, attr)
+        values.append(value)
+    q = None
+    for i, (name, desc) in enumerate(keyset):
+        lookups = dict([(keyset[j][0], values[j]) for j in xrange(i)])
+        lookups['%s__%s' % (name, desc and 'lt' or 'gt')] = values[i]
+        if q is None:
+            q = models.Q(**lookups)
+        else:
+            q = q | models.Q(**lookups)
+    return q
+
+
+def _iter_keyset_chunks(queryset, chunk_size, keyset):
+    queryset = queryset.order_by(*[desc and '-%s' % name or name for name, desc in keyset])
+    chunk = list(queryset[:chunk_size])
+    while chunk:
+        yield chunk
+        if len(chunk) < chunk_size:
+            break
+        keyset_filter = _get_keyset_filter(keyset, chunk[-1])
+        del chunk
+        chunk = list(queryset.filter(keyset_filter)[:chunk_size])
+
+
+def _iter_sliced_chunks(queryset, chunk_size):
+    # The ordering can not be used as a key (extra or random orderings,
+    # fields that can be null or through many to many relations), so the
+    # chunks are sliced: the database skips the previous objects again for
+    # every chunk, and the ordering must be deterministic for the chunks not
+    # to repeat or miss objects
+    offset = 0
+    chunk = list(queryset[:chunk_size])
+    while chunk:
+        yield chunk
+        if len(chunk) < chunk_size:
+            break
+        offset += chunk_size
+        del chunk
+        chunk = list(queryset[offset:offset + chunk_size])
+
+
+def iter_queryset_chunks(object_list, chunk_size=None):
+    chunk_size = get_chunk_size(chunk_size)
+    if not isinstance(object_list, QuerySet):
+        iterator = iter(object_list)
+        chunk = list(itertools.islice(iterator, chunk_size))
+        while chunk:
+            yield chunk
+            chunk = list(itertools.islice(iterator, chunk_size))
+        return
+    keyset = _get_keyset_ordering(object_list)
+    if keyset:
+        chunks = _iter_keyset_chunks(object_list, chunk_size, keyset)
+    else:
+        chunks = _iter_sliced_chunks(object_list, chunk_size)
+    for chunk in chunks:
+        yield chunk
+
+
+def _get_relation_lookup(field):
+    if isinstance(field, models.ForeignKey):
+        return (field.name, False)
+    elif isinstance(field, models.ManyToManyField):
+        return (field.name, True)
+    elif isinstance(field, RelatedObject):
+        return (field.get_accessor_name(), True)
+    return (None, False)
+
+
+def get_related_lookups(model, list_fields, separated_field=SEPARATED_FIELD, api=None):
+    select_related = []
+    prefetch_related = []
+    for field_name in list_fields:
+        if callable(field_name):
+            continue
+        prefix, field_name_parsed = parsed_field_name(field_name, separated_field)
+        current_model = model
+        path = []
+        multiple = False
+        for i, name in enumerate(prefix + [field_name_parsed]):
+            try:
+                name, field = get_field_by_name(current_model, name, api=i == 0 and api or None)
+            except models.FieldDoesNotExist:
+                break
+            lookup, lookup_multiple = _get_relation_lookup(field)
+            if not lookup:
+                break
+            path.append(lookup)
+            multiple = multiple or lookup_multiple
+            current_model = get_model_of_relation(field)
+        if not path:
+            continue
+        if multiple:
+            lookups = prefetch_related
+        else:
+            lookups = select_related
+        lookup = '__'.join(path)
+        if not lookup in lookups:
+            lookups.append(lookup)
+    return (select_related, prefetch_related)
+
+
+def add_related_lookups(queryset, list_fields, separated_field=SEPARATED_FIELD, api=None):
+    select_related, prefetch_related = get_related_lookups(queryset.model, list_fields,
+                                                           separated_field=separated_field,
+                                                           api=api)
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    # prefetch_related is only available since Django 1.4
+    if prefetch_related and hasattr(queryset, 'prefetch_related'):
+        queryset = queryset.prefetch_related(*prefetch_related)
+    return queryset
+
+
+class RelationHop(object):
+    """
+    A relation of a list column, the related objects of a chunk of objects
+    are fetched with a query of (object pk, related pk) pairs. The objects
+    of the later hops are given as a subquery, so their primary keys are
+    not loaded in memory
+    """
+
+    def __init__(self, field):
+        if isinstance(field, RelatedObject):
+            self.model = field.model
+            self.lookup = field.field.name
+            self.multiple = True
+        else:
+            self.model = get_model_of_relation(field)
+            self.lookup = field.related_query_name()
+            self.multiple = isinstance(field, models.ManyToManyField)
+
+    def get_queryset(self, pks):
+        return self.model._default_manager.filter(**{'%s__pk__in' % self.lookup: pks}).order_by()
+
+    def get_pairs(self, pks, *fields):
+        return self.get_queryset(pks).values_list('%s__pk' % self.lookup, 'pk', *fields)
+
+    def get_related_pks(self, pks):
+        return self.get_queryset(pks).values('pk')
+
+
+class RelationColumn(object):
+    """
+    Loads the values of a column through many to many or reverse relations
+    for a chunk of objects, with a query by relation instead of a query by
+    object and relation. The values are the same that the column accessor
+    returns: None, a value or a list of them
+    """
+
+    def __init__(self, hops, field_name=None, attname=None):
+        self.hops = hops
+        # field_name is the name of the last field when it is not a relation,
+        # attname its column when it can be read in the last query
+        self.field_name = field_name
+        self.attname = attname
+
+    def load(self, pks):
+        children = []
+        values = {}
+        last = len(self.hops) - 1
+        for i, hop in enumerate(self.hops):
+            related = {}
+            fields = i == last and self.attname and [self.attname] or []
+            for pair in hop.get_pairs(pks, *fields):
+                related.setdefault(pair[0], []).append(pair[1])
+                if fields:
+                    values[pair[1]] = pair[2]
+            children.append(related)
+            pks = hop.get_related_pks(pks)
+        if not self.attname:
+            objects = dict([(obj.pk, obj) for obj in
+                            self.hops[-1].model._default_manager.filter(pk__in=pks)])
+            if self.field_name is None:
+                values = objects
+            else:
+                values = dict([(pk, get_value_from_object(obj, self.field_name))
+                               for pk, obj in objects.items()])
+        return (children, values)
+
+    def get_value(self, pk, children, values, i=0):
+        if i == len(self.hops):
+            return values.get(pk, None)
+        related_pks = children[i].get(pk, [])
+        related_values = [self.get_value(related_pk, children, values, i + 1)
+                          for related_pk in related_pks]
+        if not related_values:
+            return None
+        elif len(related_values) == 1 or not self.hops[i].multiple:
+            return related_values[0]
+        return related_values
+
+    def get_values(self, pks):
+        children, values = self.load(pks)
+        return dict([(pk, self.get_value(pk, children, values)) for pk in pks])
+
+
+def get_relation_column(model, field_name, separated_field=SEPARATED_FIELD, api=None):
+    """
+    Returns a RelationColumn if the column goes through a many to many or a
+    reverse relation, else None
+    """
+    if callable(field_name):
+        return None
+    prefix, field_name_parsed = parsed_field_name(field_name, separated_field)
+    hops = []
+    current_model = model
+    for i, name in enumerate(prefix + [field_name_parsed]):
+        try:
+            name, field = get_field_by_name(current_model, name, api=i == 0 and api or None)
+        except models.FieldDoesNotExist:
+            return None
+        lookup, multiple = _get_relation_lookup(field)
+        if not lookup:
+            if i < len(prefix):
+                return None
+            break
+        hops.append(RelationHop(field))
+        current_model = get_model_of_relation(field)
+    if not [hop for hop in hops if hop.multiple]:
+        return None
+    if len(hops) == len(prefix) + 1:
+        return RelationColumn(hops)
+    from autoreports.fields import BaseReportField
+    attname = None
+    # The value is read from the last query if the adaptor returns the attribute
+    if (isinstance(field, models.Field) and
+        get_adaptor(field).get_value.im_func is BaseReportField.get_value.im_func):
+        attname = field.attname
+    return RelationColumn(hops, name, attname)
+
+
+def get_bulk_function(accessor, field_name, context):
+    if callable(field_name):
+        return getattr(field_name, 'bulk_value', None)
+    prepare_bulk = getattr(accessor, 'prepare_bulk', None)
+    if prepare_bulk is None:
+        return None
+    return prepare_bulk(context)
+
+
+def get_values(object_list, list_fields, separated_field=SEPARATED_FIELD, api=None,
+               chunk_size=None):
+    relation_columns = {}
+    bulk_functions = {}
+    if isinstance(object_list, QuerySet):
+        for i, field_name in enumerate(list_fields):
+            relation_column = get_relation_column(object_list.model, field_name,
+                                                  separated_field=separated_field, api=api)
+            if relation_column is not None:
+                relation_columns[i] = relation_column
+        object_list = add_related_lookups(object_list,
+                                          [field_name for i, field_name in enumerate(list_fields)
+                                           if not i in relation_columns],
+                                          separated_field=separated_field, api=api)
+        accessors = [get_column_accessor(object_list.model, field_name,
+                                         separated_field=separated_field, api=api)
+                     for field_name in list_fields]
+        context = ExportContext()
+        for i, field_name in enumerate(list_fields):
+            bulk_function = get_bulk_function(accessors[i], field_name, context)
+            if bulk_function is not None:
+                bulk_functions[i] = bulk_function
+        accessors = [getattr(accessor, 'prepare', None) and accessor.prepare(context) or accessor
+                     for accessor in accessors]
+    else:
+        accessors = [lambda obj, field_name=field_name: get_value_from_object(obj, field_name,
+                                                                              separated_field=separated_field,
+                                                                              api=api)
+                     for field_name in list_fields]
+    chunk_accessors = accessors
+    for chunk in iter_queryset_chunks(object_list, chunk_size):
+        if relation_columns or bulk_functions:
+            chunk_accessors = list(accessors)
+            pks = [obj.pk for obj in chunk]
+            for i, relation_column in relation_columns.items():
+                column_values = relation_column.get_values(pks)
+                chunk_accessors[i] = lambda obj, column_values=column_values: column_values[obj.pk]
+            for i, bulk_function in bulk_functions.items():
+                values = bulk_function(chunk)
+                if values is None:
+                    continue
+                column_values = dict(zip(pks, values))
+                chunk_accessors[i] = lambda obj, column_values=column_values: column_values[obj.pk]
+        for obj in chunk:
+            yield [accessor(obj) for accessor in chunk_accessors]
+
+
+def is_aggregated_report(report):
+    if report is None or not report.options:
+        return False
+    for field_name, opts in report.options.items():
+        if opts.get('group_by', False) or opts.get('aggregates', None):
+            return True
+    return False
+
+
+def get_aggregated_columns(report, api=None):
+    """
+    Returns the headers, the adaptors of the group by fields and the
+    aggregates (by alias) of a grouped report
+    """
+    headers = []
+    group_adaptors = []
+    aggregates = SortedDict()
+    aggregate_headers = []
+    compiled_report = get_compiled_report(report)
+    adaptors = compiled_report.get_adaptors(report, api)
+    for (field_name, opts), adaptor in zip(compiled_report.fields, adaptors):
+        label = adaptor.get_label_to_opts(opts) or adaptor.get_verbose_name()
+        if opts.get('group_by', False) and adaptor.can_group_by:
+            group_adaptors.append(adaptor)
+            headers.append(unicode(label).encode('utf-8'))
+        aggregate_choices = dict(adaptor.get_aggregates())
+        for aggregate in opts.get('aggregates', None) or []:
+            if not aggregate in aggregate_choices:
+                continue
+            alias = 'autoreports_aggregate_%d' % len(aggregates)
+            aggregates[alias] = AGGREGATE_FUNCTIONS[aggregate](adaptor.field_name_parsed)
+            aggregate_headers.append((u'%s (%s)' % (label, aggregate_choices[aggregate])).encode('utf-8'))
+    headers.extend(aggregate_headers)
+    return (headers, group_adaptors, aggregates)
+
+
+def get_aggregated_values(object_list, report, api=None):
+    """
+    Returns the headers and the rows of a report with a row by every group
+    of values of its group by fields and a column by every total, which
+    are calculated by the database
+    """
+    headers, group_adaptors, aggregates = get_aggregated_columns(report, api)
+    lookups = [adaptor.field_name_parsed for adaptor in group_adaptors]
+    if lookups:
+        # The ordering of the queryset would be added to the GROUP BY
+        rows = list(object_list.order_by().values(*lookups).annotate(**aggregates).order_by(*lookups))
+    else:
+        rows = [object_list.aggregate(**aggregates)]
+    columns = []
+    for adaptor in group_adaptors:
+        column = [row[adaptor.field_name_parsed] for row in rows]
+        columns.append(adaptor.get_group_values(column))
+    for alias in aggregates.keys():
+        columns.append([row[alias] for row in rows])
+    return (headers, [list(row) for row in zip(*columns)])
+
+
+def _iter_output(output):
+    if isinstance(output, basestring):
+        if output:
+            yield output
+    else:
+        for chunk in output:
+            if chunk:
+                yield chunk
+
+
+def format_rows(rows, formatters=None):
+    """
+    Formats a chunk of rows with get_parser_value, or column by column with
+    the formatters of the columns (see get_column_formatters)
+    """
+    if formatters is None:
+        return [[get_parser_value(value) for value in row] for row in rows]
+    columns = [formatter(column) for formatter, column in zip(formatters, zip(*rows))]
+    return zip(*columns)
+
+
+def write_export(writer, columns, values, rows_per_chunk=ROWS_PER_CHUNK, formatters=None):
+    """
+    Sends the columns and the values, by chunks of rows, to the writer and
+    yields its output
+    """
+    values = iter(values)
+    if columns is not None:
+        for chunk in _iter_output(writer.write_header(columns)):
+            yield chunk
+    while True:
+        rows = list(itertools.islice(values, rows_per_chunk))
+        if not rows:
+            break
+        if not writer.raw_values:
+            rows = format_rows(rows, formatters)
+        for chunk in _iter_output(writer.write_rows(rows)):
+            yield chunk
+    for chunk in _iter_output(writer.finish()):
+        yield chunk
+
+
+def iter_file(output, chunk_size=FILE_CHUNK_SIZE):
+    output.seek(0)
+    try:
+        chunk = output.read(chunk_size)
+        while chunk:
+            yield chunk
+            chunk = output.read(chunk_size)
+    finally:
+        output.close()
+
+
+def stream_in_language(content, language):
+    # The response is consumed after the middlewares have run, and
+    # LocaleMiddleware deactivates the language of the request on the way out
+    translation.activate(language)
+    try:
+        for chunk in content:
+            yield chunk
+    finally:
+        translation.deactivate()
+
+
+def export_response(filename, content, streaming=None,
+                    mimetype='application/vnd.ms-excel'):
+    if is_streaming(streaming):
+        content = stream_in_language(content, translation.get_language())
+    else:
+        content = ''.join(content)
+    response = HttpResponse(content, mimetype=mimetype)
+    response['Content-Disposition'] = 'attachment; filename=%s' % filename
+    return response
@@ -1,25 +1,66 @@
 import itertools
 
-from copy import copy
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+from copy import copy, deepcopy
 
 from django import forms
 from django.conf import settings
 from django.contrib.admin.widgets import AdminSplitDateTime, AdminDateWidget
 from django.db.models import ObjectDoesNotExist
 from django.template.loader import render_to_string
+from django.utils import simplejson
+from django.utils.datastructures import SortedDict
 from django.utils.translation import get_language
 from django.utils.translation import ugettext as _
+from django.utils.translation import ugettext_lazy
 
 from autoreports.forms import BaseReportForm
 from autoreports.model_forms import modelform_factory
-from autoreports.utils import (is_iterable, get_fields_from_model, get_field_from_model,
-                               parsed_field_name, transmeta_field_name, SEPARATED_FIELD,
-                               get_class_from_path)
+from autoreports.utils import (is_iterable, get_compiled_report, get_fields_from_model, get_field_from_model,
+                               get_model_of_relation, parsed_field_name, transmeta_field_name,
+                               SEPARATED_FIELD, get_class_from_path)
 from autoreports.wizards import ModelFieldForm, WizardField, WizardAdminField
 
+MAX_FORM_FIELDS = 1000
+
+AGGREGATES = (('count', ugettext_lazy('Count')),
+              ('sum', ugettext_lazy('Sum')),
+              ('avg', ugettext_lazy('Average')),
+              ('min', ugettext_lazy('Minimum')),
+              ('max', ugettext_lazy('Maximum')))
+
+_report_forms = {}
+_form_fields = {}
+
+
+def clear_form_fields():
+    _report_forms.clear()
+    _form_fields.clear()
+
+
+def get_report_form(model, field_name):
+    # The metaclass of the model forms is slow, so the form of every field
+    # is built once and its fields are copied
+    try:
+        return _report_forms[(model, field_name)]
+    except KeyError:
+        form = modelform_factory(model, form=BaseReportForm, fields=[field_name])
+        _report_forms[(model, field_name)] = form
+        return form
+
 
 class BaseReportField(object):
 
+    # The form fields of the reports are built once by field and options
+    # and copied, unless their choices come from the database
+    cache_field_form = True
+    # If the reports can be grouped by the values of the field
+    can_group_by = True
+
     def __init__(self, model, field, field_name=None, instance=None, treatment_transmeta=True, *args, **kwargs):
         super(BaseReportField, self).__init__(*args, **kwargs)
         self.model = model
@@ -39,6 +80,13 @@ class BaseReportField(object):
     def get_filter_default(self):
         return 'icontains'
 
+    @classmethod
+    def get_aggregates(self):
+        return AGGREGATES[:1]
+
+    def get_group_values(self, values):
+        return values
+
     @classmethod
     def get_filters(self):
         return (('exact', _('Exact (case-sensitive)')),
@@ -98,11 +146,37 @@ class BaseReportField(object):
     def get_basic_field_form(self, form, field_name):
         return form.base_fields[field_name]
 
+    def get_field_form_key(self, opts=None, default=True):
+        return (self.__class__, self.model, self.field, self.field_name, default,
+                opts and simplejson.dumps(opts, sort_keys=True) or None,
+                getattr(settings, 'AUTOREPORTS_INITIAL', True),
+                getattr(settings, 'AUTOREPORTS_SUBFIX', True),
+                getattr(settings, 'AUTOREPORTS_I18N', False),
+                get_language())
+
     def get_field_form(self, opts=None, default=True,
                        fields_form_filter=None, fields_form_display=None):
+        if not self.cache_field_form:
+            return self.build_field_form(opts, default, fields_form_filter, fields_form_display)
+        key = self.get_field_form_key(opts, default)
+        form_fields = _form_fields.get(key, None)
+        if form_fields is None:
+            form_filter, form_display = self.build_field_form(opts, default, SortedDict(), SortedDict())
+            form_fields = (form_filter.items(), form_display.items())
+            if len(_form_fields) >= MAX_FORM_FIELDS:
+                _form_fields.clear()
+            _form_fields[key] = form_fields
+        for field_name, field in form_fields[0]:
+            fields_form_filter[field_name] = deepcopy(field)
+        for field_name, field in form_fields[1]:
+            fields_form_display[field_name] = deepcopy(field)
+        return (fields_form_filter, fields_form_display)
+
+    def build_field_form(self, opts=None, default=True,
+                         fields_form_filter=None, fields_form_display=None):
         prefix, field_name = parsed_field_name(self.field_name)
-        form = modelform_factory(self.model, form=BaseReportForm, fields=[field_name])
-        field = self.get_basic_field_form(form, field_name)
+        form = get_report_form(self.model, field_name)
+        field = deepcopy(self.get_basic_field_form(form, field_name))
         autoreports_initial = getattr(settings, 'AUTOREPORTS_INITIAL', True)
         autoreports_subfix = getattr(settings, 'AUTOREPORTS_SUBFIX', True)
         if not autoreports_initial:
@@ -152,11 +226,18 @@ class BaseReportField(object):
             return WizardField
         return get_class_from_path(wizard_path)
 
+    def get_form_prefix(self):
+        # The same for the same field and report, the forms of the wizard are
+        # cached (wizard_fragment) and they must not share their prefix
+        key = '%s.%s:%s:%s' % (self.model._meta.app_label, self.model._meta.module_name,
+                               self.field_name, self.instance and self.instance.pk or '')
+        return 'f%s' % md5(key.encode('utf-8')).hexdigest()[:16]
+
     def get_form(self, is_admin=True):
         wizard_class = self.get_class_form(is_admin)
         return wizard_class(self,
                           instance=self.instance,
-                          prefix=id(self))
+                          prefix=self.get_form_prefix())
 
     def render_model_field(self, form, model, is_admin=True):
         modelfieldform = ModelFieldForm(initial={'app_label': model._meta.app_label,
@@ -231,7 +312,7 @@ class TextFieldReportField(BaseReportField):
             return {}
         initial = None
         if self.instance:
-            field_options = self.instance.options.get(self.field_name, None)
+            field_options = get_compiled_report(self.instance).get_options(self.field_name)
             if field_options:
                 initial = field_options.get('other_fields', None)
         return {'other_fields': forms.MultipleChoiceField(label=_('Other fields to filter'),
@@ -353,6 +434,10 @@ class ChoicesFieldReportField(ProviderSelectMultiple, TextFieldReportField):
             return choice_display()
         return super(ChoicesFieldReportField, self).get_value(obj, field_name)
 
+    def get_group_values(self, values):
+        choices = dict(self.field.flatchoices)
+        return [choices.get(value, value) for value in values]
+
     def get_filter_default(self):
         return 'exact'
 
@@ -376,6 +461,10 @@ class NumberFieldReportField(BaseReportField):
     def get_filter_default(self):
         return 'exact'
 
+    @classmethod
+    def get_aggregates(self):
+        return AGGREGATES
+
     def change_value(self, value, key, request_get):
         if value and len(value) > 0 and value[0].isnumeric():
             return (value, request_get)
@@ -399,6 +488,11 @@ class AutoNumberFieldReportField(NumberFieldReportField):
 
 class BaseDateFieldReportField(BaseReportField):
 
+    @classmethod
+    def get_aggregates(self):
+        return tuple([aggregate for aggregate in AGGREGATES
+                      if aggregate[0] in ('count', 'min', 'max')])
+
     def change_value_date_widget(self, value, key, request_get, field=None):
         if len(value) <= 0 or not value[0]:
             del request_get[key]
@@ -511,6 +605,8 @@ class BooleanFieldReportField(BaseReportField):
 
 class RelatedReportField(BaseReportField):
 
+    cache_field_form = False
+
     def _treatment_transmeta(self):
         pass
 
@@ -525,6 +621,12 @@ class RelatedReportField(BaseReportField):
     def get_filter_default(self):
         return 'in'
 
+    def get_group_values(self, values):
+        # The values are the primary keys of the related objects
+        model = get_model_of_relation(self.field)
+        objects = model._default_manager.in_bulk([value for value in values if value is not None])
+        return [objects.get(value, value) for value in values]
+
     def change_value(self, value, key, request_get):
         if len(value) <= 0 or not value[0]:
             del request_get[key]
@@ -585,6 +687,12 @@ class M2MReportField(ProviderSelectSigle, RelatedDirectField):
 
 class FuncField(BaseReportField):
 
+    can_group_by = False
+
+    @classmethod
+    def get_aggregates(self):
+        return tuple()
+
     from autoreports.utils import add_domain
     middleware_value = {'get_absolute_url': add_domain}
 
@@ -620,6 +728,46 @@ class FuncField(BaseReportField):
             value = self.middleware_value[field_name](value)
         return value
 
+    def get_accessor(self, field_name, context):
+        """
+        Returns a function that gets the value of the column from an object,
+        the way to call the function and its middleware are resolved once
+        """
+        func_args = self.field.im_func.func_code.co_argcount
+        if func_args == 1:
+            def get_value(obj):
+                return getattr(obj, field_name)()
+        elif func_args == 2:
+            get_value = self.field
+        else:
+            def get_value(obj):
+                return 'error'
+        middleware = self.middleware_value.get(field_name, None)
+        if middleware is None:
+            return get_value
+        middleware = context.get_middleware(middleware)
+        return lambda obj: middleware(get_value(obj))
+
+    def get_bulk_function(self, field_name, context):
+        """
+        Returns a function that gets the values of the column from a list of
+        objects if the function of the column has a bulk_value attribute
+        """
+        bulk_value = getattr(self.field, 'bulk_value', None)
+        if bulk_value is None:
+            return None
+        middleware = self.middleware_value.get(field_name, None)
+        if middleware is None:
+            return bulk_value
+        middleware = context.get_middleware(middleware)
+
+        def get_values(objects):
+            values = bulk_value(objects)
+            if values is None:
+                return None
+            return [middleware(value) for value in values]
+        return get_values
+
     def _treatment_transmeta(self):
         pass
 
@@ -654,6 +802,12 @@ class PropertyField(FuncField):
     def get_value(self, obj, field_name=None):
         return super(FuncField, self).get_value(obj, field_name)
 
+    def get_accessor(self, field_name, context):
+        return None
+
+    def get_bulk_function(self, field_name, context):
+        return getattr(getattr(self.field, 'fget', None), 'bulk_value', None)
+
 
 class GenericFKField(PropertyField):
     pass
@@ -0,0 +1,396 @@
+ # Copyright (c) 2010 by Yaco Sistemas <pmartin@yaco.es>
+ #
+ # This program is free software: you can redistribute it and/or modify
+ # it under the terms of the GNU Lesser General Public License as published by
+ # the Free Software Foundation, either version 3 of the License, or
+ # (at your option) any later version.
+ #
+ # This program is distributed in the hope that it will be useful,
+ # but WITHOUT ANY WARRANTY; without even the implied warranty of
+ # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ # GNU Lesser General Public License for more details.
+ #
+ # You should have received a copy of the GNU Lesser General Public License
+ # along with this programe.  If not, see <http://www.gnu.org/licenses/>.
+
+import csv
+import datetime
+import decimal
+import struct
+
+from django.conf import settings
+from django.db import models
+from django.utils import simplejson
+from django.utils.datastructures import SortedDict
+from django.utils.encoding import force_unicode, smart_str
+from django.utils.functional import Promise
+from django.utils.translation import ugettext_lazy as _
+
+from autoreports.utils import get_class_from_path, get_parser_value, is_iterable
+
+DEFAULT_EXPORT_FORMATS = (
+    ('csv', 'autoreports.formats.CSVWriter'),
+    ('excel', 'autoreports.excel.XLSWriter'),
+    ('xlsx', 'autoreports.excel.XLSXWriter'),
+    ('tsv', 'autoreports.formats.TSVWriter'),
+    ('jsonl', 'autoreports.formats.JSONLinesWriter'),
+    ('columnar', 'autoreports.formats.ColumnarWriter'),
+)
+
+
+class ExportFormatNotRegistered(Exception):
+    pass
+
+
+class BaseExportWriter(object):
+    """
+    A writer receives the columns, the rows by chunks and the end of the
+    export. Every method returns a string or an iterable of strings with
+    the output that is ready to be sent.
+    """
+
+    file_extension = None
+    label = None
+    mimetype = 'application/octet-stream'
+    # If False the rows are formatted with get_parser_value before writing them
+    raw_values = True
+    # If the output of several writers of consecutive rows (without header)
+    # can be concatenated, so the export can be done in parallel
+    can_split = False
+
+    def __init__(self, **options):
+        self.options = options
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    def write_header(self, columns):
+        return ''
+
+    def write_rows(self, rows):
+        return ''
+
+    def finish(self):
+        return ''
+
+
+class StreamBuffer(object):
+    """
+    File-like object that keeps what is written into it until it is read,
+    so a csv.writer can be drained every few rows
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, value):
+        self.chunks.append(value)
+
+    def read(self):
+        value = ''.join(self.chunks)
+        self.chunks = []
+        return value
+
+
+def normalize_value(value):
+    if not isinstance(value, basestring):
+        return value
+    return value.replace('\t', ' ').replace('\r\n', '\n').replace('\n\n', '\n')
+
+
+class CSVWriter(BaseExportWriter):
+
+    file_extension = 'csv'
+    label = _('Report to CSV')
+    mimetype = 'application/vnd.ms-excel'
+    raw_values = False
+    can_split = True
+    delimiter = ','
+
+    def __init__(self, delimiter=None, **options):
+        super(CSVWriter, self).__init__(**options)
+        self.buffer = StreamBuffer()
+        self.writer = csv.writer(self.buffer, delimiter=delimiter or self.delimiter,
+                                 lineterminator='\n')
+
+    def write_header(self, columns):
+        return self.write_rows([columns])
+
+    def write_rows(self, rows):
+        for row in rows:
+            self.writer.writerow([normalize_value(value) for value in row])
+        return self.buffer.read()
+
+
+class TSVWriter(CSVWriter):
+
+    file_extension = 'tsv'
+    label = _('Report to TSV')
+    mimetype = 'text/tab-separated-values'
+    delimiter = '\t'
+
+
+def get_json_value(value):
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    elif isinstance(value, decimal.Decimal):
+        return str(value)
+    elif isinstance(value, (models.Model, Promise)):
+        return force_unicode(value)
+    elif is_iterable(value):
+        return [get_json_value(item) for item in value]
+    return force_unicode(get_parser_value(value), 'utf-8')
+
+
+class JSONLinesWriter(BaseExportWriter):
+    """
+    One JSON array per line, the first one with the columns
+    """
+
+    file_extension = 'jsonl'
+    label = _('Report to JSON Lines')
+    mimetype = 'application/x-ndjson'
+    can_split = True
+
+    def _dumps(self, value):
+        line = simplejson.dumps(value, default=get_json_value,
+                                ensure_ascii=False, separators=(',', ':'))
+        return u'%s\n' % line
+
+    def write_header(self, columns):
+        return self._dumps([force_unicode(column, 'utf-8') for column in columns]).encode('utf-8')
+
+    def write_rows(self, rows):
+        return u''.join([self._dumps([isinstance(value, str) and force_unicode(value, 'utf-8') or value
+                                      for value in row])
+                         for row in rows]).encode('utf-8')
+
+
+# Columnar format:
+#   'ARC1', column count (uint32) and every column name (uint32 length + utf-8)
+#   row groups: row count (uint32) and, for every column, its type code (1 byte),
+#   a null bitmap (1 bit per row) and its values
+#   a row count of 0 ends the file
+# Every number is little endian.
+
+COLUMNAR_MAGIC = 'ARC1'
+COLUMNAR_ROW_GROUP_SIZE = 1000
+COLUMNAR_EPOCH = datetime.datetime(1970, 1, 1)
+COLUMNAR_EPOCH_ORDINAL = COLUMNAR_EPOCH.toordinal()
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
+
+
+def _get_columnar_type(values):
+    values = [value for value in values if value is not None]
+    types = set([type(value) for value in values])
+    if not types:
+        return 's'
+    elif types == set([bool]):
+        return 'b'
+    elif types <= set([int, long]):
+        if min(values) >= INT64_MIN and max(values) <= INT64_MAX:
+            return 'q'
+        return 'd'
+    elif types <= set([int, long, float, decimal.Decimal]):
+        return 'd'
+    elif types == set([datetime.date]):
+        return 'D'
+    elif types == set([datetime.datetime]):
+        return 'T'
+    return 's'
+
+
+def _encode_columnar_value(value, type_code):
+    if value is None:
+        return 0
+    elif type_code == 'd':
+        return float(value)
+    elif type_code == 'D':
+        return value.toordinal() - COLUMNAR_EPOCH_ORDINAL
+    elif type_code == 'T':
+        delta = value - COLUMNAR_EPOCH
+        return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+    return value
+
+
+def _decode_columnar_value(value, type_code):
+    if type_code == 'b':
+        return bool(value)
+    elif type_code == 'D':
+        return datetime.date.fromordinal(value + COLUMNAR_EPOCH_ORDINAL)
+    elif type_code == 'T':
+        return COLUMNAR_EPOCH + datetime.timedelta(microseconds=value)
+    return value
+
+COLUMNAR_STRUCT_CODES = {'b': 'B', 'q': 'q', 'd': 'd', 'D': 'i', 'T': 'q'}
+
+
+def encode_columnar_column(values):
+    type_code = _get_columnar_type(values)
+    nulls = bytearray((len(values) + 7) // 8)
+    for i, value in enumerate(values):
+        if value is None:
+            nulls[i // 8] |= 1 << (i % 8)
+    if type_code == 's':
+        strings = [value is None and '' or smart_str(get_parser_value(value))
+                   for value in values]
+        offsets = [0]
+        for string in strings:
+            offsets.append(offsets[-1] + len(string))
+        data = struct.pack('<%dI' % len(offsets), *offsets) + ''.join(strings)
+    else:
+        data = struct.pack('<%d%s' % (len(values), COLUMNAR_STRUCT_CODES[type_code]),
+                           *[_encode_columnar_value(value, type_code)
+                             for value in values])
+    return type_code + str(nulls) + data
+
+
+def decode_columnar_column(data, offset, row_count):
+    type_code = data[offset]
+    offset += 1
+    null_size = (row_count + 7) // 8
+    nulls = bytearray(data[offset:offset + null_size])
+    offset += null_size
+    if type_code == 's':
+        offsets = struct.unpack_from('<%dI' % (row_count + 1), data, offset)
+        offset += 4 * (row_count + 1)
+        values = [data[offset + offsets[i]:offset + offsets[i + 1]].decode('utf-8')
+                  for i in xrange(row_count)]
+        offset += offsets[-1]
+    else:
+        struct_format = '<%d%s' % (row_count, COLUMNAR_STRUCT_CODES[type_code])
+        values = [_decode_columnar_value(value, type_code)
+                  for value in struct.unpack_from(struct_format, data, offset)]
+        offset += struct.calcsize(struct_format)
+    for i in xrange(row_count):
+        if nulls[i // 8] & (1 << (i % 8)):
+            values[i] = None
+    return (values, offset)
+
+
+class ColumnarWriter(BaseExportWriter):
+    """
+    Compact binary format that stores the values by columns and keeps
+    their types, see read_columnar
+    """
+
+    file_extension = 'arc'
+    label = _('Report to columnar format')
+
+    def __init__(self, row_group_size=COLUMNAR_ROW_GROUP_SIZE, **options):
+        super(ColumnarWriter, self).__init__(**options)
+        self.row_group_size = row_group_size
+        self.rows = []
+
+    def write_header(self, columns):
+        header = [COLUMNAR_MAGIC, struct.pack('<I', len(columns))]
+        for column in columns:
+            column = force_unicode(column, 'utf-8').encode('utf-8')
+            header.append(struct.pack('<I', len(column)))
+            header.append(column)
+        self.column_count = len(columns)
+        return ''.join(header)
+
+    def write_row_group(self):
+        rows = self.rows
+        self.rows = []
+        row_group = [struct.pack('<I', len(rows))]
+        for i in xrange(self.column_count):
+            row_group.append(encode_columnar_column([row[i] for row in rows]))
+        return ''.join(row_group)
+
+    def write_rows(self, rows):
+        output = []
+        for row in rows:
+            self.rows.append(row)
+            if len(self.rows) >= self.row_group_size:
+                output.append(self.write_row_group())
+        return ''.join(output)
+
+    def finish(self):
+        output = ''
+        if self.rows:
+            output = self.write_row_group()
+        return output + struct.pack('<I', 0)
+
+
+def read_columnar(fileobj):
+    """
+    Returns the columns and an iterator of the rows of a file written by
+    ColumnarWriter
+    """
+    if fileobj.read(len(COLUMNAR_MAGIC)) != COLUMNAR_MAGIC:
+        raise ValueError('It is not a columnar report')
+    column_count = struct.unpack('<I', fileobj.read(4))[0]
+    columns = []
+    for i in xrange(column_count):
+        length = struct.unpack('<I', fileobj.read(4))[0]
+        columns.append(fileobj.read(length).decode('utf-8'))
+
+    def rows():
+        data = fileobj.read()
+        offset = 0
+        while True:
+            row_count = struct.unpack_from('<I', data, offset)[0]
+            offset += 4
+            if not row_count:
+                break
+            values = []
+            for i in xrange(column_count):
+                column_values, offset = decode_columnar_column(data, offset, row_count)
+                values.append(column_values)
+            for row in zip(*values):
+                yield list(row)
+    return (columns, rows())
+
+
+class ExportFormatRegistry(object):
+
+    def __init__(self):
+        self._registry = SortedDict({})
+        self._loaded = False
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        registry = self._registry
+        self._registry = SortedDict({})
+        for key, writer_class in DEFAULT_EXPORT_FORMATS:
+            self._registry[key] = writer_class
+        autoreports_export_formats = getattr(settings, 'AUTOREPORTS_EXPORT_FORMATS', None) or {}
+        for key, writer_class in autoreports_export_formats.items():
+            self._registry[key] = writer_class
+        self._registry.update(registry)
+
+    def register(self, key, writer_class):
+        self._registry[key] = writer_class
+
+    def unregister(self, key):
+        self._load()
+        if key in self._registry:
+            del self._registry[key]
+
+    def get_writer_class(self, key):
+        self._load()
+        if not key in self._registry:
+            raise ExportFormatNotRegistered('Export format %s not registered. Options are: %s'
+                                            % (key, self._registry.keys()))
+        writer_class = self._registry[key]
+        if isinstance(writer_class, basestring):
+            writer_class = get_class_from_path(writer_class)
+            self._registry[key] = writer_class
+        return writer_class
+
+    def get_available_formats(self):
+        self._load()
+        formats = SortedDict({})
+        for key in self._registry.keys():
+            writer_class = self.get_writer_class(key)
+            if writer_class.is_available():
+                formats[key] = writer_class
+        return formats
+
+export_formats = ExportFormatRegistry()
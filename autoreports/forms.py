@@ -17,8 +17,9 @@ from django import forms
 
 from django.utils.translation import ugettext_lazy as _
 
+from autoreports.jobs import create_job
 from autoreports.model_forms import ReportModelFormMetaclass
-from autoreports.views import reports_view
+from autoreports.views import reports_preflight, reports_view
 
 from formadmin.forms import FormAdminDjango
 
@@ -68,14 +69,23 @@ class ReportFilterForm(ReportForm, FormAdminDjango):
             self.fields[field_required].required = True
         return valid
 
-    def get_report(self, request, queryset, form_display, report, report_to, api=None):
+    def get_display_fields(self, form_display):
         list_headers = []
         report_display_fields = form_display.cleaned_data.get('__report_display_fields_choices', [])
         choices_display_fields = dict(form_display.fields['__report_display_fields_choices'].choices)
         for key in report_display_fields:
             label = choices_display_fields[key]
             list_headers.append(unicode(label).encode('utf-8'))
-        return reports_view(request,
+        return (report_display_fields, list_headers)
+
+    def get_report_job(self, request, form_display, report, report_to, api=None):
+        report_display_fields, list_headers = self.get_display_fields(form_display)
+        return create_job(request, api, report_to, report_display_fields, list_headers,
+                          report=report)
+
+    def get_report_estimate(self, request, queryset, form_display, report, report_to, api=None):
+        report_display_fields, list_headers = self.get_display_fields(form_display)
+        return reports_preflight(request,
                  self._meta.model._meta.app_label,
                  self._meta.model._meta.module_name,
                  fields=report_display_fields,
@@ -84,3 +94,17 @@ class ReportFilterForm(ReportForm, FormAdminDjango):
                  report=report,
                  report_to=report_to,
                  api=api)
+
+    def get_report(self, request, queryset, form_display, report, report_to, api=None):
+        report_display_fields, list_headers = self.get_display_fields(form_display)
+        return reports_view(request,
+                 self._meta.model._meta.app_label,
+                 self._meta.model._meta.module_name,
+                 fields=report_display_fields,
+                 list_headers=list_headers,
+                 queryset=queryset,
+                 report=report,
+                 report_to=report_to,
+                 api=api,
+                 streaming=getattr(api, 'export_streaming', None),
+                 chunk_size=getattr(api, 'export_chunk_size', None))
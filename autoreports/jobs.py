@@ -0,0 +1,316 @@
+ # Copyright (c) 2010 by Yaco Sistemas <pmartin@yaco.es>
+ #
+ # This program is free software: you can redistribute it and/or modify
+ # it under the terms of the GNU Lesser General Public License as published by
+ # the Free Software Foundation, either version 3 of the License, or
+ # (at your option) any later version.
+ #
+ # This program is distributed in the hope that it will be useful,
+ # but WITHOUT ANY WARRANTY; without even the implied warranty of
+ # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ # GNU Lesser General Public License for more details.
+ #
+ # You should have received a copy of the GNU Lesser General Public License
+ # along with this programe.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import os
+import Queue
+import tempfile
+import threading
+import traceback
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.contenttypes.models import ContentType
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.core.signals import request_finished
+from django.db import connection, transaction
+from django.http import HttpRequest, QueryDict
+from django.utils import translation
+
+from autoreports.models import ReportJob, JOB_PENDING, JOB_RUNNING, JOB_DONE, JOB_FAILED
+from autoreports.utils import get_class_from_path, get_request_filters, pre_procession_request
+
+ADMIN_API_KEY = 'admin:site'
+JOB_WORKERS = 2
+JOB_TIMEOUT = 60 * 60 * 6
+JOB_POLL_INTERVAL = 30
+
+_job_pool = None
+_job_pool_lock = threading.Lock()
+_submitted_jobs = threading.local()
+
+
+class ReportJobStorage(FileSystemStorage):
+    """
+    Local filesystem store of the files generated by the jobs, by default
+    out of the MEDIA_ROOT since the reports must not be public
+    """
+
+    def __init__(self, location=None, base_url=None):
+        location = (location or getattr(settings, 'AUTOREPORTS_JOB_ROOT', None) or
+                    os.path.join(tempfile.gettempdir(), 'autoreports'))
+        super(ReportJobStorage, self).__init__(location=location, base_url=base_url)
+
+
+def get_job_storage():
+    storage_class = getattr(settings, 'AUTOREPORTS_JOB_STORAGE', 'autoreports.jobs.ReportJobStorage')
+    return get_class_from_path(storage_class)()
+
+
+def is_async_export(api=None):
+    export_async = getattr(api, 'export_async', None)
+    if export_async is None:
+        return getattr(settings, 'AUTOREPORTS_ASYNC_EXPORT', False)
+    return export_async
+
+
+def get_api_key(api):
+    from django.contrib import admin
+    from autoreports.registry import report_registry
+    for key, registered_api in report_registry.get_registered().items():
+        if registered_api is api:
+            return key
+    if admin.site._registry.get(api.model, None) is api:
+        return ADMIN_API_KEY
+    return ''
+
+
+def get_job_api(job):
+    from django.contrib import admin
+    from autoreports.api import ReportApi
+    from autoreports.registry import report_registry
+    model = job.content_type.model_class()
+    if job.api_key == ADMIN_API_KEY:
+        return admin.site._registry[model]
+    elif job.api_key:
+        return report_registry.get_api_class(job.api_key)
+    return ReportApi(model)
+
+
+def get_job_request(job):
+    """
+    Rebuilds the request that created the job with the filters that were
+    validated when it was created (the jobs of older versions only have
+    their querystring)
+    """
+    request = HttpRequest()
+    request.method = 'GET'
+    request.path = '/'
+    filters = job.options.get('filters', None)
+    if filters is None:
+        request.META['QUERY_STRING'] = str(job.options.get('query_string', ''))
+    request.GET = QueryDict(request.META.get('QUERY_STRING', ''))
+    if filters is not None:
+        request._autoreports_filters = filters
+    request.user = job.user or AnonymousUser()
+    request.LANGUAGE_CODE = job.options.get('language', None) or settings.LANGUAGE_CODE
+    return request
+
+
+def create_job(request, api, report_to, fields, list_headers, report=None):
+    user = getattr(request, 'user', None)
+    if user is not None and not user.is_authenticated():
+        user = None
+    # The job keeps the filters and the options of the report as they are
+    # now, so the later changes of the report do not change its export
+    options = {'fields': list(fields),
+               'list_headers': [unicode(label, 'utf-8') for label in list_headers],
+               'query_string': request.GET.urlencode(),
+               'filters': get_request_filters(pre_procession_request(request, api.model)),
+               'language': translation.get_language()}
+    if report is not None:
+        options['report_options'] = report.options
+    job = ReportJob.objects.create(content_type=ContentType.objects.get_for_model(api.model),
+                                   report=report,
+                                   user=user,
+                                   api_key=get_api_key(api),
+                                   report_to=report_to,
+                                   options=options)
+    submit_job(job)
+    return job
+
+
+def claim_job(job_id):
+    # Only one worker can change the status of a pending job
+    return ReportJob.objects.filter(pk=job_id, status=JOB_PENDING).update(
+                    status=JOB_RUNNING, started=datetime.datetime.now()) == 1
+
+
+def fail_stale_jobs(job_id=None):
+    """
+    The jobs that are running or pending for more than
+    AUTOREPORTS_JOB_TIMEOUT seconds are failed, their worker has died or
+    there is none
+    """
+    timeout = getattr(settings, 'AUTOREPORTS_JOB_TIMEOUT', JOB_TIMEOUT)
+    if not timeout:
+        return 0
+    now = datetime.datetime.now()
+    before = now - datetime.timedelta(seconds=timeout)
+    failed = 0
+    for status, lookup in ((JOB_RUNNING, 'started__lt'), (JOB_PENDING, 'created__lt')):
+        jobs = ReportJob.objects.filter(status=status, **{lookup: before})
+        if job_id is not None:
+            jobs = jobs.filter(pk=job_id)
+        failed += jobs.update(status=JOB_FAILED, finished=now,
+                              error='The job has been %s for more than %s seconds' % (status, timeout))
+    return failed
+
+
+def save_job_file(job, filename, content):
+    output = tempfile.NamedTemporaryFile()
+    try:
+        for chunk in content:
+            output.write(chunk)
+        output.flush()
+        return get_job_storage().save('%s/%s' % (job.pk, filename), File(output))
+    finally:
+        output.close()
+
+
+def run_job(job_id):
+    from autoreports.views import reports_content
+    if not claim_job(job_id):
+        return None
+    job = ReportJob.objects.get(pk=job_id)
+    request = get_job_request(job)
+    report = job.report
+    if report is not None and 'report_options' in job.options:
+        report.options = job.options['report_options']
+    translation.activate(request.LANGUAGE_CODE)
+    try:
+        api = get_job_api(job)
+        model = job.content_type.model_class()
+        name, writer_class, content = reports_content(request,
+                                    model._meta.app_label,
+                                    model._meta.module_name,
+                                    fields=job.options.get('fields', None),
+                                    list_headers=[label.encode('utf-8') for label in
+                                                  job.options.get('list_headers', [])],
+                                    queryset=api.get_export_queryset(request),
+                                    report=report,
+                                    report_to=job.report_to,
+                                    api=api,
+                                    chunk_size=getattr(api, 'export_chunk_size', None),
+                                    parallel=True)
+        job.file_name = save_job_file(job, name, content)
+        job.status = JOB_DONE
+    except Exception:
+        job.status = JOB_FAILED
+        job.error = traceback.format_exc()
+    finally:
+        translation.deactivate()
+    job.finished = datetime.datetime.now()
+    job.save()
+    return job
+
+
+def get_pending_jobs():
+    fail_stale_jobs()
+    return ReportJob.objects.filter(status=JOB_PENDING).order_by('created').values_list('pk', flat=True)
+
+
+def delete_jobs(before):
+    storage = get_job_storage()
+    jobs = ReportJob.objects.filter(status__in=(JOB_DONE, JOB_FAILED), finished__lt=before)
+    for job in jobs:
+        if job.file_name and storage.exists(job.file_name):
+            storage.delete(job.file_name)
+        job.delete()
+
+
+class LocalJobPool(object):
+    """
+    Threads of the current process that run the jobs that are sent to them,
+    and the pending jobs every interval seconds if it is given (the jobs
+    of the transactions that were not committed yet, or of the processes
+    that were restarted)
+    """
+
+    def __init__(self, workers=JOB_WORKERS, interval=None):
+        self.queue = Queue.Queue()
+        self.interval = interval
+        self.threads = []
+        for i in xrange(workers):
+            thread = threading.Thread(target=self.work, name='autoreports-job-%s' % i)
+            thread.setDaemon(True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, job_id):
+        self.queue.put(job_id)
+
+    def work(self):
+        while True:
+            try:
+                job_id = self.queue.get(timeout=self.interval)
+            except Queue.Empty:
+                self.run_pending_jobs()
+                continue
+            try:
+                run_job(job_id)
+            finally:
+                # Every thread has its own connection
+                connection.close()
+                self.queue.task_done()
+
+    def run_pending_jobs(self):
+        try:
+            for job_id in get_pending_jobs():
+                run_job(job_id)
+        except Exception:
+            # The database is not available, the next interval tries again
+            pass
+        finally:
+            connection.close()
+
+    def join(self):
+        self.queue.join()
+
+
+def get_job_pool():
+    global _job_pool
+    workers = getattr(settings, 'AUTOREPORTS_JOB_WORKERS', JOB_WORKERS)
+    if not workers:
+        return None
+    if _job_pool is None:
+        _job_pool_lock.acquire()
+        try:
+            if _job_pool is None:
+                _job_pool = LocalJobPool(workers, getattr(settings, 'AUTOREPORTS_JOB_POLL_INTERVAL',
+                                                          JOB_POLL_INTERVAL))
+        finally:
+            _job_pool_lock.release()
+    return _job_pool
+
+
+def submit_job(job):
+    # Without local workers the job waits for the autoreports_worker command
+    pool = get_job_pool()
+    if pool is None:
+        return
+    if transaction.is_managed():
+        # The threads of the pool do not see the job until the transaction
+        # of the request is committed
+        if not hasattr(_submitted_jobs, 'job_ids'):
+            _submitted_jobs.job_ids = []
+        _submitted_jobs.job_ids.append(job.pk)
+    else:
+        pool.submit(job.pk)
+
+
+def submit_committed_jobs(sender, **kwargs):
+    job_ids = getattr(_submitted_jobs, 'job_ids', None)
+    if not job_ids:
+        return
+    _submitted_jobs.job_ids = []
+    pool = get_job_pool()
+    if pool is not None:
+        for job_id in job_ids:
+            pool.submit(job_id)
+
+
+request_finished.connect(submit_committed_jobs)
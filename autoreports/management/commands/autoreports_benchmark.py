@@ -0,0 +1,256 @@
+ # Copyright (c) 2010 by Yaco Sistemas <pmartin@yaco.es>
+ #
+ # This program is free software: you can redistribute it and/or modify
+ # it under the terms of the GNU Lesser General Public License as published by
+ # the Free Software Foundation, either version 3 of the License, or
+ # (at your option) any later version.
+ #
+ # This program is distributed in the hope that it will be useful,
+ # but WITHOUT ANY WARRANTY; without even the implied warranty of
+ # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ # GNU Lesser General Public License for more details.
+ #
+ # You should have received a copy of the GNU Lesser General Public License
+ # along with this programe.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+from optparse import make_option
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models
+
+from autoreports.api import ReportApi
+from autoreports.exports import ROWS_PER_CHUNK, format_rows, get_values, write_export
+from autoreports.fields import clear_form_fields
+from autoreports.formats import CSVWriter
+from autoreports.models import Report
+from autoreports.parallel import get_shards, write_parallel_export
+from autoreports.model_forms import _report_form_classes
+from autoreports.utils import (clear_adaptors, filter_queryset, clear_column_accessors, get_adaptor,
+                               get_all_field_names, get_column_formatters, get_value_from_object,
+                               get_field_by_name)
+
+WIDE_MODEL_FIELDS = 500
+
+
+class Command(BaseCommand):
+    args = '<benchmark> [<benchmark> ...]'
+    help = ('Measures the overhead of autoreports. '
+            'Available benchmarks: columns, adaptors, form, filters, format, parallel')
+    option_list = BaseCommand.option_list + (
+        make_option('--model', dest='model',
+                    help='app_label.module_name of the model to use'),
+        make_option('--fields', dest='fields',
+                    help='Comma separated list of fields (default: the local fields of the model)'),
+        make_option('--rows', dest='rows', type='int', default=1000,
+                    help='Number of objects to use'),
+        make_option('--filter', dest='filters', action='append', default=[],
+                    help='lookup=value filter of the filters benchmark, it can be repeated'),
+    )
+
+    def handle(self, *benchmarks, **options):
+        if not benchmarks:
+            raise CommandError('Enter at least one benchmark')
+        if not options.get('model'):
+            raise CommandError('Enter the model with --model=app_label.module_name')
+        model = models.get_model(*options['model'].split('.'))
+        if model is None:
+            raise CommandError('Unknown model %s' % options['model'])
+        fields = options.get('fields') and options['fields'].split(',') or self.get_local_fields(model)
+        for benchmark in benchmarks:
+            func = getattr(self, 'benchmark_%s' % benchmark, None)
+            if func is None:
+                raise CommandError('Unknown benchmark %s' % benchmark)
+            if benchmark == 'filters':
+                func(model, options['filters'], options['rows'])
+            else:
+                func(model, fields, options['rows'])
+
+    def get_local_fields(self, model):
+        fields = []
+        for field_name in get_all_field_names(model):
+            field_name, field = get_field_by_name(model, field_name)
+            if not isinstance(field, models.Field) or field.rel:
+                continue
+            fields.append(field_name)
+        return fields
+
+    def timeit(self, func, *args):
+        start = time.time()
+        func(*args)
+        return time.time() - start
+
+    def report(self, label, seconds, cells, unit='cell'):
+        self.stdout.write('%-40s %10.2f us/%s %12.0f %ss/s\n' % (label,
+                                                                 seconds * 1000000 / cells, unit,
+                                                                 cells / seconds, unit))
+
+    def benchmark_columns(self, model, fields, rows):
+        objects = list(model._default_manager.all()[:rows])
+        if not objects:
+            raise CommandError('There are not objects of %s' % model.__name__)
+        cells = len(objects) * len(fields)
+        self.stdout.write('columns: %s objects x %s fields (%s)\n' % (len(objects), len(fields),
+                                                                       ', '.join(fields)))
+
+        def resolve_every_cell():
+            for obj in objects:
+                for field_name in fields:
+                    clear_column_accessors()
+                    get_value_from_object(obj, field_name)
+
+        def compiled_columns():
+            for obj in objects:
+                for field_name in fields:
+                    get_value_from_object(obj, field_name)
+
+        compiled_columns()  # warm up
+        self.report('resolving every cell (before)', self.timeit(resolve_every_cell), cells)
+        self.report('compiled columns (after)', self.timeit(compiled_columns), cells)
+
+    def benchmark_format(self, model, fields, rows):
+        values = list(get_values(model._default_manager.all()[:rows], fields))
+        if not values:
+            raise CommandError('There are not objects of %s' % model.__name__)
+        # The rows are repeated when there are less objects
+        values = [values[i % len(values)] for i in xrange(rows)]
+        formatters = get_column_formatters(model, fields)
+        cells = len(values) * len(fields)
+        self.stdout.write('format: %s rows x %s fields (%s)\n' % (len(values), len(fields),
+                                                                  ', '.join(fields)))
+        chunks = [values[i:i + ROWS_PER_CHUNK] for i in xrange(0, len(values), ROWS_PER_CHUNK)]
+
+        def format_every_cell():
+            for chunk in chunks:
+                format_rows(chunk)
+
+        def format_columns():
+            for chunk in chunks:
+                format_rows(chunk, formatters)
+
+        format_columns()  # warm up
+        self.report('get_parser_value by cell (before)', self.timeit(format_every_cell), cells)
+        self.report('column formatters (after)', self.timeit(format_columns), cells)
+
+    def benchmark_parallel(self, model, fields, rows):
+        # The shards are filtered, so the first rows are taken by their pks
+        pks = list(model._default_manager.order_by('pk').values_list('pk', flat=True)[:rows])
+        object_list = model._default_manager.filter(pk__in=pks).order_by('pk')
+        count = object_list.count()
+        if not count:
+            raise CommandError('There are not objects of %s' % model.__name__)
+        cells = count * len(fields)
+        formatters = get_column_formatters(model, fields)
+        self.stdout.write('parallel: %s objects x %s fields (%s)\n' % (count, len(fields),
+                                                                        ', '.join(fields)))
+
+        def serial():
+            values = get_values(object_list, fields)
+            for chunk in write_export(CSVWriter(), fields, values, formatters=formatters):
+                pass
+
+        def parallel(processes):
+            shards = get_shards(object_list, processes, min_rows=1)
+            for chunk in write_parallel_export(CSVWriter, fields, shards, fields,
+                                               formatters=formatters):
+                pass
+
+        serial()  # warm up
+        self.report('serial export (before)', self.timeit(serial), cells)
+        for processes in (2, 4):
+            self.report('%s processes (after)' % processes, self.timeit(parallel, processes), cells)
+
+    def get_wide_model(self, number_fields=WIDE_MODEL_FIELDS):
+        field_classes = (models.CharField, models.IntegerField, models.DateField,
+                         models.DateTimeField, models.BooleanField, models.TextField)
+        attrs = {'__module__': __name__,
+                 'Meta': type('Meta', (object, ), {'app_label': 'autoreports', 'managed': False})}
+        for i in xrange(number_fields):
+            field_class = field_classes[i % len(field_classes)]
+            kwargs = field_class is models.CharField and {'max_length': 10} or {}
+            attrs['field_%s' % i] = field_class(**kwargs)
+        return type('BenchmarkWideModel', (models.Model, ), attrs)
+
+    def benchmark_adaptors(self, model, fields, rows):
+        for model in (model, self.get_wide_model()):
+            model_fields = [get_field_by_name(model, field_name)[1]
+                            for field_name in get_all_field_names(model)]
+            lookups = len(model_fields) * rows
+            self.stdout.write('adaptors: %s fields of %s x %s\n' % (len(model_fields), model.__name__, rows))
+
+            def resolve_every_lookup():
+                for i in xrange(rows):
+                    for field in model_fields:
+                        clear_adaptors()
+                        get_adaptor(field)
+
+            def dispatch_table():
+                for i in xrange(rows):
+                    for field in model_fields:
+                        get_adaptor(field)
+
+            dispatch_table()  # warm up
+            self.report('resolving every lookup (before)', self.timeit(resolve_every_lookup), lookups)
+            self.report('dispatch table (after)', self.timeit(dispatch_table), lookups)
+
+    def benchmark_form(self, model, fields, rows):
+        options = {}
+        for i, field_name in enumerate(get_all_field_names(model)):
+            field = get_field_by_name(model, field_name)[1]
+            fil = get_adaptor(field)(model, field, field_name).get_filter_default()
+            options[field_name] = {'display': True,
+                                   'filters': fil and [fil] or [],
+                                   'order': i}
+        report = Report(content_type=ContentType.objects.get_for_model(model), options=options)
+        api = ReportApi(model)
+        self.stdout.write('form: %s fields of %s x %s renders\n' % (len(options), model.__name__, rows))
+
+        def render():
+            fields_form_filter, fields_form_display = api.get_fields_of_form(report)
+            unicode(api.get_report_form_filter(None, fields_form_filter))
+            unicode(api.get_report_form_display(None, fields_form_display))
+
+        def build_every_form():
+            for i in xrange(rows):
+                clear_form_fields()
+                _report_form_classes.clear()
+                render()
+
+        def cached_forms():
+            for i in xrange(rows):
+                render()
+
+        cached_forms()  # warm up
+        self.report('building every form (before)', self.timeit(build_every_form), rows, 'render')
+        self.report('cached form fields (after)', self.timeit(cached_forms), rows, 'render')
+
+    def explain(self, queryset):
+        sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+        cursor = connection.cursor()
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN %s' % sql, params)
+        else:
+            cursor.execute('EXPLAIN %s' % sql, params)
+        return [sql] + [' '.join([unicode(column) for column in row]) for row in cursor.fetchall()]
+
+    def benchmark_filters(self, model, filters, rows):
+        if not filters:
+            raise CommandError('Enter the filters with --filter=lookup=value')
+        filters = dict([str(fil).split('=', 1) for fil in filters])
+        queryset = model._default_manager.all()
+        distinct = queryset.filter(**filters).distinct()
+        semi_join = filter_queryset(queryset, [models.Q(**{fil: value}) for fil, value in filters.items()])
+        if list(distinct.values_list('pk', flat=True)) != list(semi_join.values_list('pk', flat=True)):
+            raise CommandError('The results are different')
+        self.stdout.write('filters: %s on %s, %s objects\n' % (filters, model.__name__, distinct.count()))
+        for label, queryset in (('distinct (before)', distinct), ('semi-join (after)', semi_join)):
+            self.stdout.write('%s\n    %s\n' % (label, '\n    '.join(self.explain(queryset))))
+
+        def fetch(queryset):
+            for i in xrange(rows):
+                list(queryset.all())
+
+        self.report('distinct (before)', self.timeit(fetch, distinct), rows, 'run')
+        self.report('semi-join (after)', self.timeit(fetch, semi_join), rows, 'run')
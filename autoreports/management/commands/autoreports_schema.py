@@ -0,0 +1,68 @@
+ # Copyright (c) 2010 by Yaco Sistemas <pmartin@yaco.es>
+ #
+ # This program is free software: you can redistribute it and/or modify
+ # it under the terms of the GNU Lesser General Public License as published by
+ # the Free Software Foundation, either version 3 of the License, or
+ # (at your option) any later version.
+ #
+ # This program is distributed in the hope that it will be useful,
+ # but WITHOUT ANY WARRANTY; without even the implied warranty of
+ # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ # GNU Lesser General Public License for more details.
+ #
+ # You should have received a copy of the GNU Lesser General Public License
+ # along with this programe.  If not, see <http://www.gnu.org/licenses/>.
+
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models
+from django.utils import translation
+
+from autoreports.utils import get_model_schema
+
+
+class Command(BaseCommand):
+    args = '[<app_label> | <app_label.module_name> ...]'
+    help = ('Builds the schema of the models that the wizard uses and keeps it in the cache. '
+            'By default the schema of every installed model')
+    option_list = BaseCommand.option_list + (
+        make_option('--languages', dest='languages',
+                    help='Comma separated list of languages (default: the LANGUAGES setting)'),
+    )
+
+    def get_models(self, labels):
+        if not labels:
+            return models.get_models()
+        model_list = []
+        for label in labels:
+            if '.' in label:
+                model = models.get_model(*label.split('.'))
+                if model is None:
+                    raise CommandError('Unknown model %s' % label)
+                model_list.append(model)
+            else:
+                model_list.extend(models.get_models(models.get_app(label)))
+        return model_list
+
+    def handle(self, *labels, **options):
+        verbosity = int(options.get('verbosity', 1))
+        if options.get('languages'):
+            languages = options['languages'].split(',')
+        else:
+            languages = [language for language, language_name in settings.LANGUAGES]
+        model_list = self.get_models(labels)
+        for language in languages:
+            translation.activate(language)
+            try:
+                for model in model_list:
+                    get_model_schema(model, rebuild=True)
+                    if verbosity > 1:
+                        self.stdout.write('%s.%s (%s)\n' % (model._meta.app_label,
+                                                            model._meta.module_name,
+                                                            language))
+            finally:
+                translation.deactivate()
+        if verbosity > 0:
+            self.stdout.write('Schema of %s models in %s languages\n' % (len(model_list), len(languages)))
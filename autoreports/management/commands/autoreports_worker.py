@@ -0,0 +1,60 @@
+ # Copyright (c) 2010 by Yaco Sistemas <pmartin@yaco.es>
+ #
+ # This program is free software: you can redistribute it and/or modify
+ # it under the terms of the GNU Lesser General Public License as published by
+ # the Free Software Foundation, either version 3 of the License, or
+ # (at your option) any later version.
+ #
+ # This program is distributed in the hope that it will be useful,
+ # but WITHOUT ANY WARRANTY; without even the implied warranty of
+ # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ # GNU Lesser General Public License for more details.
+ #
+ # You should have received a copy of the GNU Lesser General Public License
+ # along with this programe.  If not, see <http://www.gnu.org/licenses/>.
+
+import datetime
+import time
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from autoreports.jobs import LocalJobPool, delete_jobs, get_pending_jobs, run_job
+
+
+class Command(BaseCommand):
+    help = 'Runs the pending report jobs'
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', dest='workers', type='int', default=1,
+                    help='Number of threads that run the jobs'),
+        make_option('--interval', dest='interval', type='float', default=5,
+                    help='Seconds between the checks of pending jobs'),
+        make_option('--once', dest='once', action='store_true', default=False,
+                    help='Run the pending jobs and exit'),
+        make_option('--delete-days', dest='delete_days', type='int', default=None,
+                    help='Delete the finished jobs (and their files) older than these days'),
+    )
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity', 1))
+        pool = None
+        if options['workers'] > 1:
+            pool = LocalJobPool(options['workers'])
+        while True:
+            if options['delete_days'] is not None:
+                delete_jobs(datetime.datetime.now() - datetime.timedelta(days=options['delete_days']))
+            for job_id in get_pending_jobs():
+                if pool is not None:
+                    pool.submit(job_id)
+                    continue
+                job = run_job(job_id)
+                if job is not None and verbosity > 1:
+                    self.stdout.write('Job %s: %s\n' % (job.pk, job.status))
+            if pool is not None:
+                pool.join()
+            if options['once']:
+                break
+            connection.close()
+            time.sleep(options['interval'])
@@ -1,6 +1,8 @@
 from django.forms.models import ModelFormMetaclass, get_declared_fields, media_property, ModelFormOptions, ModelForm
 from django.utils.datastructures import SortedDict
 
+_report_form_classes = {}
+
 
 def modelform_factory(model, form=ModelForm, fields=None, exclude=None,
                        formfield_callback=lambda f: f.formfield()):
@@ -33,6 +35,20 @@ def modelform_factory(model, form=ModelForm, fields=None, exclude=None,
     return form.__metaclass__(class_name, (form, ), form_class_attrs)
 
 
+def reportform_factory(model, form, base_fields):
+    """
+    The form class of a model is built once, every report gets a subclass
+    with its fields that does not go through the metaclass
+    """
+    key = (model, form)
+    form_class = _report_form_classes.get(key, None)
+    if form_class is None:
+        form_class = modelform_factory(model=model, form=form)
+        _report_form_classes[key] = form_class
+    return type.__new__(type(form_class), form_class.__name__, (form_class, ),
+                        {'base_fields': base_fields})
+
+
 def fields_for_model(model, fields=None, exclude=None, formfield_callback=lambda f: f.formfield()):
     """
     Returns a ``SortedDict`` containing form fields for the given model.
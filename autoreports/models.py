@@ -13,13 +13,23 @@
  # You should have received a copy of the GNU Lesser General Public License
  # along with this programe.  If not, see <http://www.gnu.org/licenses/>.
 
+import datetime
+import uuid
+
+from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
+from django.core.urlresolvers import reverse
 from django.db import models
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.utils.translation import ugettext_lazy as _
 
 from configfield.dbfields import JSONField
 from south.modelsinspector import add_introspection_rules
 
+from autoreports.cache import invalidate_export_cache
+from autoreports.utils import clear_compiled_report, get_compiled_report, get_options_hash
+
 
 class BaseReport(models.Model):
     name = models.CharField(_('Name'), max_length=200)
@@ -35,17 +45,14 @@ class BaseReport(models.Model):
 
     @property
     def report_filter_fields_tuple(self):
-        report_filter = []
         if self.options:
-            for field_name, opts in self.options.items():
-                for fil in self.options[field_name].get('filters', []):
-                    report_filter.append("%s__%s" % (field_name, fil))
-        return tuple(report_filter)
+            return get_compiled_report(self).filter_fields
+        return tuple()
 
     @property
     def report_display_fields_tuple(self):
         if self.options:
-            return tuple([field_name for field_name in self.options if self.options[field_name].get('display', False)])
+            return get_compiled_report(self).display_fields
         return tuple()
 
     class Meta:
@@ -58,6 +65,15 @@ class BaseReport(models.Model):
 
 
 class Report(BaseReport):
+    # Denormalized from the options when the report is saved, so the
+    # listings do not load them
+    column_count = models.PositiveIntegerField(_('Columns'), default=0, db_index=True)
+    filter_count = models.PositiveIntegerField(_('Filters'), default=0, db_index=True)
+    options_hash = models.CharField(_('Options hash'), max_length=32, blank=True, db_index=True)
+    # Updated when the report is exported
+    run_count = models.PositiveIntegerField(_('Runs'), default=0)
+    last_run = models.DateTimeField(_('Last run'), blank=True, null=True, db_index=True)
+    last_run_seconds = models.FloatField(_('Seconds of the last run'), blank=True, null=True)
 
     def get_redirect_wizard(self, report=None):
         if report:
@@ -65,11 +81,106 @@ class Report(BaseReport):
         else:
             return '../%s' % self.id
 
+    def update_metadata(self):
+        options = self.options or {}
+        self.column_count = len([field_name for field_name, opts in options.items()
+                                 if opts.get('display', False)])
+        self.filter_count = sum([len(opts.get('filters', None) or []) for opts in options.values()])
+        self.options_hash = get_options_hash(self)[0]
+
+    def save(self, *args, **kwargs):
+        # The options could have been changed in place
+        clear_compiled_report(self)
+        self.update_metadata()
+        super(Report, self).save(*args, **kwargs)
+
+    def record_run(self, seconds=None):
+        # An update, so the options are neither loaded nor saved again
+        self.last_run = datetime.datetime.now()
+        self.last_run_seconds = seconds
+        Report.objects.filter(pk=self.pk).update(run_count=F('run_count') + 1,
+                                                 last_run=self.last_run,
+                                                 last_run_seconds=seconds)
+        self.run_count += 1
+
     class Meta:
         verbose_name = _('report')
         verbose_name_plural = _('reports')
 
 
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+JOB_STATUS_CHOICES = (
+    (JOB_PENDING, _('Pending')),
+    (JOB_RUNNING, _('Running')),
+    (JOB_DONE, _('Done')),
+    (JOB_FAILED, _('Failed')),
+)
+
+
+class ReportJob(models.Model):
+    content_type = models.ForeignKey(ContentType, verbose_name=_('Content type'))
+    report = models.ForeignKey(Report, verbose_name=_('Report'), blank=True, null=True)
+    user = models.ForeignKey(User, verbose_name=_('User'), blank=True, null=True)
+    api_key = models.CharField(_('Api'), max_length=200, blank=True)
+    # The jobs without user are only seen with their token
+    token = models.CharField(_('Token'), max_length=32, blank=True)
+    report_to = models.CharField(_('Format'), max_length=20)
+    status = models.CharField(_('Status'), max_length=20, choices=JOB_STATUS_CHOICES,
+                              default=JOB_PENDING, db_index=True)
+    options = JSONField(blank=True, null=True)
+    # Format: {'fields': ['field_name', ...],
+              #'list_headers': ['label', ...],
+              #'query_string': 'field_name__filter=value&...',
+              #'filters': {'field_name__filter': 'value', ...},
+              #'report_options': {...},
+              #'language': 'en'}
+    file_name = models.CharField(_('File name'), max_length=255, blank=True)
+    error = models.TextField(_('Error'), blank=True)
+    created = models.DateTimeField(_('Created'), auto_now_add=True)
+    started = models.DateTimeField(_('Started'), blank=True, null=True)
+    finished = models.DateTimeField(_('Finished'), blank=True, null=True)
+
+    class Meta:
+        verbose_name = _('report job')
+        verbose_name_plural = _('report jobs')
+        ordering = ('-created', )
+
+    def __unicode__(self):
+        return u'%s (%s)' % (self.content_type, self.get_status_display())
+
+    @property
+    def is_finished(self):
+        return self.status in (JOB_DONE, JOB_FAILED)
+
+    def save(self, *args, **kwargs):
+        if not self.user_id and not self.token:
+            self.token = uuid.uuid4().hex
+        super(ReportJob, self).save(*args, **kwargs)
+
+    def get_token_querystring(self):
+        if self.user_id:
+            return ''
+        return '?token=%s' % self.token
+
+    def get_absolute_url(self):
+        return reverse('reports_job', args=(self.pk, )) + self.get_token_querystring()
+
+    def get_download_url(self):
+        if self.status != JOB_DONE:
+            return None
+        return reverse('reports_job_download', args=(self.pk, )) + self.get_token_querystring()
+
+
+# ----- invalidating the cached exports of the reported models -----
+post_save.connect(invalidate_export_cache)
+post_delete.connect(invalidate_export_cache)
+m2m_changed.connect(invalidate_export_cache)
+
+
 # ----- adding south rules to help introspection -----
 rules_jsonfield = [
   (
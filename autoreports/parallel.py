@@ -0,0 +1,170 @@
+ # Copyright (c) 2010 by Yaco Sistemas <pmartin@yaco.es>
+ #
+ # This program is free software: you can redistribute it and/or modify
+ # it under the terms of the GNU Lesser General Public License as published by
+ # the Free Software Foundation, either version 3 of the License, or
+ # (at your option) any later version.
+ #
+ # This program is distributed in the hope that it will be useful,
+ # but WITHOUT ANY WARRANTY; without even the implied warranty of
+ # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ # GNU Lesser General Public License for more details.
+ #
+ # You should have received a copy of the GNU Lesser General Public License
+ # along with this programe.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+import threading
+import traceback
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+from django.conf import settings
+from django.db import connections
+from django.db.models.query import QuerySet
+from django.utils import translation
+
+from autoreports.exports import (_get_pk_ordering, _iter_output, get_values, iter_file,
+                                 write_export)
+from autoreports.utils import SEPARATED_FIELD
+
+EXPORT_PROCESSES = 1
+PARALLEL_MIN_ROWS = 10000
+
+# The connections inherited from the parent, see reset_connections
+_inherited_connections = []
+
+
+class ParallelExportError(Exception):
+    pass
+
+
+def get_export_processes(api=None):
+    processes = getattr(api, 'export_processes', None)
+    if processes is None:
+        processes = getattr(settings, 'AUTOREPORTS_EXPORT_PROCESSES', EXPORT_PROCESSES)
+    # A daemonic process can not have children, and the forks of a thread
+    # would copy the locks and connections that the other threads hold
+    if (multiprocessing is None or multiprocessing.current_process().daemon or
+        not isinstance(threading.current_thread(), threading._MainThread)):
+        return 1
+    return processes or multiprocessing.cpu_count()
+
+
+def get_shards(object_list, processes, min_rows=None):
+    """
+    Splits the queryset in ranges of primary keys with the same number of
+    objects, in the order of the export. Returns None if the queryset is not
+    ordered by its primary key or it is too small
+    """
+    if processes < 2 or not isinstance(object_list, QuerySet):
+        return None
+    ordering = _get_pk_ordering(object_list)
+    if not ordering:
+        return None
+    min_rows = min_rows or getattr(settings, 'AUTOREPORTS_EXPORT_PARALLEL_MIN_ROWS', PARALLEL_MIN_ROWS)
+    object_list = object_list.order_by(ordering)
+    count = object_list.count()
+    processes = min(processes, count // min_rows)
+    if processes < 2:
+        return None
+    pks = object_list.values_list('pk', flat=True)
+    starts = [pks[i * count // processes] for i in xrange(processes)]
+    if ordering == 'pk':
+        first_lookup, next_lookup = 'pk__gte', 'pk__lt'
+    else:
+        first_lookup, next_lookup = 'pk__lte', 'pk__gt'
+    shards = []
+    for i, start in enumerate(starts):
+        shard = object_list.filter(**{first_lookup: start})
+        if i + 1 < len(starts):
+            shard = shard.filter(**{next_lookup: starts[i + 1]})
+        shards.append(shard)
+    return shards
+
+
+def reset_connections():
+    # A forked process opens its own connections. The ones of the parent
+    # share their sockets with it, freeing them would close them (psycopg2
+    # and MySQLdb say goodbye to the server), so they are kept alive until
+    # the process exits. The in-memory databases only exist in the copy of
+    # the parent.
+    for connection in connections.all():
+        if connection.vendor == 'sqlite' and connection.settings_dict['NAME'] in ('', ':memory:'):
+            continue
+        if connection.connection is not None:
+            _inherited_connections.append(connection.connection)
+        connection.connection = None
+
+
+def render_shard(path, object_list, list_fields, writer_class, formatters=None,
+                 separated_field=SEPARATED_FIELD, api=None, chunk_size=None, language=None):
+    reset_connections()
+    if language:
+        translation.activate(language)
+    output = open(path, 'wb')
+    try:
+        try:
+            values = get_values(object_list, list_fields, separated_field=separated_field,
+                                api=api, chunk_size=chunk_size)
+            for chunk in write_export(writer_class(), None, values, formatters=formatters):
+                output.write(chunk)
+        except Exception:
+            error = open('%s.error' % path, 'wb')
+            error.write(traceback.format_exc())
+            error.close()
+            raise
+    finally:
+        output.close()
+
+
+def write_parallel_export(writer_class, columns, shards, list_fields, formatters=None,
+                          separated_field=SEPARATED_FIELD, api=None, chunk_size=None):
+    """
+    Renders every shard in a process and yields their output in order, the
+    writer must be able to concatenate the output of several writers
+    (writer_class.can_split). The processes are forked, so it is not used in
+    the web requests nor in daemonic processes
+    """
+    directory = tempfile.mkdtemp()
+    workers = []
+    try:
+        for i, shard in enumerate(shards):
+            path = os.path.join(directory, str(i))
+            worker = multiprocessing.Process(target=render_shard,
+                                             args=(path, shard, list_fields, writer_class),
+                                             kwargs={'formatters': formatters,
+                                                     'separated_field': separated_field,
+                                                     'api': api,
+                                                     'chunk_size': chunk_size,
+                                                     'language': translation.get_language()})
+            worker.daemon = True
+            worker.start()
+            workers.append((worker, path))
+        writer = writer_class()
+        if columns is not None:
+            for chunk in _iter_output(writer.write_header(columns)):
+                yield chunk
+        for worker, path in workers:
+            worker.join()
+            if worker.exitcode != 0:
+                error = ''
+                if os.path.exists('%s.error' % path):
+                    error = open('%s.error' % path, 'rb').read()
+                raise ParallelExportError('The process of %s failed\n%s' % (path, error))
+            for chunk in iter_file(open(path, 'rb')):
+                yield chunk
+            os.remove(path)
+        for chunk in _iter_output(writer.finish()):
+            yield chunk
+    finally:
+        for worker, path in workers:
+            if worker.is_alive():
+                worker.terminate()
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
@@ -0,0 +1,163 @@
+ # Copyright (c) 2010 by Yaco Sistemas <pmartin@yaco.es>
+ #
+ # This program is free software: you can redistribute it and/or modify
+ # it under the terms of the GNU Lesser General Public License as published by
+ # the Free Software Foundation, either version 3 of the License, or
+ # (at your option) any later version.
+ #
+ # This program is distributed in the hope that it will be useful,
+ # but WITHOUT ANY WARRANTY; without even the implied warranty of
+ # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ # GNU Lesser General Public License for more details.
+ #
+ # You should have received a copy of the GNU Lesser General Public License
+ # along with this programe.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.db.models.query import EmptyQuerySet, QuerySet, ValuesQuerySet
+from django.db.models.sql.datastructures import EmptyResultSet
+
+from autoreports.exports import get_aggregated_columns, get_values, is_aggregated_report, write_export
+from autoreports.utils import SEPARATED_FIELD
+
+PREFLIGHT_MAX_COUNT = 100000
+PREFLIGHT_SAMPLE_ROWS = 20
+
+EXPORT_ALLOWED = 'allowed'
+EXPORT_ASYNC = 'async'
+EXPORT_REFUSED = 'refused'
+
+POSTGRESQL_PLAN_ROWS = re.compile(r'rows=(\d+)')
+
+
+def get_export_limit(api, name):
+    """
+    The limits of the exports (max_rows, async_rows) are taken from the api
+    (export_max_rows) or from the settings (AUTOREPORTS_EXPORT_MAX_ROWS)
+    """
+    value = getattr(api, 'export_%s' % name, None)
+    if value is None:
+        return getattr(settings, 'AUTOREPORTS_EXPORT_%s' % name.upper(), None)
+    return value
+
+
+def has_export_limits(api=None):
+    return bool(get_export_limit(api, 'max_rows') or get_export_limit(api, 'async_rows'))
+
+
+def get_planner_rows(queryset):
+    """ The rows that the planner of the database expects, or None """
+    try:
+        sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+    except EmptyResultSet:
+        return 0
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        cursor = connection.cursor()
+        try:
+            cursor.execute('EXPLAIN %s' % sql, params)
+        except DatabaseError:
+            return None
+        match = POSTGRESQL_PLAN_ROWS.search(cursor.fetchone()[0])
+        return match and int(match.group(1)) or None
+    elif connection.vendor == 'mysql':
+        cursor = connection.cursor()
+        try:
+            cursor.execute('EXPLAIN %s' % sql, params)
+        except DatabaseError:
+            return None
+        columns = [column[0] for column in cursor.description]
+        row = cursor.fetchone()
+        if row is None or not 'rows' in columns:
+            return None
+        return row[columns.index('rows')]
+    return None
+
+
+def count_rows(queryset, max_count=PREFLIGHT_MAX_COUNT):
+    """
+    Counts until max_count, returns the count (max_count + 1 if there are
+    more rows) and if it is exact. The count is done over a limited subquery,
+    QuerySet.count() would drop the limit of the SQL and count every row
+    """
+    if isinstance(queryset, EmptyQuerySet):
+        return (0, True)
+    if not isinstance(queryset, ValuesQuerySet):
+        queryset = queryset.values_list('pk', flat=True)
+    queryset = queryset.order_by()[:max_count + 1]
+    try:
+        sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+    except EmptyResultSet:
+        return (0, True)
+    cursor = connections[queryset.db].cursor()
+    cursor.execute('SELECT COUNT(*) FROM (%s) autoreports_count' % sql, params)
+    count = cursor.fetchone()[0]
+    return (count, count <= max_count)
+
+
+def get_max_count(api=None):
+    # The count goes beyond the limits, so they can be checked
+    return max(getattr(settings, 'AUTOREPORTS_PREFLIGHT_MAX_COUNT', PREFLIGHT_MAX_COUNT),
+               get_export_limit(api, 'max_rows') or 0,
+               get_export_limit(api, 'async_rows') or 0)
+
+
+def estimate_rows(queryset, max_count=None, api=None):
+    """
+    The estimate of the planner is used when it is available, but it can be
+    stale: when it goes beyond the limits of the exports, the rows are
+    counted before refusing the export or sending it to the background
+    """
+    max_count = max_count or get_max_count(api)
+    if not isinstance(queryset, QuerySet):
+        return (len(queryset), True)
+    rows = None
+    if getattr(settings, 'AUTOREPORTS_PREFLIGHT_PLANNER', True):
+        rows = get_planner_rows(queryset)
+    if rows is not None and check_export({'rows': rows}, api) == EXPORT_ALLOWED:
+        return (rows, False)
+    return count_rows(queryset, max_count)
+
+
+def estimate_export(object_list, list_fields, list_headers, writer_class, report=None,
+                    separated_field=SEPARATED_FIELD, api=None,
+                    sample_rows=PREFLIGHT_SAMPLE_ROWS):
+    """
+    Returns the estimated rows, columns and bytes of an export, the bytes
+    are extrapolated from the output of the first rows. The grouped reports
+    only count their groups, their bytes are unknown (None)
+    """
+    if is_aggregated_report(report):
+        list_headers, group_adaptors, aggregates = get_aggregated_columns(report, api)
+        lookups = [adaptor.field_name_parsed for adaptor in group_adaptors]
+        rows, exact = (1, True)
+        if lookups:
+            rows, exact = count_rows(object_list.order_by().values(*lookups).distinct(),
+                                     get_max_count(api))
+        return {'rows': rows, 'exact': exact,
+                'columns': len(list_headers), 'bytes': None}
+    rows, exact = estimate_rows(object_list, api=api)
+    header_size = len(''.join(write_export(writer_class(), list_headers, [])))
+    size = header_size
+    if rows:
+        values = list(get_values(object_list[:sample_rows], list_fields,
+                                 separated_field=separated_field, api=api))
+        if values:
+            sample_size = len(''.join(write_export(writer_class(), list_headers, values)))
+            size += (sample_size - header_size) * rows / len(values)
+    return {'rows': rows, 'exact': exact,
+            'columns': len(list_headers), 'bytes': size}
+
+
+def check_export(estimate, api=None):
+    """ Returns if the export is allowed, refused or sent to the background """
+    max_rows = get_export_limit(api, 'max_rows')
+    if max_rows and estimate['rows'] > max_rows:
+        return EXPORT_REFUSED
+    async_rows = get_export_limit(api, 'async_rows')
+    if async_rows and estimate['rows'] > async_rows:
+        return EXPORT_ASYNC
+    return EXPORT_ALLOWED
@@ -17,7 +17,10 @@ from django.conf.urls.defaults import patterns, url
 
 urlpatterns = patterns('autoreports.views',
     url(r'^ajax/fields/tree/$', 'reports_ajax_fields', name='reports_ajax_fields'),
+    url(r'^ajax/fields/trees/$', 'reports_ajax_fields_batch', name='reports_ajax_fields_batch'),
     url(r'^ajax/fields/options/$', 'reports_ajax_fields_options', name='reports_ajax_fields_options'),
+    url(r'^jobs/(?P<job_id>\d+)/$', 'reports_job', name='reports_job'),
+    url(r'^jobs/(?P<job_id>\d+)/download/$', 'reports_job_download', name='reports_job_download'),
 
 
     url(r'^(category/(?P<category_key>[\w-]+)/)?$', 'reports_list', name='reports_list'),
@@ -13,24 +13,44 @@
  # You should have received a copy of the GNU Lesser General Public License
  # along with this programe.  If not, see <http://www.gnu.org/licenses/>.
 
+import datetime
+import decimal
+import operator
+import threading
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
+
+try:
+    from collections import Iterable
+except ImportError:
+    Iterable = None
+
 from django.conf import settings
 from django.contrib.contenttypes.generic import GenericForeignKey
 from django.contrib.admin.views.main import (ALL_VAR, ORDER_VAR, ORDER_TYPE_VAR, PAGE_VAR, SEARCH_VAR,
                                              TO_FIELD_VAR, IS_POPUP_VAR, ERROR_FLAG)
 from django.contrib.sites.models import Site
+from django.core.cache import cache
 from django.db import models
 from django.db.models.fields.related import RelatedField
+from django.db.models.query import QuerySet
+from django.db.models.sql.constants import LHS_ALIAS, LOOKUP_SEP, RHS_JOIN_COL, TABLE_NAME
 from django.db.models.related import RelatedObject
 from django.http import QueryDict
+from django.utils import simplejson
+from django.utils import tree
+from django.utils.datastructures import SortedDict
+from django.utils.encoding import force_unicode
 try:
     from django.utils.importlib import import_module
 except:
     from importlib import import_module
-from django.utils.translation import ugettext_lazy as _
 from django.utils.translation import get_language
 
 from autoreports.adaptors import AUTOREPORTS_ADAPTOR as DEFAULT_AUTOREPORTS_ADAPTOR
-from autoreports import csv_to_excel
 
 try:
     import transmeta
@@ -39,17 +59,6 @@ except ImportError:
     IMPORTABLE_TRANSMETA = False
 
 
-EXPORT_FORMATS = {
-    'csv': {
-        'file_extension': 'csv',
-        'label': _('Report to CSV'),
-    },
-    'excel': {
-        'file_extension': 'xls',
-        'label': _('Report to Excel'),
-    },
-}
-
 EXCLUDE_FIELDS = ('batchadmin_checkbox', 'action_checkbox',
                   ALL_VAR, ORDER_VAR, ORDER_TYPE_VAR, PAGE_VAR, SEARCH_VAR,
                   TO_FIELD_VAR, IS_POPUP_VAR, ERROR_FLAG)
@@ -58,127 +67,254 @@ SEPARATED_FIELD = "$__$"
 
 
 def is_iterable(value):
-    try:
-        import collections
-        return isinstance(value, collections.Iterable)
-    except (ImportError, AttributeError):
-        return getattr(value, '__iter__', False) and True
+    if Iterable is not None:
+        return isinstance(value, Iterable)
+    return getattr(value, '__iter__', False) and True
 
 
-def add_domain(value):
-    site = Site.objects.get_current()
-    value = 'http://%s%s' % (site.domain, value)
+def add_domain(value, domain=None):
+    if domain is None:
+        domain = Site.objects.get_current().domain
+    value = 'http://%s%s' % (domain, value)
     return value
 
 
-def pre_procession_request(request, model, lite=False):
+def prepare_add_domain(context):
+    domain = context.get('site_domain', lambda: Site.objects.get_current().domain)
+    return lambda value: add_domain(value, domain)
 
-    class RequestFake(object):
+add_domain.prepare = prepare_add_domain
+
+
+def bulk_value(bulk_function):
+    """
+    Decorator of the functions of the reports, bulk_function(objects)
+    returns the values of a list of objects at once (or None to get them
+    object by object)
+    """
+    def decorator(func):
+        func.bulk_value = bulk_function
+        return func
+    return decorator
 
-        def __init__(self, request, model, lite=False, *args, **kwargs):
-            new_get = None
-            setattr(self, 'user', getattr(request, 'user', None))
-            try:
-                path = request.get_full_path()
-                path_index = path.index("?")
-                new_get = QueryDict(path[path_index + 1:], mutable=True)
-                if lite:
-                    self.GET = QueryDict("")
-                    return
-                for key, value in new_get.lists():
-                    if not key.startswith('__'):
-                        key_with_filter = '__'.join(key.split('__')[:-1])
-                        try:
-                            model_field, field = get_field_from_model(model, key_with_filter, separated_field='__')
-                            adaptor = get_adaptor(field)
-                            adaptor = adaptor(model, field, key_with_filter)
-                            value, new_get = adaptor.change_value(value, key, new_get)
-                            if key in new_get:
-                                new_get.setlist(key, value)
-                        except models.FieldDoesNotExist:
-                            del new_get[key]
-                self.GET = new_get
-            except ValueError:
-                self.GET = QueryDict("")
-
-        def convert_filter_datetime(self, key, endswith, filters, filters_clean):
-            key_new = key.replace(endswith, '')
-            value_new = '%s %s' % (filters.get('%s_0' % key_new, ''),
-                                    filters.get('%s_1' % key_new, ''))
-            value_new = value_new.strip()
-            return (key_new, value_new)
-
-    if isinstance(request, RequestFake):
-        return request
 
-    request_fake = RequestFake(request, model, lite)
-    request_fake.get_full_path = request.get_full_path
-    if request_fake.GET != request.GET:
-        return request_fake
+class ExportContext(object):
+    """
+    What the function columns need during an export, resolved once by
+    export. A middleware of the function columns (FuncField.middleware_value)
+    can have a prepare(context) attribute that returns the function used
+    in the export, and keep its inputs with context.get(key, setup)
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.middlewares = {}
+
+    def get(self, key, setup):
+        try:
+            return self.values[key]
+        except KeyError:
+            value = self.values[key] = setup()
+            return value
+
+    def get_middleware(self, middleware):
+        try:
+            return self.middlewares[middleware]
+        except KeyError:
+            prepare = getattr(middleware, 'prepare', None)
+            prepared = self.middlewares[middleware] = prepare and prepare(self) or middleware
+            return prepared
+
+
+MAX_REQUEST_ADAPTORS = 10000
+
+_request_adaptors = {}
+
+
+def clear_request_adaptors():
+    _request_adaptors.clear()
+
+
+def get_request_adaptor(model, key_with_filter):
+    # The adaptor that normalizes the values of a GET key, None if it is not a field
+    key = (model, key_with_filter, get_language())
+    try:
+        return _request_adaptors[key]
+    except KeyError:
+        pass
+    try:
+        model_field, field = get_field_from_model(model, key_with_filter, separated_field='__')
+        adaptor = get_adaptor(field)(model, field, key_with_filter)
+    except models.FieldDoesNotExist:
+        adaptor = None
+    if len(_request_adaptors) >= MAX_REQUEST_ADAPTORS:
+        _request_adaptors.clear()
+    _request_adaptors[key] = adaptor
+    return adaptor
+
+
+def normalize_request_get(request_get, model):
+    new_get = request_get.copy()
+    try:
+        for key, value in new_get.lists():
+            if key.startswith('__'):
+                continue
+            adaptor = get_request_adaptor(model, '__'.join(key.split('__')[:-1]))
+            if adaptor is None:
+                del new_get[key]
+                continue
+            value, new_get = adaptor.change_value(value, key, new_get)
+            if key in new_get:
+                new_get.setlist(key, value)
+    except ValueError:
+        return QueryDict("")
+    return new_get
+
+
+class ReportRequest(object):
+    """
+    The request with its GET normalized by the adaptors of the fields of
+    the model, or without GET if it is lite
+    """
+
+    def __init__(self, request, model, lite=False):
+        self.user = getattr(request, 'user', None)
+        self.get_full_path = request.get_full_path
+        if lite:
+            self.GET = QueryDict("")
+        else:
+            self.GET = normalize_request_get(request.GET, model)
+
+    def convert_filter_datetime(self, key, endswith, filters, filters_clean):
+        key_new = key.replace(endswith, '')
+        value_new = '%s %s' % (filters.get('%s_0' % key_new, ''),
+                                filters.get('%s_1' % key_new, ''))
+        value_new = value_new.strip()
+        return (key_new, value_new)
+
+
+def pre_procession_request(request, model, lite=False):
+    if isinstance(request, ReportRequest):
+        return request
+    # The changelist and the export of the same request share it
+    report_requests = getattr(request, '_autoreports_requests', None)
+    if report_requests is None:
+        report_requests = request._autoreports_requests = {}
+    key = (model, lite, request.get_full_path())
+    report_request = report_requests.get(key, None)
+    if report_request is None:
+        report_request = ReportRequest(request, model, lite)
+        report_requests[key] = report_request
+    if report_request.GET != request.GET:
+        return report_request
     return request
 
 
 def get_available_formats():
-    formats = {}
-    for format, format_data in EXPORT_FORMATS.items():
-        if format == 'excel' and not csv_to_excel.HAS_PYEXCELERATOR:
-            continue
-        formats[format] = format_data
+    from autoreports.formats import export_formats
+    formats = SortedDict({})
+    for format, writer_class in export_formats.get_available_formats().items():
+        formats[format] = {'file_extension': writer_class.file_extension,
+                           'label': writer_class.label,
+                           'mimetype': writer_class.mimetype}
     return formats
 
 
-def get_ordered_fields(report):
-    return sorted(report.options.iteritems(),
+def sort_options(options):
+    return sorted(options.iteritems(),
                   key=lambda e: len(e) > 0 and e[1].get('order', -1) or -1)
 
 
-def get_adaptors_from_report(report):
-    model = report.content_type.model_class()
-    adaptors = []
-    if not report.options:
-        return adaptors
-    report_options_order = get_ordered_fields(report)
-    for field_name, ops in report_options_order:
-        model_field, field = get_field_from_model(model, field_name)
-        adaptors.append(get_adaptor(field)(model, field, field_name, instance=report, treatment_transmeta=False))
-    return adaptors
+def get_ordered_fields(report):
+    return list(get_compiled_report(report).fields)
 
 
-def get_adaptor(field):
-    from autoreports.fields import BaseReportField
-    adaptor = None
-    if isinstance(field, models.CharField) or isinstance(field, models.TextField):
+def get_adaptors_from_report(report, api=None):
+    return get_compiled_report(report).get_adaptors(report, api)
+
+
+# The same order than the old isinstance cascade, the first one wins
+ADAPTOR_FIELD_TYPES = (
+    ((models.CharField, models.TextField), 'text'),
+    ((models.AutoField, ), 'autonumber'),
+    ((models.IntegerField, models.FloatField), 'number'),
+    ((models.BooleanField, ), 'boolean'),
+    ((models.DateTimeField, ), 'datetime'),
+    ((models.DateField, ), 'date'),
+    ((models.ForeignKey, ), 'fk'),
+    ((models.ManyToManyField, ), 'm2m'),
+    ((RelatedObject, ), 'relatedreverse'),
+)
+
+MAX_FIELD_ADAPTORS = 10000
+
+_adaptor_classes = {}
+_adaptor_types = {}
+_field_adaptors = {}
+
+
+def clear_adaptors():
+    _adaptor_classes.clear()
+    _adaptor_types.clear()
+    _field_adaptors.clear()
+
+
+def _get_adaptor_classes():
+    if not _adaptor_classes:
+        adaptor_paths = dict(DEFAULT_AUTOREPORTS_ADAPTOR)
+        for adaptor, path in (getattr(settings, 'AUTOREPORTS_ADAPTOR', None) or {}).items():
+            if path:
+                adaptor_paths[adaptor] = path
+        adaptor_classes = dict([(adaptor, get_class_from_path(path))
+                                for adaptor, path in adaptor_paths.items()])
+        _adaptor_classes.update(adaptor_classes)
+    return _adaptor_classes
+
+
+def _get_adaptor_of_type(field_type):
+    try:
+        return _adaptor_types[field_type]
+    except KeyError:
+        adaptor = None
+        for field_types, adaptor_type in ADAPTOR_FIELD_TYPES:
+            if issubclass(field_type, field_types):
+                adaptor = adaptor_type
+                break
+        _adaptor_types[field_type] = adaptor
+        return adaptor
+
+
+def _get_adaptor_name(field):
+    adaptor = _get_adaptor_of_type(type(field))
+    if adaptor == 'text':
         if getattr(field, 'choices', None):
-            adaptor = 'choices'
-        else:
-            adaptor = 'text'
-    elif isinstance(field, models.AutoField):
-        adaptor = 'autonumber'
-    elif isinstance(field, models.IntegerField) or isinstance(field, models.FloatField):
-        adaptor = 'number'
-    elif isinstance(field, models.BooleanField):
-        adaptor = 'boolean'
-    elif isinstance(field, models.DateTimeField):
-        adaptor = 'datetime'
-    elif isinstance(field, models.DateField):
-        adaptor = 'date'
-    elif isinstance(field, models.ForeignKey):
-        adaptor = 'fk'
-    elif isinstance(field, models.ManyToManyField):
-        adaptor = 'm2m'
-    elif isinstance(field, RelatedObject):
-        adaptor = 'relatedreverse'
-    elif callable(field):
-        adaptor = 'func'
-    elif isinstance(field, property):
-        adaptor = 'property'
-    elif isinstance(field, GenericForeignKey):
-        adaptor = 'gfk'
-    class_adaptor = adaptor and (get_class_from_path((getattr(settings, 'AUTOREPORTS_ADAPTOR', None) and
-                                                     settings.AUTOREPORTS_ADAPTOR.get(adaptor, None)) or
-                                                     (DEFAULT_AUTOREPORTS_ADAPTOR.get(adaptor, None))))
+            return 'choices'
+    elif adaptor is None:
+        if callable(field):
+            return 'func'
+        elif isinstance(field, property):
+            return 'property'
+        elif isinstance(field, GenericForeignKey):
+            return 'gfk'
+    return adaptor
+
+
+def get_adaptor(field):
+    # The adaptor of a field does not change, so it is memoized by field
+    # instance (the field is kept in the entry, so its id is not reused)
+    try:
+        field_memo, class_adaptor = _field_adaptors[id(field)]
+        if field_memo is field:
+            return class_adaptor
+    except KeyError:
+        pass
+    class_adaptor = _get_adaptor_classes().get(_get_adaptor_name(field), None)
     if not class_adaptor:
-        return BaseReportField
+        from autoreports.fields import BaseReportField
+        class_adaptor = BaseReportField
+    if len(_field_adaptors) >= MAX_FIELD_ADAPTORS:
+        _field_adaptors.clear()
+    _field_adaptors[id(field)] = (field, class_adaptor)
     return class_adaptor
 
 
@@ -237,48 +373,99 @@ def get_field_by_name(model, field_name, checked_transmeta=True, api=None):
         raise e
 
 
-def get_value_from_object(obj, field_name, separated_field=SEPARATED_FIELD, api=None):
-    if not obj:
-        return obj
-    if callable(field_name):
-        return field_name(obj)
+_column_accessors = {}
+
+
+def clear_column_accessors():
+    _column_accessors.clear()
+
+
+def _compile_column_accessor(model, field_name, separated_field=SEPARATED_FIELD, api=None):
     prefix, field_name_parsed = parsed_field_name(field_name, separated_field)
-    model = type(obj)
     if not prefix:
         try:
             field_name, field = get_field_by_name(model, field_name, api=api)
-            adaptor = get_adaptor(field)(model, field, field_name)
-            return adaptor.get_value(obj, field_name)
         except models.FieldDoesNotExist, e:
-            if hasattr(obj, field_name):
-                return getattr(obj, field_name, None)
-            raise e
-    else:
-        field_name_current = prefix[0]
-        field_name_new = prefix[1:]
-        field_name_new.append(field_name_parsed)
-        field_name, field = get_field_by_name(model, prefix[0], api=api)
+            error = e
+
+            def get_attribute(obj):
+                if hasattr(obj, field_name):
+                    return getattr(obj, field_name, None)
+                raise error
+            get_attribute.api = None
+            return get_attribute
         adaptor = get_adaptor(field)(model, field, field_name)
+
+        def get_value(obj):
+            return adaptor.get_value(obj, field_name)
+        get_value.api = _get_bound_api(field, api)
+        get_accessor = getattr(adaptor, 'get_accessor', None)
+        if get_accessor is not None:
+            # The accessor of an export, see ExportContext
+            get_value.prepare = lambda context: get_accessor(field_name, context) or get_value
+            get_value.prepare_bulk = lambda context: adaptor.get_bulk_function(field_name, context)
+        return get_value
+    field_name_current = prefix[0]
+    field_name_new = separated_field.join(prefix[1:] + [field_name_parsed])
+    field_name, field = get_field_by_name(model, field_name_current, api=api)
+    adaptor = get_adaptor(field)(model, field, field_name)
+
+    def get_related_value(obj):
         value = adaptor.get_value(obj, field_name_current)
         if is_iterable(value):
-            value_list = []
-            for obj in value:
-                val = get_value_from_object(obj,
-                                            separated_field.join(field_name_new),
-                                            separated_field=separated_field)
-                if isinstance(val, basestring):
-                    value_list.append(val)
-                elif is_iterable(val):
-                    value_list.append(val)
-                else:
-                    value_list.append(val)
-            return value_list
+            return [get_value_from_object(item, field_name_new,
+                                          separated_field=separated_field)
+                    for item in value]
         elif isinstance(value, models.Model):
-            return get_value_from_object(value,
-                                         separated_field.join(field_name_new),
+            return get_value_from_object(value, field_name_new,
                                          separated_field=separated_field)
         elif value:
             return adaptor.get_value(value, field_name_parsed)
+    get_related_value.api = _get_bound_api(field, api)
+    return get_related_value
+
+
+def _get_bound_api(field, api):
+    # The functions of the api are bound to it
+    if api is not None and getattr(field, 'im_self', None) is api:
+        return api
+    return None
+
+
+def get_column_accessor(model, field_name, separated_field=SEPARATED_FIELD, api=None):
+    """
+    The accessors (and the formatters, see get_column_formatter) are kept
+    by class of api, a new api can be built for every request or job. The
+    accessors of the functions of an api are bound to it, so they are kept
+    in the api instance
+    """
+    if callable(field_name):
+        return field_name
+    key = (model, field_name, separated_field, api is not None and type(api) or None,
+           has_transmeta() and get_language() or None)
+    accessor = _column_accessors.get(key, None)
+    if accessor is not None:
+        return accessor
+    api_accessors = None
+    if api is not None:
+        api_accessors = api.__dict__.setdefault('_column_accessors', {})
+        accessor = api_accessors.get(key, None)
+        if accessor is not None:
+            return accessor
+    accessor = _compile_column_accessor(model, field_name, separated_field, api)
+    if accessor.api is not None:
+        api_accessors[key] = accessor
+        return accessor
+    if len(_column_accessors) >= MAX_FIELD_ADAPTORS:
+        _column_accessors.clear()
+    _column_accessors[key] = accessor
+    return accessor
+
+
+def get_value_from_object(obj, field_name, separated_field=SEPARATED_FIELD, api=None):
+    if not obj:
+        return obj
+    return get_column_accessor(type(obj), field_name, separated_field, api)(obj)
 
 
 def get_parser_value(value):
@@ -304,6 +491,133 @@ def get_parser_value(value):
     return get_parser_value(unicode(value))
 
 
+# The column formatters return the same than get_parser_value for every
+# value of a column, with a loop specialised for the type of the column
+
+NUMBER_TYPES = (int, long, float, decimal.Decimal)
+DATE_TYPES = (datetime.date, datetime.datetime)
+
+
+def format_values(values):
+    return [get_parser_value(value) for value in values]
+
+
+def format_numbers(values):
+    formatted = []
+    append = formatted.append
+    for value in values:
+        if value.__class__ in NUMBER_TYPES:
+            append(value and str(value) or unicode(value))
+        else:
+            append(get_parser_value(value))
+    return formatted
+
+
+def format_dates(values):
+    formatted = []
+    append = formatted.append
+    for value in values:
+        if value.__class__ in DATE_TYPES:
+            append(str(value))
+        else:
+            append(get_parser_value(value))
+    return formatted
+
+
+def format_booleans(values):
+    formatted = []
+    append = formatted.append
+    for value in values:
+        if value is True:
+            append('True')
+        elif value is False:
+            append(u'False')
+        else:
+            append(get_parser_value(value))
+    return formatted
+
+
+def format_texts(values):
+    formatted = []
+    append = formatted.append
+    for value in values:
+        if value and value.__class__ is unicode:
+            append(value.encode('utf8'))
+        else:
+            append(get_parser_value(value))
+    return formatted
+
+
+def format_related(values):
+    formatted = []
+    append = formatted.append
+    for value in values:
+        if isinstance(value, models.Model):
+            append(unicode(value).encode('utf8'))
+        elif isinstance(value, (list, QuerySet)):
+            items = list(value)
+            if items and not [item for item in items if not isinstance(item, models.Model)]:
+                append(', '.join([unicode(item).encode('utf8') for item in items]))
+            else:
+                append(get_parser_value(value))
+        else:
+            append(get_parser_value(value))
+    return formatted
+
+COLUMN_FORMATTERS = {'number': format_numbers,
+                     'autonumber': format_numbers,
+                     'date': format_dates,
+                     'datetime': format_dates,
+                     'boolean': format_booleans,
+                     'text': format_texts,
+                     'choices': format_texts,
+                     'fk': format_related,
+                     'm2m': format_related,
+                     'relatedreverse': format_related}
+
+_column_formatters = {}
+
+
+def clear_column_formatters():
+    _column_formatters.clear()
+
+
+def _get_column_type(model, field_name, separated_field=SEPARATED_FIELD, api=None):
+    prefix, field_name_parsed = parsed_field_name(field_name, separated_field)
+    try:
+        for i, name in enumerate(prefix):
+            name, field = get_field_by_name(model, name, api=i == 0 and api or None)
+            if _get_adaptor_name(field) in ('m2m', 'relatedreverse'):
+                # A list of values of the related objects
+                return 'm2m'
+            model = get_model_of_relation(field)
+        name, field = get_field_by_name(model, field_name_parsed, api=not prefix and api or None)
+    except models.FieldDoesNotExist:
+        return None
+    return _get_adaptor_name(field)
+
+
+def get_column_formatter(model, field_name, separated_field=SEPARATED_FIELD, api=None):
+    if callable(field_name):
+        return format_values
+    # By class of api like the accessors, the type of a column does not
+    # depend on the instance of the api
+    key = (model, field_name, separated_field, api is not None and type(api) or None)
+    formatter = _column_formatters.get(key, None)
+    if formatter is None:
+        column_type = _get_column_type(model, field_name, separated_field, api)
+        formatter = COLUMN_FORMATTERS.get(column_type, format_values)
+        if len(_column_formatters) >= MAX_FIELD_ADAPTORS:
+            _column_formatters.clear()
+        _column_formatters[key] = formatter
+    return formatter
+
+
+def get_column_formatters(model, list_fields, separated_field=SEPARATED_FIELD, api=None):
+    return [get_column_formatter(model, field_name, separated_field, api)
+            for field_name in list_fields]
+
+
 def get_field_from_model(model, field_name, separated_field=SEPARATED_FIELD, api=None):
     prefix, field_name_parsed = parsed_field_name(field_name, separated_field)
     if not prefix:
@@ -326,56 +640,119 @@ def get_all_field_names(model):
     return field_list
 
 
-def get_fields_from_model(model, prefix=None, ignore_models=None, adaptors=None):
+SCHEMA_VERSION = 1
+SCHEMA_CACHE_PREFIX = 'autoreports:schema'
+SCHEMA_CACHE_TTL = 60 * 60 * 24
+
+_model_schemas = {}
+
+
+def clear_model_schemas():
+    _model_schemas.clear()
+
+
+def get_class_path(cls):
+    return '%s.%s' % (cls.__module__, cls.__name__)
+
+
+def build_model_schema(model):
+    """
+    The fields and the functions of a model that the wizard shows, with
+    unicode strings and the paths of the adaptors so it can be serialized
+    """
     fields = []
-    funcs = []
-    prefix = prefix or ''
-    ignore_models = ignore_models or []
-    field_list = get_all_field_names(model)
-    for field_name in field_list:
+    for field_name in get_all_field_names(model):
         field_name_model, field = get_field_by_name(model, field_name)
-        field_name_prefix = prefix and '%s%s%s' % (prefix, SEPARATED_FIELD, field_name) or field_name
-        adaptor = get_adaptor(field)(model, field, field_name_prefix)
-        if adaptors and not isinstance(adaptor, adaptors):
-            continue
+        adaptor_class = get_adaptor(field)
+        adaptor = adaptor_class(model, field, field_name)
         field_data = {'name': field_name,
-                      'name_prefix': field_name_prefix}
+                      'verbose_name': force_unicode(adaptor.get_verbose_name()),
+                      'adaptor': get_class_path(adaptor_class),
+                      'collapsible': False}
         if isinstance(field, (RelatedObject, RelatedField)):
             model_relation = get_model_of_relation(field)
-            if model_relation in ignore_models:
-                continue
             if issubclass(model, model_relation) and field_name.endswith('_ptr'):
                 continue
-            field_data['verbose_name'] = adaptor.get_verbose_name()
-            model_relation = get_model_of_relation(field)
             field_data['collapsible'] = {'app_label': model_relation._meta.app_label,
                                          'module_name': model_relation._meta.module_name}
-        else:
-            field_data['verbose_name'] = adaptor.get_verbose_name()
-            field_data['collapsible'] = False
         fields.append(field_data)
 
+    funcs = []
+    if getattr(settings, 'AUTOREPORTS_FUNCTIONS', False):
+        for func_name in dir(model):
+            if not callable(getattr(model, func_name, None)):
+                continue
+            func = getattr(model, func_name)
+            if not getattr(func, 'im_func', None):
+                continue
+            func_num_args = func.im_func.func_code.co_argcount
+            if func_num_args == 1 or len(func.im_func.func_dict) == func_num_args:
+                adaptor_class = get_adaptor(func)
+                adaptor = adaptor_class(model, func, func_name)
+                funcs.append({'name': func_name,
+                              'verbose_name': force_unicode(adaptor.get_verbose_name()),
+                              'adaptor': get_class_path(adaptor_class)})
+    return {'version': SCHEMA_VERSION,
+            'hash': md5(simplejson.dumps([fields, funcs], sort_keys=True)).hexdigest(),
+            'fields': fields,
+            'funcs': funcs}
+
+
+def get_schema_key(model):
+    return '%s:%s:%s:%s.%s:%s:%s' % (SCHEMA_CACHE_PREFIX, SCHEMA_VERSION,
+                                     getattr(settings, 'AUTOREPORTS_SCHEMA_VERSION', ''),
+                                     model._meta.app_label, model._meta.module_name,
+                                     get_language(),
+                                     int(bool(getattr(settings, 'AUTOREPORTS_FUNCTIONS', False))))
+
+
+def get_model_schema(model, rebuild=False):
+    """
+    The schema of a model in the current language, it is built once by
+    process and shared between processes with the cache of Django
+    """
+    key = get_schema_key(model)
+    schema = not rebuild and _model_schemas.get(key, None) or None
+    if schema is None:
+        schema = not rebuild and cache.get(key) or None
+        if schema is None or schema.get('version', None) != SCHEMA_VERSION:
+            schema = build_model_schema(model)
+            cache.set(key, schema, getattr(settings, 'AUTOREPORTS_SCHEMA_CACHE_TTL', SCHEMA_CACHE_TTL))
+        _model_schemas[key] = schema
+    return schema
+
+
+def get_fields_from_model(model, prefix=None, ignore_models=None, adaptors=None):
+    schema = get_model_schema(model)
+    fields = []
+    prefix = prefix or ''
+    ignore_models = [(model_ignored._meta.app_label, model_ignored._meta.module_name)
+                     for model_ignored in ignore_models or []]
+    for field_data in schema['fields']:
+        if adaptors and not issubclass(get_class_from_path(field_data['adaptor']), adaptors):
+            continue
+        collapsible = field_data['collapsible']
+        if collapsible and (collapsible['app_label'], collapsible['module_name']) in ignore_models:
+            continue
+        field_name = field_data['name']
+        fields.append({'name': field_name,
+                       'name_prefix': prefix and '%s%s%s' % (prefix, SEPARATED_FIELD, field_name) or field_name,
+                       'verbose_name': field_data['verbose_name'],
+                       'collapsible': collapsible})
+
     autoreports_functions = getattr(settings, 'AUTOREPORTS_FUNCTIONS', False)
 
     if not autoreports_functions or adaptors:
         return (fields, None)
 
-    for func_name in dir(model):
-        if not callable(getattr(model, func_name, None)):
-            continue
-        func = getattr(model, func_name)
-        if not getattr(func, 'im_func', None):
-            continue
-        func_num_args = func.im_func.func_code.co_argcount
-        func_name_prefix = func_name
+    funcs = []
+    for func_data in schema['funcs']:
+        func_name_prefix = func_data['name']
         if prefix:
-            func_name_prefix = '%s%s%s' % (prefix, SEPARATED_FIELD, func_name)
-        adaptor = get_adaptor(func)(model, func, func_name_prefix)
-        if func_num_args == 1 or len(func.im_func.func_dict) == func_num_args:
-            funcs.append({'name': func_name_prefix,
-                          'verbose_name': adaptor.get_verbose_name(),
-                          'collapsible': False
-                          })
+            func_name_prefix = '%s%s%s' % (prefix, SEPARATED_FIELD, func_name_prefix)
+        funcs.append({'name': func_name_prefix,
+                      'verbose_name': func_data['verbose_name'],
+                      'collapsible': False})
     return (fields, funcs)
 
 
@@ -398,43 +775,303 @@ def pre_processing_transmeta_fields(model, field_list):
     return field_list
 
 
-def filtering_from_request(request, object_list, report=None):
-    qsm = get_querystring_manager()(request)
-    filters = qsm.get_filters()
-    for field in EXCLUDE_FIELDS:
-        if field in filters:
-            del filters[field]
-    if not report or not report.options:
-        return (filters, object_list.filter(**filters).distinct())
-    else:
+MAX_FILTER_PLANS = 1000
+MAX_FILTER_LOOKUPS = 1000
+
+_filter_plans = {}
+
+
+def clear_filter_plans():
+    _filter_plans.clear()
+
+
+class FilterPlan(object):
+    """
+    The lookups of every filter of a report: the filter itself and, if its
+    field has other_fields, the same filter on them. They are compiled once
+    by filter and applied by filter_queryset
+    """
+
+    def __init__(self, model, options):
+        self.model = model
+        self.options = options
+        self.lookups = {}
+
+    def compile(self, fil):
+        fil_split = fil.split('__')
+        field_name = SEPARATED_FIELD.join(fil_split[:-1])
+        field_name_opts = transmeta_inverse_field_name(self.model, field_name)
+        field_options = self.options.get(field_name_opts, None)
+        if not field_options or not field_options.get('other_fields', None):
+            return (fil, )
+        prefix = '__'.join(fil_split[:-2])
+        filter_operator = fil_split[-1]
+        lookups = [fil]
+        for other_field in field_options.get('other_fields'):
+            if prefix:
+                other_field = "%s__%s" % (prefix, other_field)
+            m, f = get_field_from_model(self.model, other_field, separated_field='__')
+            other_field = transmeta_field_name(f, other_field)
+            lookups.append(str("%s__%s" % (other_field, filter_operator)))
+        return tuple(lookups)
+
+    def get_lookups(self, fil):
+        lookups = self.lookups.get(fil, None)
+        if lookups is None:
+            lookups = self.compile(fil)
+            if len(self.lookups) < MAX_FILTER_LOOKUPS:
+                self.lookups[fil] = lookups
+        return lookups
+
+    def get_filters_q(self, filters):
         filter_list = {}
-        options = report.options
-        model = object_list.model
+        filters_q = []
         for fil, value in filters.items():
-            fil_split = fil.split('__')
-            field_name = SEPARATED_FIELD.join(fil_split[:-1])
-            field_name_opts = transmeta_inverse_field_name(model, field_name)
-            prefix = '__'.join(fil_split[:-2])
-            filter_operator = fil_split[-1]
-            field_options = options.get(field_name_opts, None)
-            if not field_options or not field_options.get('other_fields', None):
-                object_list = object_list.filter(**{fil: value})
+            lookups = self.get_lookups(fil)
+            if len(lookups) == 1:
                 filter_list[fil] = value
+                filters_q.append(models.Q(**{fil: value}))
             else:
-                from django.db.models  import Q
-                other_fields = field_options.get('other_fields', None)
-                filter_or = Q(**{fil: value})
-                filter_list[fil] = [{fil: value}]
-                for other_field in other_fields:
-                    if prefix:
-                        other_field = "%s__%s" % (prefix, other_field)
-                    m, f = get_field_from_model(model, other_field, separated_field='__')
-                    other_field = transmeta_field_name(f, other_field)
-                    other_field = str("%s__%s" % (other_field, filter_operator))
-                    filter_or = filter_or | Q(**{other_field: value})
-                    filter_list[fil].append({other_field: value})
-                object_list = object_list.filter(filter_or)
-    return (filter_list, object_list.distinct())
+                filter_list[fil] = [{lookup: value} for lookup in lookups]
+                filters_q.append(reduce(operator.or_, [models.Q(**{lookup: value})
+                                                       for lookup in lookups]))
+        return (filter_list, filters_q)
+
+
+def get_filter_plan(model, report):
+    compiled_report = get_compiled_report(report)
+    if compiled_report.model is model:
+        return compiled_report.filter_plan
+    key = (model, report.pk, compiled_report.options_hash, get_language())
+    filter_plan = _filter_plans.get(key, None)
+    if filter_plan is None:
+        filter_plan = FilterPlan(model, compiled_report.options)
+        if len(_filter_plans) >= MAX_FILTER_PLANS:
+            _filter_plans.clear()
+        _filter_plans[key] = filter_plan
+    return filter_plan
+
+
+MAX_COMPILED_REPORTS = 500
+
+_compiled_reports = SortedDict()
+_compiled_reports_lock = threading.Lock()
+
+
+def clear_compiled_reports():
+    _compiled_reports_lock.acquire()
+    try:
+        _compiled_reports.clear()
+    finally:
+        _compiled_reports_lock.release()
+
+
+class CompiledReport(object):
+    """
+    The options of a saved report compiled once: its fields in order with
+    their options, the filter and display fields and the filter plan. The
+    fields of the model are resolved when they are needed, once by class of
+    api, since the functions of the api are fields too. It is shared between
+    requests, so it must not be changed and it does not keep the report
+    """
+
+    def __init__(self, report, options_hash, options):
+        self.pk = report.pk
+        self.model = report.content_type.model_class()
+        self.options_hash = options_hash
+        self.options = options
+        self.fields = tuple(sort_options(options))
+        self.model_fields = {}
+        filter_fields = []
+        for field_name, opts in self.fields:
+            for fil in opts.get('filters', []):
+                filter_fields.append("%s__%s" % (field_name, fil))
+        self.filter_fields = tuple(filter_fields)
+        self.display_fields = tuple([field_name for field_name, opts in self.fields
+                                     if opts.get('display', False)])
+        self.filter_plan = FilterPlan(self.model, options)
+
+    def get_options(self, field_name):
+        return self.options.get(field_name, None)
+
+    def get_model_fields(self, api=None):
+        """ The (model, field) of every field, resolved with the api """
+        key = api is not None and type(api) or None
+        model_fields = self.model_fields.get(key, None)
+        if model_fields is None:
+            model_fields = tuple([get_field_from_model(self.model, field_name, api=api)
+                                  for field_name, opts in self.fields])
+            self.model_fields[key] = model_fields
+        return model_fields
+
+    def get_adaptors(self, report, api=None):
+        """ The adaptors of the fields, for this report """
+        return [get_adaptor(field)(self.model, field, field_name,
+                                   instance=report, treatment_transmeta=False)
+                for (field_name, opts), (model, field) in zip(self.fields,
+                                                              self.get_model_fields(api))]
+
+
+def get_options_hash(report):
+    dumped = simplejson.dumps(report.options or {}, sort_keys=True)
+    return (md5(dumped).hexdigest(), dumped)
+
+
+def get_compiled_report(report):
+    """
+    The CompiledReport of the report, built once by report, options and
+    language and kept in the process (the least recently used are removed).
+    It is memoized in the report too, until its options are assigned again
+    or it is saved, so the options are only dumped once by report
+    """
+    key = (report.pk, report.content_type_id, get_language())
+    memo = getattr(report, '_compiled_report', None)
+    if memo is not None and memo[0] is report.options and memo[1] == key:
+        return memo[2]
+    options_hash, dumped = get_options_hash(report)
+    compiled_report = _get_compiled_report(report, key + (options_hash, ), options_hash, dumped)
+    report._compiled_report = (report.options, key, compiled_report)
+    return compiled_report
+
+
+def clear_compiled_report(report):
+    report._compiled_report = None
+
+
+def _get_compiled_report(report, key, options_hash, dumped):
+    _compiled_reports_lock.acquire()
+    try:
+        compiled_report = _compiled_reports.pop(key, None)
+        if compiled_report is not None:
+            _compiled_reports[key] = compiled_report
+            return compiled_report
+    finally:
+        _compiled_reports_lock.release()
+    # The options are loaded again, so the compiled report has its own copy
+    compiled_report = CompiledReport(report, options_hash, simplejson.loads(dumped))
+    _compiled_reports_lock.acquire()
+    try:
+        _compiled_reports[key] = compiled_report
+        while len(_compiled_reports) > MAX_COMPILED_REPORTS:
+            del _compiled_reports[_compiled_reports.keyOrder[0]]
+    finally:
+        _compiled_reports_lock.release()
+    return compiled_report
+
+
+def get_request_filters(request):
+    filters = getattr(request, '_autoreports_filters', None)
+    if filters is None:
+        qsm = get_querystring_manager()(request)
+        filters = qsm.get_filters()
+        for field in EXCLUDE_FIELDS:
+            if field in filters:
+                del filters[field]
+        request._autoreports_filters = filters
+    return dict(filters)
+
+
+def filtering_from_request(request, object_list, report=None):
+    filters = get_request_filters(request)
+    if not report or not report.options:
+        filter_list = filters
+        filters_q = [models.Q(**{fil: value}) for fil, value in filters.items()]
+    else:
+        filter_list, filters_q = get_filter_plan(object_list.model, report).get_filters_q(filters)
+    return (filter_list, filter_queryset(object_list, filters_q))
+
+
+_multivalued_lookups = {}
+_table_models = {}
+
+
+def is_multivalued_lookup(model, lookup):
+    """
+    If the lookup goes through a many to many or a reverse foreign key, so
+    the rows of the model can be repeated when it is joined
+    """
+    key = (model, lookup)
+    multivalued = _multivalued_lookups.get(key, None)
+    if multivalued is not None:
+        return multivalued
+    multivalued = False
+    opts = model._meta
+    for part in lookup.split(LOOKUP_SEP):
+        try:
+            field, field_model, direct, m2m = opts.get_field_by_name(part)
+        except models.FieldDoesNotExist:
+            break
+        if m2m or (not direct and not isinstance(field.field, models.OneToOneField)):
+            multivalued = True
+            break
+        if not direct:
+            opts = field.model._meta
+        elif field.rel:
+            opts = field.rel.to._meta
+        else:
+            break
+    _multivalued_lookups[key] = multivalued
+    return multivalued
+
+
+def get_q_lookups(q):
+    lookups = []
+    for child in q.children:
+        if isinstance(child, tree.Node):
+            lookups.extend(get_q_lookups(child))
+        else:
+            lookups.append(child[0])
+    return lookups
+
+
+def get_model_by_table(table_name):
+    if not _table_models:
+        for model in models.get_models(include_auto_created=True):
+            _table_models[model._meta.db_table] = model
+    return _table_models.get(table_name, None)
+
+
+def has_multivalued_joins(query):
+    # A join can repeat the rows unless it is made by a unique column of the joined table
+    for alias, join in query.alias_map.items():
+        if join[LHS_ALIAS] is None or not query.alias_refcount.get(alias, 0):
+            continue
+        model = get_model_by_table(join[TABLE_NAME])
+        if model is None:
+            return True
+        unique_columns = [field.column for field in model._meta.fields if field.unique]
+        if join[RHS_JOIN_COL] not in unique_columns:
+            return True
+    return False
+
+
+def filter_queryset(object_list, filters_q):
+    """
+    Applies the filters without DISTINCT: the filters of many to many and
+    reverse relations are applied in a subquery of primary keys (pk__in).
+    They are applied in the same subquery, so a related object must match
+    all of them; with AUTOREPORTS_RELATED_FILTERS_SAME_OBJECT = False every
+    one has its own subquery, as the filter calls of the version 0.8
+    """
+    model = object_list.model
+    single_filters = []
+    multivalued_filters = []
+    for filter_q in filters_q:
+        if [lookup for lookup in get_q_lookups(filter_q) if is_multivalued_lookup(model, lookup)]:
+            multivalued_filters.append(filter_q)
+        else:
+            single_filters.append(filter_q)
+    if multivalued_filters and getattr(settings, 'AUTOREPORTS_RELATED_FILTERS_SAME_OBJECT', True):
+        multivalued_filters = [reduce(operator.and_, multivalued_filters)]
+    for filter_q in multivalued_filters:
+        pks = model._base_manager.filter(filter_q).values('pk')
+        single_filters.append(models.Q(pk__in=pks))
+    if single_filters:
+        object_list = object_list.filter(reduce(operator.and_, single_filters))
+    if has_multivalued_joins(object_list.query):
+        # The queryset of the api or the search of the quick reports
+        object_list = object_list.distinct()
+    return object_list
 
 
 def transmeta_field_name(field, field_name):
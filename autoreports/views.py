@@ -13,32 +13,49 @@
  # You should have received a copy of the GNU Lesser General Public License
  # along with this programe.  If not, see <http://www.gnu.org/licenses/>.
 
-import csv
+import os
+import sys
+import time
+
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import new as md5
 
 from django.conf import settings
 from django.contrib.admin import site
 from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
 from django.db import models
 from django.db.models import Q
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse
 from django.shortcuts import render_to_response, get_object_or_404
 from django.template import RequestContext
-from django.template.loader import render_to_string
+from django.template.loader import find_template_loader, render_to_string
 from django.utils import simplejson
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import condition
 from django.utils.translation import ugettext as _
 from django.utils.translation import get_language
 
-from autoreports.models import Report
+from autoreports.cache import get_cache_key, get_export_cache
+from autoreports.jobs import fail_stale_jobs, get_job_storage
+from autoreports.models import Report, ReportJob, JOB_DONE
 from autoreports.utils import (EXCLUDE_FIELDS,
                                SEPARATED_FIELD,
-                               get_available_formats,
+                               SCHEMA_CACHE_PREFIX,
+                               SCHEMA_CACHE_TTL,
                                get_fields_from_model,
-                               get_value_from_object,
-                               get_parser_value,
+                               get_model_schema,
+                               get_schema_key,
                                get_adaptor, parsed_field_name,
                                get_field_by_name, pre_procession_request,
-                               filtering_from_request)
-from autoreports.csv_to_excel import  convert_to_excel
+                               filtering_from_request, get_column_formatters)
+from autoreports.exports import (export_response, get_aggregated_values, get_values,
+                                 is_aggregated_report, iter_file, write_export)
+from autoreports.formats import export_formats
+from autoreports.parallel import get_export_processes, get_shards, write_parallel_export
+from autoreports.preflight import estimate_export
 
 
 def reports_list(request, category_key=None):
@@ -64,7 +81,7 @@ def reports_api_list(request, registry_key):
     from autoreports.registry import report_registry
     api = report_registry.get_api_class(registry_key)
     ct = ContentType.objects.get_for_model(api.model)
-    reports = Report.objects.filter(content_type=ct)
+    reports = Report.objects.filter(content_type=ct).defer('options')
     return render_to_response('autoreports/autoreports_report_list.html',
                               {'reports': reports,
                                'report_key': registry_key,
@@ -83,27 +100,163 @@ def reports_api_wizard(request, registry_key, report_id=None):
                                  extra_context={'registry_key': registry_key})
 
 
-def reports_ajax_fields(request):
-    module_name = request.GET.get('module_name')
-    app_label = request.GET.get('app_label')
-    ct = ContentType.objects.get(model=module_name,
-                                 app_label=app_label)
-    ignore_module_name = request.GET.get('ignore_module_name')
-    ignore_app_label = request.GET.get('ignore_app_label')
-    ignore_models = _get_ignore_models(ignore_app_label, ignore_module_name)
-    field = request.GET.get('field')
-    model = ct.model_class()
+def _get_model(app_label, module_name):
+    # The app cache of Django has every model, the content types are not queried
+    model = None
+    if app_label and module_name:
+        model = models.get_model(app_label, module_name)
+    if model is None:
+        raise Http404
+    return model
+
+
+def _get_trees(request):
+    try:
+        trees = simplejson.loads(request.GET.get('trees', '[]'))
+    except ValueError:
+        raise Http404
+    model_trees = []
+    for tree in trees:
+        if not isinstance(tree, list) or len(tree) not in (3, 4):
+            raise Http404
+        app_label, module_name, field = tree[:3]
+        ignore_models = []
+        for ignored in len(tree) == 4 and tree[3] or []:
+            if not isinstance(ignored, list) or len(ignored) != 2:
+                raise Http404
+            ignore_models.append(_get_model(*ignored))
+        model_trees.append((_get_model(app_label, module_name), field, ignore_models))
+    return model_trees
+
+
+def _get_wizard_models(request):
+    if 'trees' in request.GET:
+        return [model for model, field, ignore_models in _get_trees(request)]
+    return [_get_model(request.GET.get('app_label'), request.GET.get('module_name'))]
+
+
+WIZARD_TEMPLATES = ('autoreports/inc.render_model.html',
+                    'autoreports/inc.render_choices.html',
+                    'autoreports/as_wizard_field.html',
+                    'autoreports/fields/func_field_wizard.html')
+WIZARD_MODULES = ('autoreports.fields', 'autoreports.wizards')
+
+_wizard_version = None
+
+
+def get_wizard_version():
+    """
+    The last change of the templates and the adaptors of the wizard, with
+    AUTOREPORTS_WIZARD_VERSION. It is read once per process, a deployment
+    restarts the processes
+    """
+    global _wizard_version
+    if _wizard_version is None:
+        paths = [sys.modules[module_name].__file__ for module_name in WIZARD_MODULES]
+        for loader_path in settings.TEMPLATE_LOADERS:
+            loader = find_template_loader(loader_path)
+            # The cached loader has the loaders that find the templates
+            for template_loader in getattr(loader, 'loaders', [loader]):
+                get_template_sources = getattr(template_loader, 'get_template_sources', None)
+                if get_template_sources is None:
+                    continue
+                for template_name in WIZARD_TEMPLATES:
+                    paths.extend(get_template_sources(template_name))
+        mtime = 0
+        for path in paths:
+            try:
+                mtime = max(mtime, os.path.getmtime(path))
+            except OSError:
+                pass
+        _wizard_version = '%s:%s' % (mtime, getattr(settings, 'AUTOREPORTS_WIZARD_VERSION', ''))
+    return _wizard_version
+
+
+def clear_wizard_version():
+    global _wizard_version
+    _wizard_version = None
+
+
+def get_wizard_key(request):
+    # The wizard only depends on the schema of the models, the language, the
+    # settings (in the key of the schema), the querystring and the version of
+    # its templates
+    wizard_key = getattr(request, '_autoreports_wizard_key', None)
+    if wizard_key is None:
+        data = [request.path, sorted(request.GET.lists()),
+                getattr(settings, 'AUTOREPORTS_I18N', False),
+                getattr(settings, 'AUTOREPORTS_WIZARDFIELD', None),
+                getattr(settings, 'AUTOREPORTS_WIZARDADMINFIELD', None),
+                get_wizard_version()]
+        for model in _get_wizard_models(request):
+            data.append([get_schema_key(model), get_model_schema(model)['hash']])
+        wizard_key = md5(simplejson.dumps(data)).hexdigest()
+        request._autoreports_wizard_key = wizard_key
+    return wizard_key
+
+
+def wizard_fragment(request, render):
+    if not getattr(settings, 'AUTOREPORTS_WIZARD_CACHE', True):
+        return render(request)
+    key = '%s:wizard:%s' % (SCHEMA_CACHE_PREFIX, get_wizard_key(request))
+    content = cache.get(key)
+    if content is None:
+        content = render(request)
+        cache.set(key, content, getattr(settings, 'AUTOREPORTS_SCHEMA_CACHE_TTL', SCHEMA_CACHE_TTL))
+    return content
+
+
+def wizard_etag(request):
+    if not getattr(settings, 'AUTOREPORTS_WIZARD_CACHE', True):
+        return None
+    return get_wizard_key(request)
+
+
+def render_model_fields(model, field=None, ignore_models=None):
     fields, funcs = get_fields_from_model(model, field,
                                           ignore_models=ignore_models)
     context = {'fields': fields,
                'funcs': funcs,
-               'app_label': app_label,
-               'module_name': module_name}
-    return HttpResponse(render_to_string('autoreports/inc.render_model.html',
-                                         context),
+               'app_label': model._meta.app_label,
+               'module_name': model._meta.module_name}
+    return render_to_string('autoreports/inc.render_model.html', context)
+
+
+@condition(etag_func=wizard_etag)
+def reports_ajax_fields(request):
+    return HttpResponse(wizard_fragment(request, render_ajax_fields),
                         mimetype='text/html')
 
 
+def render_ajax_fields(request):
+    model = _get_model(request.GET.get('app_label'), request.GET.get('module_name'))
+    ignore_module_name = request.GET.get('ignore_module_name')
+    ignore_app_label = request.GET.get('ignore_app_label')
+    ignore_models = _get_ignore_models(ignore_app_label, ignore_module_name)
+    return render_model_fields(model, request.GET.get('field'), ignore_models)
+
+
+@condition(etag_func=wizard_etag)
+def reports_ajax_fields_batch(request):
+    """
+    The subtrees of several relations in a JSON, trees is a JSON list of
+    [app_label, module_name, field] or [app_label, module_name, field,
+    [[ignore_app_label, ignore_module_name], ...]]
+    """
+    return HttpResponse(wizard_fragment(request, render_ajax_fields_batch),
+                        mimetype='application/json')
+
+
+def render_ajax_fields_batch(request):
+    trees = []
+    for model, field, ignore_models in _get_trees(request):
+        trees.append({'app_label': model._meta.app_label,
+                      'module_name': model._meta.module_name,
+                      'field': field,
+                      'content': render_model_fields(model, field, ignore_models)})
+    return simplejson.dumps({'trees': trees})
+
+
 def _get_ignore_models(ignore_app_label, ignore_module_name):
     if not ignore_app_label or not ignore_module_name:
         return []
@@ -113,41 +266,31 @@ def _get_ignore_models(ignore_app_label, ignore_module_name):
         return []
     ignore_list = []
     for i, app_label in enumerate(app_labels):
-        ct = ContentType.objects.get(model=module_names[i],
-                                     app_label=app_label)
-        ignore_list.append(ct.model_class())
+        ignore_list.append(_get_model(app_label, module_names[i]))
     return ignore_list
 
 
+@condition(etag_func=wizard_etag)
 def reports_ajax_fields_options(request):
+    return HttpResponse(wizard_fragment(request, render_ajax_fields_options),
+                        mimetype='text/html')
+
+
+def render_ajax_fields_options(request):
     module_name = request.GET.get('module_name')
     app_label = request.GET.get('app_label')
     is_admin = simplejson.loads(request.GET.get('is_admin', True),)
-    ct = ContentType.objects.get(model=module_name,
-                                 app_label=app_label)
-    model = ct.model_class()
+    model = _get_model(app_label, module_name)
     field_name = request.GET.get('field')
     prefix, field_name_parsed = parsed_field_name(field_name)
     field_name_x, field = get_field_by_name(model, field_name_parsed)
     adaptor = get_adaptor(field)(model, field, field_name, treatment_transmeta=False)
     wizard = adaptor.get_form(is_admin)
-    wizard_render = adaptor.render(wizard, model, is_admin)
-    return HttpResponse(wizard_render,
-                        mimetype='text/html')
+    return adaptor.render(wizard, model, is_admin)
 
 
-def reports_view(request, app_name, model_name, fields=None,
-                 list_headers=None, ordering=None, filters=Q(),
-                 api=None, queryset=None,
-                 report_to='csv',
-                 report=None,
-                 separated_field=SEPARATED_FIELD,
-                 pre_procession_lite=False):
-    class_model = models.get_model(app_name, model_name)
-    request = pre_procession_request(request, class_model, pre_procession_lite)
+def get_report_fields(class_model, fields=None, list_headers=None, api=None):
     list_fields = fields
-    formats = get_available_formats()
-
     if not list_fields:
         api = api or site._registry.get(class_model, None)
         if api:
@@ -158,24 +301,173 @@ def reports_view(request, app_name, model_name, fields=None,
             list_fields = ['__unicode__']
             list_headers = [_('Object')]
 
-    list_headers = list_headers
     if not list_headers:
         list_headers = translate_fields(list_fields, class_model)
-    name = "%s-%s.%s" % (app_name, model_name, formats[report_to]['file_extension'])
+    return (list_fields, list_headers, api)
+
 
-    object_list = queryset and queryset.filter(filters) or class_model.objects.filter(filters)
+def get_report_object_list(request, class_model, ordering=None, filters=Q(),
+                           queryset=None, report=None):
+    if queryset is None:
+        queryset = class_model.objects.all()
+    object_list = queryset.filter(filters)
 
     filters, object_list = filtering_from_request(request, object_list, report=report)
 
     if ordering:
         object_list = object_list.order_by(*ordering)
+    return (filters, object_list)
+
+
+def reports_content(request, app_name, model_name, fields=None,
+                    list_headers=None, ordering=None, filters=Q(),
+                    api=None, queryset=None,
+                    report_to='csv',
+                    report=None,
+                    separated_field=SEPARATED_FIELD,
+                    pre_procession_lite=False,
+                    chunk_size=None,
+                    parallel=False):
+    class_model = models.get_model(app_name, model_name)
+    request = pre_procession_request(request, class_model, pre_procession_lite)
+    writer_class = export_formats.get_writer_class(report_to)
+    list_fields, list_headers, api = get_report_fields(class_model, fields, list_headers, api)
+    name = "%s-%s.%s" % (app_name, model_name, writer_class.file_extension)
+    filters, object_list = get_report_object_list(request, class_model, ordering, filters,
+                                                  queryset, report)
+
+    export_cache = get_export_cache()
+    if export_cache is not None:
+        cache_key = get_cache_key(class_model, report, filters, list_fields, list_headers,
+                                  report_to, object_list, export_cache=export_cache,
+                                  separated_field=separated_field)
+        content = export_cache.get(cache_key, class_model)
+        if content is not None:
+            return (name, writer_class, record_report_run(report, content))
+
+    if is_aggregated_report(report):
+        list_headers, values = get_aggregated_values(object_list, report, api=api)
+        content = write_export(writer_class(), list_headers, values)
+    else:
+        formatters = get_column_formatters(class_model, list_fields,
+                                           separated_field=separated_field, api=api)
+        shards = None
+        # The processes are forked, which is not done in the web requests
+        if parallel and writer_class.can_split:
+            shards = get_shards(object_list, get_export_processes(api))
+        if shards:
+            content = write_parallel_export(writer_class, list_headers, shards, list_fields,
+                                            formatters=formatters, separated_field=separated_field,
+                                            api=api, chunk_size=chunk_size)
+        else:
+            values = get_values(object_list, list_fields,
+                                separated_field=separated_field, api=api,
+                                chunk_size=chunk_size)
+            content = write_export(writer_class(), list_headers, values, formatters=formatters)
+    if export_cache is not None:
+        content = export_cache.store(cache_key, class_model, content)
+    return (name, writer_class, record_report_run(report, content))
+
+
+def record_report_run(report, content):
+    """ Yields the content and records the run in the report when it has been sent """
+    if report is None or report.pk is None:
+        return content
+    return _record_report_run(report, content)
+
+
+def _record_report_run(report, content):
+    start = time.time()
+    for chunk in content:
+        yield chunk
+    report.record_run(time.time() - start)
+
+
+def reports_preflight(request, app_name, model_name, fields=None,
+                      list_headers=None, ordering=None, filters=Q(),
+                      api=None, queryset=None,
+                      report_to='csv',
+                      report=None,
+                      separated_field=SEPARATED_FIELD,
+                      pre_procession_lite=False):
+    """
+    Returns the estimated rows, columns and bytes of the export, without
+    generating it
+    """
+    class_model = models.get_model(app_name, model_name)
+    request = pre_procession_request(request, class_model, pre_procession_lite)
+    writer_class = export_formats.get_writer_class(report_to)
+    list_fields, list_headers, api = get_report_fields(class_model, fields, list_headers, api)
+    filters, object_list = get_report_object_list(request, class_model, ordering, filters,
+                                                  queryset, report)
+    return estimate_export(object_list, list_fields, list_headers, writer_class, report=report,
+                           separated_field=separated_field, api=api)
+
+
+def reports_view(request, app_name, model_name, fields=None,
+                 list_headers=None, ordering=None, filters=Q(),
+                 api=None, queryset=None,
+                 report_to='csv',
+                 report=None,
+                 separated_field=SEPARATED_FIELD,
+                 pre_procession_lite=False,
+                 streaming=None,
+                 chunk_size=None):
+    name, writer_class, content = reports_content(request, app_name, model_name,
+                                                  fields=fields, list_headers=list_headers,
+                                                  ordering=ordering, filters=filters,
+                                                  api=api, queryset=queryset,
+                                                  report_to=report_to, report=report,
+                                                  separated_field=separated_field,
+                                                  pre_procession_lite=pre_procession_lite,
+                                                  chunk_size=chunk_size)
+    return export_response(name, content, streaming=streaming,
+                           mimetype=writer_class.mimetype)
+
+
+def _get_job(request, job_id):
+    """
+    The job of the user, any job for the staff; the jobs without user only
+    with their token
+    """
+    fail_stale_jobs(job_id)
+    job = get_object_or_404(ReportJob, pk=job_id)
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated() and user.is_staff:
+        return job
+    if job.user_id:
+        if user is None or job.user_id != user.id:
+            raise Http404
+    elif not job.token or not constant_time_compare(request.GET.get('token', ''), job.token):
+        raise Http404
+    return job
+
+
+def reports_job(request, job_id):
+    job = _get_job(request, job_id)
+    if request.is_ajax() or request.GET.get('format', None) == 'json':
+        data = {'id': job.pk,
+                'status': job.status,
+                'status_display': unicode(job.get_status_display()),
+                'is_finished': job.is_finished,
+                'download_url': job.get_download_url()}
+        return HttpResponse(simplejson.dumps(data),
+                            mimetype='application/json')
+    return render_to_response('autoreports/autoreports_job.html',
+                              {'job': job,
+                               'template_base': getattr(settings, 'AUTOREPORTS_BASE_TEMPLATE', 'base.html'),
+                              },
+                              context_instance=RequestContext(request))
 
-    response = csv_head(name, list_headers)
-    csv_body(response, class_model, object_list, list_fields,
-             separated_field=separated_field, api=api)
-    if report_to == 'excel':
-        convert_to_excel(response)
-    return response
+
+def reports_job_download(request, job_id):
+    job = _get_job(request, job_id)
+    if job.status != JOB_DONE:
+        raise Http404
+    writer_class = export_formats.get_writer_class(job.report_to)
+    content = iter_file(get_job_storage().open(job.file_name))
+    return export_response(os.path.basename(job.file_name), content, streaming=True,
+                           mimetype=writer_class.mimetype)
 
 
 def set_filters_search_fields(model_admin, request, filters, class_model):
@@ -214,29 +506,3 @@ def is_translate_field(field_name, class_model):
         if field_name in getattr(class_parent._meta, 'translatable_fields', []):
             return True
     return False
-
-
-def csv_head(filename, columns, delimiter=','):
-    response = HttpResponse(mimetype='application/vnd.ms-excel')
-    response['Content-Disposition'] = 'attachment; filename=%s' % filename
-    writer = csv.writer(response, delimiter=delimiter)
-    writer.writerow(columns)
-    return response
-
-
-def csv_body(response, class_model, object_list, list_fields, delimiter=',',
-             separated_field=SEPARATED_FIELD, api=None):
-    writer = csv.writer(response, delimiter=delimiter)
-    for obj in object_list:
-        values = []
-        for field_name in list_fields:
-            value = get_value_from_object(obj, field_name,
-                                          separated_field=separated_field,
-                                          api=api)
-            value = get_parser_value(value)
-            values.append(value)
-        writer.writerow(values)
-    value = response.content
-    value = value.replace('\t', ' ').replace('\r\n', '\n')
-    value = value.replace('\n\n', '\n')
-    response.content = value
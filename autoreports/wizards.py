@@ -7,7 +7,7 @@ from django.utils.translation import ugettext
 from django.utils.translation import ugettext_lazy as _
 
 from autoreports.models import Report
-from autoreports.utils import get_adaptor, parsed_field_name, get_field_by_name
+from autoreports.utils import get_adaptor, get_compiled_report, parsed_field_name, get_field_by_name
 from formadmin.forms import FormAdminDjango
 
 
@@ -101,6 +101,17 @@ class WizardField(forms.Form):
                                                       required=False,
                                                       help_text=_('Chose other widget. If you change the widget it\'s possible that the filter change also'))
 
+        if autoreport_field.can_group_by:
+            self.fields['group_by'] = forms.BooleanField(label=_('Group by'),
+                                                         required=False,
+                                                         help_text=_('The report has a row by every value of the fields to group by, with the totals'))
+        aggregates = autoreport_field.get_aggregates()
+        if aggregates:
+            self.fields['aggregates'] = forms.MultipleChoiceField(label=_('Totals'),
+                                                                  choices=aggregates,
+                                                                  widget=forms.CheckboxSelectMultiple,
+                                                                  required=False)
+
         self.fields['order'] = forms.IntegerField(label=_('order'),
                                                  initial=0,
                                                  required=False)
@@ -111,16 +122,20 @@ class WizardField(forms.Form):
 
         if instance:
             field_name = autoreport_field.field_name
-            field_options = instance.options.get(field_name)
-            widget_initial = field_options.get('widget', None)
+            field_options = get_compiled_report(instance).get_options(field_name)
             if not field_options:
                 return
+            widget_initial = field_options.get('widget', None)
             self.fields['display'].initial = field_options.get('display', False)
             self.fields['order'].initial = field_options.get('order', 0)
             if filters:
                 self.fields['filters'].initial = field_options.get('filters', tuple())
             if widgets:
                 self.fields['widget'].initial = widget_initial
+            if autoreport_field.can_group_by:
+                self.fields['group_by'].initial = field_options.get('group_by', False)
+            if aggregates:
+                self.fields['aggregates'].initial = field_options.get('aggregates', tuple())
             if autoreports_i18n:
                 for lang_code, lang_text in settings.LANGUAGES:
                     label = 'label_%s' % lang_code
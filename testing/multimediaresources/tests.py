@@ -5,7 +5,53 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+import datetime
+import os
+import decimal
+import shutil
+import tempfile
+import threading
+
+from StringIO import StringIO
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.sites.models import Site
+from django.core.management import call_command
+from django.core.signals import request_finished
+from django.db import connection
+from django.db.models import Count, Q
+from django.http import Http404
 from django.test import TestCase
+from django.test.client import RequestFactory
+from django.utils import simplejson, unittest
+
+from autoreports import excel, preflight
+from autoreports.api import ReportApi
+from autoreports.cache import DjangoExportCache, FileExportCache, get_export_models
+from autoreports.exports import (get_aggregated_values, get_related_lookups, get_relation_column,
+                                 get_values,
+                                 is_aggregated_report, iter_queryset_chunks, write_export)
+from autoreports.formats import ColumnarWriter, CSVWriter, read_columnar
+from autoreports import jobs
+from autoreports.jobs import (LocalJobPool, claim_job, fail_stale_jobs, get_job_request, get_job_storage,
+                              submit_job)
+from autoreports.models import Report, ReportJob, JOB_FAILED
+from autoreports.parallel import get_export_processes, get_shards, write_parallel_export
+from autoreports.preflight import (EXPORT_ALLOWED, EXPORT_ASYNC, EXPORT_REFUSED, check_export,
+                                   count_rows, estimate_export, estimate_rows)
+from autoreports import fields as report_fields
+from autoreports import utils
+from autoreports.utils import (ExportContext, ReportRequest, add_domain, bulk_value, clear_compiled_reports, clear_model_schemas, filter_queryset, filtering_from_request,
+                               format_booleans, format_dates, format_numbers, format_related, format_texts,
+                               get_adaptor, get_column_formatters, get_parser_value, is_multivalued_lookup, get_column_accessor, get_column_formatter, get_field_by_name, get_field_from_model,
+                               get_compiled_report, get_fields_from_model, get_model_schema, get_options_hash, get_value_from_object,
+                               pre_procession_request)
+from autoreports.views import (clear_wizard_version, get_wizard_version, record_report_run, reports_ajax_fields, reports_ajax_fields_batch,
+                               reports_ajax_fields_options, reports_content, reports_job)
+
+from multimediaresources.models import Resource, SetResource, TypeResource, STATUS
 
 
 class SimpleTest(TestCase):
@@ -14,3 +60,1006 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class ReportExportTest(TestCase):
+
+    def setUp(self):
+        self.use_cmsutils = getattr(settings, 'AUTOREPORTS_USE_CMSUTILS', True)
+        settings.AUTOREPORTS_USE_CMSUTILS = False
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+
+    def tearDown(self):
+        settings.AUTOREPORTS_USE_CMSUTILS = self.use_cmsutils
+
+    def test_quick_report_is_streamed(self):
+        response = self.client.get('/admin/multimediaresources/resource/report/quick/')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response._is_string)
+        lines = response.content.splitlines()
+        self.assertEqual(len(lines), Resource.objects.count() + 1)
+        self.assertEqual(lines[1], 'Dive into Python,2006-02-17,Book,Available,True')
+
+    @unittest.skipUnless(excel.xlwt, 'xlwt is not installed')
+    def test_excel_report(self):
+        import xlrd
+        response = self.client.get('/admin/multimediaresources/resource/report/advance/',
+                                   {'__report_excel': '1',
+                                    '__report_display_fields_choices': ['name', 'created', 'can_borrow']})
+        book = xlrd.open_workbook(file_contents=response.content)
+        sheet = book.sheet_by_index(0)
+        self.assertEqual(sheet.nrows, Resource.objects.count() + 1)
+        self.assertEqual(sheet.cell_value(1, 0), u'Dive into Python')
+        self.assertEqual(sheet.cell_type(1, 1), xlrd.XL_CELL_DATE)
+        self.assertEqual(xlrd.xldate_as_tuple(sheet.cell_value(1, 1), book.datemode)[:3], (2006, 2, 17))
+        self.assertEqual(sheet.cell_type(1, 2), xlrd.XL_CELL_BOOLEAN)
+
+    @unittest.skipUnless(excel.XLSXWriter.is_available(), 'openpyxl is not installed')
+    def test_xlsx_report(self):
+        import openpyxl
+        response = self.client.get('/admin/multimediaresources/resource/report/advance/',
+                                   {'__report_xlsx': '1',
+                                    '__report_display_fields_choices': ['name', 'created']})
+        sheet = openpyxl.load_workbook(StringIO(response.content)).worksheets[0]
+        rows = list(sheet.iter_rows(values_only=True))
+        self.assertEqual(len(rows), Resource.objects.count() + 1)
+        self.assertEqual(rows[1][0], u'Dive into Python')
+        self.assertEqual(rows[1][1].date(), datetime.date(2006, 2, 17))
+
+    def test_jsonl_report(self):
+        response = self.client.get('/admin/multimediaresources/resource/report/advance/',
+                                   {'__report_jsonl': '1',
+                                    '__report_display_fields_choices': ['name', 'created', 'can_borrow']})
+        lines = response.content.splitlines()
+        self.assertEqual(len(lines), Resource.objects.count() + 1)
+        self.assertEqual(lines[1], '["Dive into Python","2006-02-17",true]')
+
+    def test_quick_report_normalize_values(self):
+        SetResource.objects.create(name='Tabs\tand\r\n\r\nnew lines')
+        response = self.client.get('/admin/multimediaresources/setresource/report/quick/')
+        self.assertEqual(response.content, '__str__\n"Tabs and\nnew lines"\n')
+
+
+class ReportJobTest(TestCase):
+
+    def setUp(self):
+        self.old_settings = dict([(name, getattr(settings, name, None)) for name in
+                                  ('AUTOREPORTS_USE_CMSUTILS', 'AUTOREPORTS_ASYNC_EXPORT',
+                                   'AUTOREPORTS_JOB_WORKERS', 'AUTOREPORTS_JOB_ROOT')])
+        self.job_root = tempfile.mkdtemp()
+        settings.AUTOREPORTS_USE_CMSUTILS = False
+        settings.AUTOREPORTS_ASYNC_EXPORT = True
+        settings.AUTOREPORTS_JOB_WORKERS = 0
+        settings.AUTOREPORTS_JOB_ROOT = self.job_root
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+
+    def tearDown(self):
+        for name, value in self.old_settings.items():
+            setattr(settings, name, value)
+        shutil.rmtree(self.job_root)
+
+    def test_async_report(self):
+        data = {'__report_csv': '1',
+                '__report_display_fields_choices': ['name', 'created']}
+        sync_response = self.client.get('/admin/multimediaresources/resource/report/advance/', data)
+        data['__report_async'] = '1'
+        response = self.client.get('/admin/multimediaresources/resource/report/advance/', data)
+        job = ReportJob.objects.get()
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].endswith('/autoreports/jobs/%s/' % job.pk))
+        status = self.client.get('/autoreports/jobs/%s/' % job.pk, {'format': 'json'})
+        self.assertEqual(simplejson.loads(status.content)['status'], 'pending')
+        call_command('autoreports_worker', once=True)
+        status = simplejson.loads(self.client.get('/autoreports/jobs/%s/' % job.pk, {'format': 'json'}).content)
+        self.assertEqual(status['status'], 'done')
+        response = self.client.get(status['download_url'])
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename=multimediaresources-resource.csv')
+        self.assertEqual(response.content, sync_response.content)
+
+    def test_job_of_other_user(self):
+        self.client.get('/admin/multimediaresources/resource/report/advance/',
+                        {'__report_csv': '1', '__report_async': '1',
+                         '__report_display_fields_choices': ['name']})
+        job = ReportJob.objects.get()
+        request = RequestFactory().get('/autoreports/jobs/%s/' % job.pk)
+        request.user = User.objects.create_user('other', 'other@example.com', 'other')
+        self.assertRaises(Http404, reports_job, request, job.pk)
+
+    def test_job_without_user(self):
+        job = ReportJob.objects.create(content_type=ContentType.objects.get_for_model(Resource),
+                                       report_to='csv', options={})
+        self.assertEqual(len(job.token), 32)
+        self.assertTrue(job.get_absolute_url().endswith('?token=%s' % job.token))
+        for data in ({}, {'token': 'x' * 32}):
+            data['format'] = 'json'
+            request = RequestFactory().get('/autoreports/jobs/%s/' % job.pk, data)
+            request.user = AnonymousUser()
+            self.assertRaises(Http404, reports_job, request, job.pk)
+        request = RequestFactory().get('/autoreports/jobs/%s/' % job.pk, {'token': job.token, 'format': 'json'})
+        request.user = AnonymousUser()
+        self.assertEqual(simplejson.loads(reports_job(request, job.pk).content)['id'], job.pk)
+
+    def test_stale_job(self):
+        job = ReportJob.objects.create(content_type=ContentType.objects.get_for_model(Resource),
+                                       report_to='csv', options={})
+        self.assertTrue(claim_job(job.pk))
+        self.assertEqual(fail_stale_jobs(), 0)
+        ReportJob.objects.filter(pk=job.pk).update(started=datetime.datetime.now() - datetime.timedelta(days=1))
+        self.assertEqual(fail_stale_jobs(), 1)
+        self.assertEqual(ReportJob.objects.get(pk=job.pk).status, JOB_FAILED)
+        job = ReportJob.objects.create(content_type=ContentType.objects.get_for_model(Resource),
+                                       report_to='csv', options={})
+        self.assertEqual(fail_stale_jobs(), 0)
+        ReportJob.objects.filter(pk=job.pk).update(created=datetime.datetime.now() - datetime.timedelta(days=1))
+        self.assertEqual(fail_stale_jobs(), 1)
+        self.assertEqual(ReportJob.objects.get(pk=job.pk).status, JOB_FAILED)
+
+    def test_saved_filters(self):
+        data = {'__report_csv': '1', '__report_async': '1',
+                '__report_display_fields_choices': ['name'], 'name__icontains': 'python'}
+        self.client.get('/admin/multimediaresources/resource/report/advance/', data)
+        job = ReportJob.objects.get()
+        self.assertEqual(job.options['filters'], {'name__icontains': 'python'})
+        # The querystring is not replayed
+        job.options['query_string'] = 'name__icontains=nothing'
+        job.save()
+        request = get_job_request(job)
+        self.assertEqual(request.GET.keys(), [])
+        call_command('autoreports_worker', once=True)
+        job = ReportJob.objects.get(pk=job.pk)
+        content = get_job_storage().open(job.file_name).read()
+        self.assertEqual(len(content.splitlines()),
+                         Resource.objects.filter(name__icontains='python').count() + 1)
+
+    def test_submitted_after_commit(self):
+        class FakeJobPool(object):
+            job_ids = []
+
+            def submit(self, job_id):
+                self.job_ids.append(job_id)
+
+        settings.AUTOREPORTS_JOB_WORKERS = 1
+        old_job_pool = jobs._job_pool
+        jobs._job_pool = pool = FakeJobPool()
+        try:
+            job = ReportJob.objects.create(content_type=ContentType.objects.get_for_model(Resource),
+                                           report_to='csv', options={})
+            # The tests run in a transaction, like the requests with TransactionMiddleware
+            submit_job(job)
+            self.assertEqual(pool.job_ids, [])
+            request_finished.send(sender=None)
+            self.assertEqual(pool.job_ids, [job.pk])
+        finally:
+            jobs._job_pool = old_job_pool
+
+    def test_pool_runs_pending_jobs(self):
+        job = ReportJob.objects.create(content_type=ContentType.objects.get_for_model(Resource),
+                                       report_to='csv', options={'fields': ['name']})
+        LocalJobPool(0, interval=1).run_pending_jobs()
+        self.assertEqual(ReportJob.objects.get(pk=job.pk).status, 'done')
+
+
+class ExportCacheTest(TestCase):
+
+    def setUp(self):
+        self.old_settings = dict([(name, getattr(settings, name, None)) for name in
+                                  ('AUTOREPORTS_USE_CMSUTILS', 'AUTOREPORTS_EXPORT_CACHE',
+                                   'AUTOREPORTS_EXPORT_CACHE_DIR')])
+        self.cache_dir = tempfile.mkdtemp()
+        settings.AUTOREPORTS_USE_CMSUTILS = False
+        settings.AUTOREPORTS_EXPORT_CACHE = 'autoreports.cache.FileExportCache'
+        settings.AUTOREPORTS_EXPORT_CACHE_DIR = self.cache_dir
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+
+    def tearDown(self):
+        for name, value in self.old_settings.items():
+            setattr(settings, name, value)
+        shutil.rmtree(self.cache_dir)
+
+    def get_report(self):
+        return self.client.get('/admin/multimediaresources/resource/report/advance/',
+                               {'__report_csv': '1',
+                                '__report_display_fields_choices': ['name']}).content
+
+    def test_cached_export(self):
+        content = self.get_report()
+        self.assertTrue('Dive into Python' in content)
+        # update() does not send post_save, so the cached export is used
+        Resource.objects.filter(pk=1).update(name='Dive into Python 3')
+        self.assertEqual(self.get_report(), content)
+        resource = Resource.objects.get(pk=1)
+        resource.save()
+        self.assertTrue('Dive into Python 3' in self.get_report())
+
+    def test_lru_eviction(self):
+        export_cache = FileExportCache(location=self.cache_dir, max_size=10)
+        for key in ('a', 'b'):
+            list(export_cache.store(key, Resource, iter(['1234'])))
+        self.assertEqual(''.join(export_cache.get('a', Resource)), '1234')
+        list(export_cache.store('c', Resource, iter(['1234'])))
+        self.assertEqual(export_cache.get('b', Resource), None)
+        self.assertEqual(''.join(export_cache.get('a', Resource)), '1234')
+        # Bigger than the cache, it is sent but not kept
+        self.assertEqual(list(export_cache.store('d', Resource, iter(['123456', '123456']))),
+                         ['123456', '123456'])
+        self.assertEqual(export_cache.get('d', Resource), None)
+
+    def test_django_cache(self):
+        export_cache = DjangoExportCache(max_size=10)
+        generation = export_cache.get_generation(Resource)
+        list(export_cache.store('a', Resource, iter(['12', '34'])))
+        list(export_cache.store('b', SetResource, iter(['1234'])))
+        self.assertEqual(list(export_cache.get('a', Resource)), ['1234'])
+        export_cache.invalidate(Resource)
+        self.assertNotEqual(export_cache.get_generation(Resource), generation)
+        self.assertEqual(export_cache.get('a', Resource), None)
+        self.assertEqual(list(export_cache.get('b', SetResource)), ['1234'])
+        # Bigger than a value of the cache
+        export_cache = DjangoExportCache(max_size=10, max_item_size=3)
+        self.assertEqual(list(export_cache.store('c', Resource, iter(['1234']))), ['1234'])
+        self.assertEqual(export_cache.get('c', Resource), None)
+        # The index is busy
+        export_cache.lock_index()
+        try:
+            list(export_cache.store('d', Resource, iter(['12'])))
+        finally:
+            export_cache.unlock_index()
+        self.assertEqual(export_cache.get('d', Resource), None)
+
+    def test_related_models(self):
+        self.assertEqual(get_export_models(Resource, ['name', 'resource_type$__$name',
+                                                      'setresource__name__icontains']),
+                         [Resource, TypeResource, SetResource, SetResource.resources.through])
+        fields = ['name', 'resource_type$__$name', 'owner$__$username']
+
+        def get_report():
+            request = RequestFactory().get('/')
+            request.user = AnonymousUser()
+            name, writer_class, content = reports_content(request, 'multimediaresources', 'resource',
+                                                          fields=fields, list_headers=fields)
+            return ''.join(content)
+        content = get_report()
+        self.assertEqual(len(os.listdir(os.path.join(self.cache_dir, 'generations'))), 4)
+        self.assertEqual(get_report(), content)
+        resource = Resource.objects.get(pk=1)
+        resource_type = resource.resource_type
+        resource_type.name = 'Ebook'
+        resource_type.save()
+        self.assertTrue('Ebook' in get_report())
+        resource.owner.add(User.objects.create_user('reader', 'reader@example.com', 'reader'))
+        self.assertTrue('reader' in get_report())
+
+
+class ExportChunksTest(TestCase):
+
+    def assertChunks(self, queryset):
+        chunks = list(iter_queryset_chunks(queryset, chunk_size=2))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 1])
+        self.assertEqual([obj.pk for chunk in chunks for obj in chunk],
+                         [obj.pk for obj in queryset])
+
+    def test_keyset_chunks(self):
+        self.assertChunks(Resource.objects.all())
+        self.assertChunks(Resource.objects.order_by('-pk'))
+
+    def test_ordered_chunks(self):
+        self.assertChunks(Resource.objects.order_by('-name'))
+        self.assertChunks(Resource.objects.filter(owner__isnull=False).order_by('created').distinct())
+        self.assertChunks(Resource.objects.order_by('status', '-resource_type__name'))
+        # The fields that can be null are sliced
+        self.assertChunks(Resource.objects.order_by('amount', 'pk'))
+
+    def test_ordered_keyset(self):
+        connection.use_debug_cursor = True
+        try:
+            connection.queries = []
+            list(iter_queryset_chunks(Resource.objects.order_by('-name'), chunk_size=2))
+            self.assertEqual(len(connection.queries), 2)
+            self.assertFalse([query for query in connection.queries if 'OFFSET' in query['sql']])
+            connection.queries = []
+            list(iter_queryset_chunks(Resource.objects.order_by('amount', 'pk'), chunk_size=2))
+            self.assertTrue('OFFSET 2' in connection.queries[-1]['sql'])
+        finally:
+            connection.use_debug_cursor = None
+
+
+class ExportRelatedLookupsTest(TestCase):
+
+    def test_related_lookups(self):
+        list_fields = ['name', 'resource_type', 'resource_type$__$name',
+                       'owner$__$username', 'setresource$__$resources$__$resource_type']
+        self.assertEqual(get_related_lookups(Resource, list_fields),
+                         (['resource_type'], ['owner', 'setresource_set__resources__resource_type']))
+
+    def test_foreign_keys_are_joined(self):
+        list_fields = ['name', 'resource_type', 'resource_type$__$name']
+        queryset = Resource.objects.all()
+        self.assertNumQueries(1, lambda: list(get_values(queryset, list_fields)))
+
+
+class ColumnAccessorTest(TestCase):
+
+    def test_column_accessor_is_cached(self):
+        accessor = get_column_accessor(Resource, 'resource_type$__$name')
+        self.assertTrue(accessor is get_column_accessor(Resource, 'resource_type$__$name'))
+        resource = Resource.objects.get(pk=1)
+        self.assertEqual(accessor(resource), get_value_from_object(resource, 'resource_type$__$name'))
+        self.assertEqual(accessor(resource), 'Book')
+
+    def test_cached_by_api_class(self):
+        accessor = get_column_accessor(Resource, 'name', api=ResourceCountApi(Resource))
+        self.assertTrue(accessor is get_column_accessor(Resource, 'name', api=ResourceCountApi(Resource)))
+        formatter = get_column_formatter(Resource, 'count_owners', api=ResourceCountApi(Resource))
+        self.assertEqual(len([key for key in utils._column_formatters.keys() if key[-1] is ResourceCountApi]), 1)
+        self.assertTrue(formatter is get_column_formatter(Resource, 'count_owners', api=ResourceCountApi(Resource)))
+        # The functions of the api are bound to every instance
+        apis = [ResourcePrefixApi(Resource), ResourcePrefixApi(Resource)]
+        apis[1].prefix = 'Other'
+        resource = Resource.objects.all()[0]
+        for api in apis:
+            accessor = get_column_accessor(Resource, 'prefixed_name', api=api)
+            self.assertEqual(accessor(resource), '%s: %s' % (api.prefix, resource.name))
+            self.assertTrue(accessor is get_column_accessor(Resource, 'prefixed_name', api=api))
+        max_field_adaptors = utils.MAX_FIELD_ADAPTORS
+        utils.MAX_FIELD_ADAPTORS = 2
+        try:
+            for field_name in ('name', 'status', 'amount'):
+                get_column_accessor(Resource, field_name)
+            self.assertTrue(len(utils._column_accessors) <= 2)
+        finally:
+            utils.MAX_FIELD_ADAPTORS = max_field_adaptors
+
+
+class ResourcePrefixApi(ReportApi):
+
+    prefix = 'Resource'
+
+    def prefixed_name(self, obj):
+        return '%s: %s' % (self.prefix, obj.name)
+
+
+class ListSpreadsheetWriter(excel.SpreadsheetWriter):
+
+    library = list
+
+    def get_workbook(self):
+        return []
+
+    def add_sheet(self, title):
+        sheet = (title, [])
+        self.workbook.append(sheet)
+        return sheet
+
+    def append(self, row):
+        self.sheet[1].append(row)
+        self.row_number += 1
+
+    def save(self):
+        return ''
+
+
+class AdaptorTest(TestCase):
+
+    def test_adaptor_dispatch(self):
+        adaptors = {'id': report_fields.AutoNumberFieldReportField,
+                    'name': report_fields.TextFieldReportField,
+                    'description': report_fields.TextFieldReportField,
+                    'status': report_fields.ChoicesFieldReportField,
+                    'created': report_fields.DateFieldReportField,
+                    'available_from': report_fields.DateTimeFieldReportField,
+                    'amount': report_fields.NumberFieldReportField,
+                    'can_borrow': report_fields.BooleanFieldReportField,
+                    'resource_type': report_fields.ForeingKeyReportField,
+                    'owner': report_fields.M2MReportField,
+                    'setresource': report_fields.RelatedReverseField}
+        for field_name, adaptor in adaptors.items():
+            field = get_field_by_name(Resource, field_name)[1]
+            self.assertEqual(get_adaptor(field), adaptor)
+            self.assertEqual(get_adaptor(field), adaptor)
+        self.assertEqual(get_adaptor(lambda obj: obj), report_fields.FuncField)
+
+
+class FormFieldsCacheTest(TestCase):
+
+    def test_cached_form_fields(self):
+        api = ReportApi(Resource)
+        api.report_filter_fields = ('name', 'amount', 'created')
+        fields_form_filter, fields_form_display = api.get_fields_of_form()
+        field_name = fields_form_filter.keys()[0]
+        fields_form_filter[field_name].label = u'Changed'
+        cached_form_filter, cached_form_display = api.get_fields_of_form()
+        self.assertEqual(len(cached_form_filter), 3)
+        self.assertEqual(fields_form_filter.keys(), cached_form_filter.keys())
+        self.assertNotEqual(cached_form_filter[field_name].label, u'Changed')
+        form_filter = api.get_report_form_filter(None, cached_form_filter)
+        self.assertEqual(form_filter.fields.keys(), cached_form_filter.keys())
+        form_display = api.get_report_form_display(None, cached_form_display)
+        self.assertTrue(type(form_display).__bases__[0] is
+                        type(api.get_report_form_display(None, {})).__bases__[0])
+
+
+class ModelSchemaTest(TestCase):
+
+    def test_fields_from_schema(self):
+        clear_model_schemas()
+        schema = get_model_schema(Resource)
+        simplejson.dumps(schema)
+        self.assertTrue(get_model_schema(Resource) is schema)
+        fields, funcs = get_fields_from_model(Resource, prefix='setresource')
+        field_names = [field['name'] for field in fields]
+        self.assertTrue('name' in field_names and 'resource_type' in field_names)
+        name = [field for field in fields if field['name'] == 'name'][0]
+        self.assertEqual(name['name_prefix'], 'setresource$__$name')
+        resource_type = [field for field in fields if field['name'] == 'resource_type'][0]
+        self.assertEqual(resource_type['collapsible'], {'app_label': 'multimediaresources',
+                                                        'module_name': 'typeresource'})
+        fields, funcs = get_fields_from_model(Resource, ignore_models=[SetResource])
+        self.assertFalse('setresource' in [field['name'] for field in fields])
+        fields, funcs = get_fields_from_model(Resource, adaptors=(report_fields.TextFieldReportField, ))
+        self.assertEqual(set([field['name'] for field in fields]), set(['name', 'description', 'status']))
+
+
+class WizardCacheTest(TestCase):
+
+    def test_etag(self):
+        factory = RequestFactory()
+        data = {'app_label': 'multimediaresources', 'module_name': 'resource'}
+        response = reports_ajax_fields(factory.get('/autoreports/ajax/fields/tree/', data))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue('name' in response.content)
+        etag = response['ETag']
+        response = reports_ajax_fields(factory.get('/autoreports/ajax/fields/tree/', data,
+                                                   HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(response.status_code, 304)
+        data['field'] = 'name'
+        data['is_admin'] = 'true'
+        response = reports_ajax_fields_options(factory.get('/autoreports/ajax/fields/options/', data,
+                                                           HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        content = response.content
+        response = reports_ajax_fields_options(factory.get('/autoreports/ajax/fields/options/', data))
+        self.assertEqual(response.content, content)
+
+    def test_etag_version(self):
+        factory = RequestFactory()
+        data = {'app_label': 'multimediaresources', 'module_name': 'resource'}
+        etag = reports_ajax_fields(factory.get('/autoreports/ajax/fields/tree/', data))['ETag']
+        self.assertTrue(get_wizard_version().split(':')[0] != '0')
+        old_wizard_version = getattr(settings, 'AUTOREPORTS_WIZARD_VERSION', '')
+        settings.AUTOREPORTS_WIZARD_VERSION = 'deploy-2'
+        clear_wizard_version()
+        try:
+            response = reports_ajax_fields(factory.get('/autoreports/ajax/fields/tree/', data,
+                                                       HTTP_IF_NONE_MATCH=etag))
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response['ETag'], etag)
+        finally:
+            settings.AUTOREPORTS_WIZARD_VERSION = old_wizard_version
+            clear_wizard_version()
+
+    def test_batch(self):
+        factory = RequestFactory()
+        trees = [['multimediaresources', 'typeresource', 'resource_type'],
+                 ['auth', 'user', 'owner', [['multimediaresources', 'resource']]]]
+        request = factory.get('/autoreports/ajax/fields/trees/', {'trees': simplejson.dumps(trees)})
+        self.assertNumQueries(0, reports_ajax_fields_batch, request)
+        response = reports_ajax_fields_batch(request)
+        data = simplejson.loads(response.content)['trees']
+        self.assertEqual([(tree['module_name'], tree['field']) for tree in data],
+                         [('typeresource', 'resource_type'), ('user', 'owner')])
+        self.assertTrue('resource_type$__$name' in data[0]['content'])
+        single = reports_ajax_fields(factory.get('/autoreports/ajax/fields/tree/',
+                                                 {'app_label': 'auth', 'module_name': 'user', 'field': 'owner',
+                                                  'ignore_app_label': 'multimediaresources',
+                                                  'ignore_module_name': 'resource'}))
+        self.assertEqual(data[1]['content'], single.content.decode('utf-8'))
+        request = factory.get('/autoreports/ajax/fields/trees/', {'trees': '[["auth", "unknown", ""]]'})
+        self.assertRaises(Http404, reports_ajax_fields_batch, request)
+
+    def test_form_prefix(self):
+        def get_prefix(field_name, instance=None):
+            model, field = get_field_from_model(Resource, field_name)
+            return get_adaptor(field)(model, field, field_name, instance=instance).get_form().prefix
+        report = Report.objects.create(name='Resources', content_type=ContentType.objects.get_for_model(Resource),
+                                       options={'name': {}})
+        self.assertEqual(get_prefix('name'), get_prefix('name'))
+        prefixes = [get_prefix('name'), get_prefix('status'), get_prefix('name', report),
+                    get_prefix('resource_type$__$name')]
+        self.assertEqual(len(set(prefixes)), len(prefixes))
+        self.assertFalse([prefix for prefix in prefixes if '-' in prefix])
+
+
+class FilterPlanTest(TestCase):
+
+    def test_single_filter(self):
+        report = Report(content_type=ContentType.objects.get_for_model(Resource),
+                        options={'owner$__$username': {'filters': ['icontains'],
+                                                       'other_fields': ['first_name']},
+                                 'owner$__$email': {'filters': ['icontains']}})
+        request = RequestFactory().get('/', {'owner__username__icontains': 'lgs',
+                                             'owner__email__icontains': '@'})
+        filters, object_list = filtering_from_request(request, Resource.objects.all(), report=report)
+        self.assertEqual(filters['owner__username__icontains'],
+                         [{'owner__username__icontains': u'lgs'},
+                          {'owner__first_name__icontains': u'lgs'}])
+        self.assertEqual(unicode(object_list.query).count('JOIN'), 2)
+        self.assertEqual(sorted([resource.name for resource in object_list]),
+                         sorted([resource.name for resource in
+                                 Resource.objects.filter(owner__username__icontains='lgs',
+                                                         owner__email__icontains='@')]))
+
+
+class SemiJoinTest(TestCase):
+
+    def test_distinct(self):
+        self.assertFalse(is_multivalued_lookup(Resource, 'resource_type__name__icontains'))
+        self.assertTrue(is_multivalued_lookup(Resource, 'owner__username'))
+        self.assertTrue(is_multivalued_lookup(Resource, 'setresource__name'))
+        queryset = filter_queryset(Resource.objects.all(), [Q(name__icontains='a'),
+                                                            Q(resource_type__name__icontains='game')])
+        self.assertFalse(queryset.query.distinct)
+        queryset = filter_queryset(Resource.objects.all(), [Q(owner__username__icontains='l')])
+        self.assertFalse(queryset.query.distinct)
+        self.assertEqual(sorted(queryset.values_list('pk', flat=True)),
+                         sorted(Resource.objects.filter(owner__username__icontains='l').distinct()
+                                                .values_list('pk', flat=True)))
+        queryset = filter_queryset(Resource.objects.filter(owner__username__icontains='l'), [])
+        self.assertTrue(queryset.query.distinct)
+
+    def test_same_related_object(self):
+        resource = Resource.objects.all()[0]
+        resource.owner.add(User.objects.create_user('alpha', 'alpha@example.com', 'alpha'),
+                           User.objects.create_user('beta', 'beta@example.org', 'beta'))
+        filters_q = [Q(owner__username='alpha'), Q(owner__email__endswith='.org')]
+        self.assertEqual(list(filter_queryset(Resource.objects.all(), filters_q)), [])
+        old_same_object = getattr(settings, 'AUTOREPORTS_RELATED_FILTERS_SAME_OBJECT', True)
+        settings.AUTOREPORTS_RELATED_FILTERS_SAME_OBJECT = False
+        try:
+            # The users of the resource match every filter
+            self.assertEqual(list(filter_queryset(Resource.objects.all(), filters_q)), [resource])
+        finally:
+            settings.AUTOREPORTS_RELATED_FILTERS_SAME_OBJECT = old_same_object
+
+
+class ReportRequestTest(TestCase):
+
+    def test_normalized_once(self):
+        request = RequestFactory().get('/', {'name__icontains': '', 'amount__exact': 'x',
+                                             'status__exact': 'av', 'unknown__exact': '1',
+                                             '__report_csv': '1'})
+        report_request = pre_procession_request(request, Resource)
+        self.assertTrue(isinstance(report_request, ReportRequest))
+        self.assertEqual(dict(report_request.GET.lists()), {'status__exact': [u'av'],
+                                                            '__report_csv': [u'1']})
+        self.assertTrue(pre_procession_request(request, Resource) is report_request)
+        self.assertTrue(pre_procession_request(report_request, Resource) is report_request)
+        self.assertEqual(pre_procession_request(request, Resource, lite=True).GET.keys(), [])
+        request = RequestFactory().get('/', {'status__exact': 'av'})
+        self.assertTrue(pre_procession_request(request, Resource) is request)
+
+
+class AggregatedReportTest(TestCase):
+
+    def test_group_by(self):
+        report = Report(content_type=ContentType.objects.get_for_model(Resource),
+                        options={'status': {'group_by': True, 'order': 0},
+                                 'amount': {'aggregates': ['sum', 'count'], 'order': 1},
+                                 'created': {'aggregates': ['min', 'max', 'sum'], 'order': 2},
+                                 'name': {'order': 3}})
+        self.assertTrue(is_aggregated_report(report))
+        headers, rows = get_aggregated_values(Resource.objects.all(), report)
+        self.assertEqual(headers, ['Status', 'Amount (Sum)', 'Amount (Count)',
+                                   'Date of created (Minimum)', 'Date of created (Maximum)'])
+        choices = dict(STATUS)
+        expected = []
+        for status in sorted(set(Resource.objects.values_list('status', flat=True))):
+            resources = Resource.objects.filter(status=status)
+            amounts = [resource.amount for resource in resources if resource.amount is not None]
+            created = [resource.created for resource in resources]
+            expected.append([choices[status], amounts and sum(amounts) or None, len(amounts),
+                             min(created), max(created)])
+        self.assertEqual(rows, expected)
+
+    def test_totals(self):
+        report = Report(content_type=ContentType.objects.get_for_model(Resource),
+                        options={'resource_type': {'aggregates': ['count'], 'order': 0},
+                                 'amount': {'aggregates': ['max'], 'order': 1}})
+        headers, rows = get_aggregated_values(Resource.objects.all(), report)
+        self.assertEqual(rows, [[Resource.objects.count(),
+                                 max(Resource.objects.values_list('amount', flat=True))]])
+        report.options = {'resource_type': {'aggregates': ['count'], 'order': 0, 'group_by': True},
+                          'amount': {'aggregates': ['max'], 'order': 1}}
+        headers, rows = get_aggregated_values(Resource.objects.all(), report)
+        self.assertEqual([row[0].pk for row in rows],
+                         sorted(set(Resource.objects.values_list('resource_type', flat=True))))
+        self.assertFalse(is_aggregated_report(Report(options={'name': {}})))
+
+
+class PreflightTest(TestCase):
+
+    def setUp(self):
+        self.old_settings = dict([(name, getattr(settings, name, None)) for name in
+                                  ('AUTOREPORTS_USE_CMSUTILS', 'AUTOREPORTS_EXPORT_MAX_ROWS')])
+        settings.AUTOREPORTS_USE_CMSUTILS = False
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+
+    def tearDown(self):
+        for name, value in self.old_settings.items():
+            setattr(settings, name, value)
+
+    def test_estimate(self):
+        self.assertEqual(count_rows(Resource.objects.all(), 1), (2, False))
+        self.assertEqual(count_rows(Resource.objects.all()), (Resource.objects.count(), True))
+        object_list = Resource.objects.all()
+        estimate = estimate_export(object_list, ['name', 'amount'], ['Name', 'Amount'], CSVWriter)
+        output = ''.join(write_export(CSVWriter(), ['Name', 'Amount'],
+                                      [[resource.name, resource.amount] for resource in object_list]))
+        self.assertEqual(estimate, {'rows': Resource.objects.count(), 'exact': True,
+                                    'columns': 2, 'bytes': len(output)})
+        estimate = estimate_export(Resource.objects.none(), ['name'], ['Name'], CSVWriter)
+        self.assertEqual((estimate['rows'], estimate['bytes']), (0, len('Name\n')))
+
+    def test_bounded_count(self):
+        connection.use_debug_cursor = True
+        try:
+            connection.queries = []
+            self.assertEqual(count_rows(Resource.objects.filter(amount__gte=0), 1), (2, False))
+            self.assertEqual(len(connection.queries), 1)
+            sql = connection.queries[0]['sql']
+            self.assertTrue(sql.startswith('SELECT COUNT(*) FROM (SELECT'))
+            self.assertTrue('LIMIT 2)' in sql)
+        finally:
+            connection.use_debug_cursor = None
+
+    def test_planner_confirmed(self):
+        old_get_planner_rows = preflight.get_planner_rows
+        preflight.get_planner_rows = lambda queryset: 10 ** 9
+        try:
+            api = ReportApi(Resource)
+            self.assertEqual(estimate_rows(Resource.objects.all(), api=api), (10 ** 9, False))
+            api.export_max_rows = 1000
+            self.assertNumQueries(1, estimate_rows, Resource.objects.all(), api=api)
+            estimate = estimate_rows(Resource.objects.all(), api=api)
+            self.assertEqual(estimate, (Resource.objects.count(), True))
+            self.assertEqual(check_export({'rows': estimate[0]}, api), EXPORT_ALLOWED)
+        finally:
+            preflight.get_planner_rows = old_get_planner_rows
+
+    def test_estimate_grouped(self):
+        report = Report(content_type=ContentType.objects.get_for_model(Resource),
+                        options={'status': {'group_by': True, 'order': 0},
+                                 'amount': {'aggregates': ['sum'], 'order': 1}})
+        self.assertNumQueries(1, estimate_export, Resource.objects.all(), [], [], CSVWriter, report)
+        estimate = estimate_export(Resource.objects.all(), [], [], CSVWriter, report)
+        self.assertEqual(estimate, {'rows': len(set(Resource.objects.values_list('status', flat=True))),
+                                    'exact': True, 'columns': 2, 'bytes': None})
+        report.options = {'amount': {'aggregates': ['sum'], 'order': 1}}
+        self.assertEqual(estimate_export(Resource.objects.all(), [], [], CSVWriter, report)['rows'], 1)
+
+    def test_limits(self):
+        api = ReportApi(Resource)
+        self.assertEqual(check_export({'rows': 10}, api), EXPORT_ALLOWED)
+        api.export_async_rows = 5
+        self.assertEqual(check_export({'rows': 10}, api), EXPORT_ASYNC)
+        api.export_max_rows = 8
+        self.assertEqual(check_export({'rows': 10}, api), EXPORT_REFUSED)
+        self.assertEqual(check_export({'rows': 8}, api), EXPORT_ASYNC)
+
+    def test_report_form(self):
+        data = {'__report_display_fields_choices': ['name', 'created']}
+        response = self.client.get('/admin/multimediaresources/resource/report/advance/',
+                                   dict(data, __report_preflight='jsonl'))
+        estimate = simplejson.loads(response.content)
+        self.assertEqual((estimate['rows'], estimate['columns']), (Resource.objects.count(), 2))
+        response = self.client.get('/admin/multimediaresources/resource/report/advance/',
+                                   dict(data, __filter='1'))
+        self.assertEqual(response.context['export_estimate'], None)
+        settings.AUTOREPORTS_EXPORT_MAX_ROWS = 1
+        response = self.client.get('/admin/multimediaresources/resource/report/advance/',
+                                   dict(data, __filter='1'))
+        self.assertEqual(response.context['export_estimate']['rows'], Resource.objects.count())
+        response = self.client.get('/admin/multimediaresources/resource/report/advance/',
+                                   dict(data, __report_csv='1'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['export_error'])
+
+
+class ColumnFormattersTest(TestCase):
+
+    def test_same_values(self):
+        values = [None, 0, 1, 2 ** 40, 1.5, decimal.Decimal('0.00'), decimal.Decimal('2.50'),
+                  datetime.date(2006, 2, 17), datetime.datetime(2011, 3, 1, 10, 30), True, False,
+                  u'', '', u'Dive into Python \xf1', 'Dive', [], [1, u'a', [2]],
+                  Resource.objects.all(), SetResource.objects.none()] + list(Resource.objects.all())
+        for formatter in (format_numbers, format_dates, format_booleans, format_texts, format_related):
+            self.assertEqual(formatter(values), [get_parser_value(value) for value in values])
+
+    def test_columns(self):
+        fields = ['name', 'created', 'status', 'resource_type', 'owner', 'amount', 'can_borrow',
+                  'available_from', 'resource_type$__$name', 'owner$__$username', 'computerresource']
+        formatters = get_column_formatters(Resource, fields)
+        self.assertEqual(formatters[:7], [format_texts, format_dates, format_texts, format_related,
+                                          format_related, format_numbers, format_booleans])
+        rows = [[get_parser_value(value) for value in values]
+                for values in get_values(Resource.objects.all(), fields)]
+        output = ''.join(write_export(CSVWriter(), fields, get_values(Resource.objects.all(), fields),
+                                      formatters=formatters))
+        self.assertEqual(output, ''.join(write_export(CSVWriter(), fields, rows)))
+
+
+class RelationColumnsTest(TestCase):
+
+    def test_same_values(self):
+        set_resource = SetResource.objects.create(name='All')
+        set_resource.resources = Resource.objects.all()
+        SetResource.objects.create(name='Empty')
+        Resource.objects.all()[0].owner.add(*User.objects.all())
+        columns = {SetResource: ['resources', 'resources$__$name', 'resources$__$owner$__$username',
+                                 'resources$__$resource_type$__$name', 'resources$__$status',
+                                 'resources$__$computerresource$__$url', 'name'],
+                   Resource: ['owner', 'owner$__$username', 'setresource$__$name',
+                              'computerresource', 'resource_type$__$name']}
+        for model, fields in columns.items():
+            object_list = model.objects.order_by('pk')
+            rows = [[get_value_from_object(obj, field_name) for field_name in fields]
+                    for obj in object_list]
+            self.assertEqual([[get_parser_value(value) for value in row]
+                              for row in get_values(object_list, fields, chunk_size=2)],
+                             [[get_parser_value(value) for value in row] for row in rows])
+        self.assertEqual(get_relation_column(Resource, 'resource_type$__$name'), None)
+        self.assertEqual(get_relation_column(Resource, 'name'), None)
+
+    def test_queries(self):
+        SetResource.objects.create(name='All').resources = Resource.objects.all()
+        fields = ['name', 'owner$__$username', 'setresource$__$resources$__$name']
+        relation_column = get_relation_column(Resource, fields[-1])
+        self.assertEqual(len(relation_column.hops), 2)
+        self.assertNumQueries(4, lambda: list(get_values(Resource.objects.all(), fields)))
+
+    def test_nested_hops(self):
+        set_resource = SetResource.objects.create(name='All')
+        set_resource.resources = Resource.objects.all()
+        relation_column = get_relation_column(Resource, 'setresource$__$resources$__$name')
+        pks = [Resource.objects.all()[0].pk]
+        connection.use_debug_cursor = True
+        try:
+            connection.queries = []
+            values = relation_column.get_values(pks)
+            self.assertEqual(len(connection.queries), 2)
+            # The second hop filters by a subquery of the first one
+            self.assertEqual(connection.queries[1]['sql'].count('SELECT'), 2)
+        finally:
+            connection.use_debug_cursor = None
+        self.assertEqual(sorted(values[pks[0]]),
+                         sorted([resource.name for resource in Resource.objects.all()]))
+
+
+class ResourceUrlApi(ReportApi):
+
+    def get_absolute_url(self, obj):
+        return '/resources/%s/' % obj.pk
+
+
+class ExportContextTest(TestCase):
+
+    def test_function_columns(self):
+        api = ResourceUrlApi(Resource)
+        fields = ['name', 'get_absolute_url', '__unicode__']
+        Site.objects.clear_cache()
+        self.assertNumQueries(2, lambda: list(get_values(Resource.objects.all(), fields, api=api)))
+        domain = Site.objects.get_current().domain
+        self.assertEqual(list(get_values(Resource.objects.all(), fields, api=api)),
+                         [[resource.name, 'http://%s/resources/%s/' % (domain, resource.pk),
+                           unicode(resource)] for resource in Resource.objects.all()])
+        self.assertEqual([get_value_from_object(resource, 'get_absolute_url', api=api)
+                          for resource in Resource.objects.all()],
+                         ['http://%s/resources/%s/' % (domain, resource.pk)
+                          for resource in Resource.objects.all()])
+
+    def test_middleware(self):
+        context = ExportContext()
+        prepared = context.get_middleware(add_domain)
+        self.assertTrue(context.get_middleware(add_domain) is prepared)
+        self.assertEqual(prepared('/a/'), 'http://%s/a/' % Site.objects.get_current().domain)
+        self.assertEqual(context.get('key', lambda: 1), 1)
+        self.assertEqual(context.get('key', lambda: 2), 1)
+
+
+def count_owners_bulk(objects):
+    counts = dict(Resource.owner.through.objects.filter(resource__in=objects)
+                  .values_list('resource').annotate(count=Count('user')))
+    return [counts.get(obj.pk, 0) for obj in objects]
+
+
+class ResourceCountApi(ReportApi):
+
+    @bulk_value(count_owners_bulk)
+    def count_owners(self, obj):
+        return obj.owner.count()
+
+
+class BulkValueTest(TestCase):
+
+    def test_bulk_value(self):
+        api = ResourceCountApi(Resource)
+        fields = ['name', 'count_owners']
+        object_list = Resource.objects.all()
+        expected = [[resource.name, resource.owner.count()] for resource in object_list]
+        self.assertNumQueries(2, lambda: list(get_values(object_list, fields, api=api, chunk_size=10)))
+        self.assertEqual(list(get_values(object_list, fields, api=api, chunk_size=3)), expected)
+
+    def test_fallback(self):
+        def count_owners(obj):
+            return obj.owner.count()
+        count_owners.bulk_value = lambda objects: None
+        object_list = Resource.objects.all()
+        self.assertEqual(list(get_values(object_list, [count_owners])),
+                         [[resource.owner.count()] for resource in object_list])
+
+
+class ParallelExportTest(TestCase):
+
+    fields = ['name', 'status', 'owner$__$username', 'resource_type$__$name']
+
+    def test_shards(self):
+        for ordering in ('pk', '-pk'):
+            object_list = Resource.objects.order_by(ordering)
+            shards = get_shards(object_list, 3, min_rows=1)
+            self.assertEqual(len(shards), 3)
+            self.assertEqual([obj.pk for shard in shards for obj in shard],
+                             [obj.pk for obj in object_list])
+        self.assertEqual(get_shards(Resource.objects.order_by('pk'), 3), None)
+        self.assertEqual(get_shards(Resource.objects.order_by('name'), 3, min_rows=1), None)
+        self.assertEqual(get_shards(Resource.objects.order_by('pk'), 1, min_rows=1), None)
+
+    def test_only_main_thread(self):
+        api = ReportApi(Resource)
+        api.export_processes = 4
+        self.assertEqual(get_export_processes(api), 4)
+        processes = []
+        thread = threading.Thread(target=lambda: processes.append(get_export_processes(api)))
+        thread.start()
+        thread.join()
+        self.assertEqual(processes, [1])
+
+    def test_same_output(self):
+        object_list = Resource.objects.order_by('pk')
+        formatters = get_column_formatters(Resource, self.fields)
+        serial = ''.join(write_export(CSVWriter(), self.fields,
+                                      get_values(object_list, self.fields),
+                                      formatters=formatters))
+        shards = get_shards(object_list, 2, min_rows=1)
+        self.assertEqual(''.join(write_parallel_export(CSVWriter, self.fields, shards, self.fields,
+                                                       formatters=formatters)),
+                         serial)
+
+
+class CompiledReportTest(TestCase):
+
+    def setUp(self):
+        clear_compiled_reports()
+
+    def test_compiled_once(self):
+        report = Report.objects.create(name='Resources', content_type=ContentType.objects.get_for_model(Resource),
+                                       options={'status': {'display': True, 'filters': ['exact'], 'order': 1},
+                                                'name': {'filters': ['icontains'], 'order': 0}})
+        compiled_report = get_compiled_report(report)
+        self.assertEqual([field_name for field_name, opts in compiled_report.fields], ['name', 'status'])
+        adaptors = compiled_report.get_adaptors(report)
+        self.assertEqual([adaptor.field_name for adaptor in adaptors], ['name', 'status'])
+        self.assertTrue(adaptors[0].instance is report)
+        self.assertEqual(compiled_report.filter_fields, ('name__icontains', 'status__exact'))
+        self.assertEqual(report.report_display_fields_tuple, ('status', ))
+        loaded_report = Report.objects.get(pk=report.pk)
+        self.assertNumQueries(0, lambda: get_compiled_report(loaded_report))
+        self.assertTrue(get_compiled_report(loaded_report) is compiled_report)
+        # The options are dumped once by report
+        old_get_options_hash = utils.get_options_hash
+        utils.get_options_hash = None
+        try:
+            self.assertTrue(get_compiled_report(loaded_report) is compiled_report)
+        finally:
+            utils.get_options_hash = old_get_options_hash
+        # The changes in place are seen when the report is saved
+        report.options['status']['display'] = False
+        self.assertTrue(get_compiled_report(report) is compiled_report)
+        report.save()
+        self.assertFalse(get_compiled_report(report) is compiled_report)
+        self.assertEqual(report.report_display_fields_tuple, ())
+        report.options = {'status': {'display': True, 'order': 0}}
+        self.assertEqual(report.report_display_fields_tuple, ('status', ))
+        # The compiled report has its own copy of the options
+        self.assertEqual(compiled_report.get_options('status')['display'], True)
+        self.assertFalse(hasattr(compiled_report, 'report'))
+
+    def test_api_functions(self):
+        report = Report.objects.create(name='Resources', content_type=ContentType.objects.get_for_model(Resource),
+                                       options={'name': {'display': True, 'filters': ['icontains'], 'order': 0},
+                                                'count_owners': {'display': True, 'order': 1}})
+        api = ResourceCountApi(Resource)
+        self.assertEqual(report.report_display_fields_tuple, ('name', 'count_owners'))
+        self.assertEqual(report.report_filter_fields_tuple, ('name__icontains', ))
+        fields_form_filter, fields_form_display = api.get_fields_of_form(report)
+        self.assertTrue('count_owners' in fields_form_display)
+        self.assertEqual([adaptor.field_name for adaptor in get_compiled_report(report).get_adaptors(report, api)],
+                         ['name', 'count_owners'])
+
+    def test_lru(self):
+        content_type = ContentType.objects.get_for_model(Resource)
+        # New instances every time, like the reports loaded by every request
+        get_report = lambda pk: Report(pk=pk, content_type=content_type, options={'name': {}})
+        max_compiled_reports = utils.MAX_COMPILED_REPORTS
+        utils.MAX_COMPILED_REPORTS = 2
+        try:
+            compiled_reports = [get_compiled_report(get_report(pk)) for pk in range(2)]
+            get_compiled_report(get_report(0))
+            get_compiled_report(get_report(2))
+            self.assertTrue(get_compiled_report(get_report(0)) is compiled_reports[0])
+            self.assertFalse(get_compiled_report(get_report(1)) is compiled_reports[1])
+        finally:
+            utils.MAX_COMPILED_REPORTS = max_compiled_reports
+
+
+class ReportMetadataTest(TestCase):
+
+    def test_metadata(self):
+        report = Report.objects.create(name='Resources', content_type=ContentType.objects.get_for_model(Resource),
+                                       options={'status': {'display': True, 'filters': ['exact', 'in']},
+                                                'name': {'display': True, 'filters': ['icontains']},
+                                                'amount': {'display': False}})
+        self.assertEqual((report.column_count, report.filter_count), (2, 3))
+        self.assertEqual(report.options_hash, get_options_hash(report)[0])
+        report.options['amount']['display'] = True
+        report.save()
+        listed_report = Report.objects.defer('options').get(pk=report.pk)
+        self.assertNumQueries(0, lambda: (listed_report.name, listed_report.column_count,
+                                          listed_report.filter_count, listed_report.options_hash))
+        self.assertEqual(listed_report.column_count, 3)
+        self.assertEqual(listed_report.options_hash, report.options_hash)
+
+    def test_record_run(self):
+        report = Report.objects.create(name='Resources', content_type=ContentType.objects.get_for_model(Resource),
+                                       options={'name': {'display': True}})
+        content = record_report_run(report, iter(['a,b\r\n', '1,2\r\n']))
+        self.assertEqual(Report.objects.get(pk=report.pk).run_count, 0)
+        self.assertEqual(''.join(content), 'a,b\r\n1,2\r\n')
+        saved_report = Report.objects.get(pk=report.pk)
+        self.assertEqual(saved_report.run_count, 1)
+        self.assertTrue(saved_report.last_run is not None)
+        self.assertTrue(saved_report.last_run_seconds >= 0)
+        content = iter(['a,b\r\n'])
+        self.assertTrue(record_report_run(None, content) is content)
+
+
+class ExcelSheetsTest(TestCase):
+
+    def test_split_sheets(self):
+        writer = ListSpreadsheetWriter(max_rows=3)
+        rows = [[i, u'row %s' % i] for i in range(5)]
+        list(write_export(writer, ['number', 'name'], rows, rows_per_chunk=2))
+        self.assertEqual([(title, len(sheet_rows)) for title, sheet_rows in writer.workbook],
+                         [(u'Sheet 1', 3), (u'Sheet 2', 3), (u'Sheet 3', 2)])
+        self.assertEqual(writer.workbook[1][1][0], [u'number', u'name'])
+
+
+class ColumnarFormatTest(TestCase):
+
+    def test_round_trip(self):
+        columns = [u'name', 'number', 'price', 'created', 'modified', 'available']
+        rows = [[u'Dive into Python \xf1', 1, decimal.Decimal('1.5'), datetime.date(2006, 2, 17),
+                 datetime.datetime(2011, 3, 1, 10, 30, 0, 5), True],
+                [None, None, 2, None, None, False],
+                [u'', 2 ** 40, None, datetime.date(1960, 1, 1), None, None]]
+        output = ''.join(write_export(ColumnarWriter(row_group_size=2), columns, rows))
+        read_columns, read_rows = read_columnar(StringIO(output))
+        self.assertEqual(read_columns, [u'name', u'number', u'price', u'created', u'modified', u'available'])
+        self.assertEqual(list(read_rows),
+                         [[u'Dive into Python \xf1', 1, 1.5, datetime.date(2006, 2, 17),
+                           datetime.datetime(2011, 3, 1, 10, 30, 0, 5), True],
+                          [None, None, 2.0, None, None, False],
+                          [u'', 2 ** 40, None, datetime.date(1960, 1, 1), None, None]])